@@ -1,26 +1,13 @@
-import asyncio
-import math
-import math
-import os.path
-import pickle
 from itertools import groupby
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 
 from smolagents import Tool
 
-from bm25Tool.build_document_index import read_file_content
-from bm25Tool.load_build_retriever_file import load_or_build_retriever_state
-from bm25Tool.query_bm25 import query_bm25_tool
-from config_reader import get_base_directory, get_output_dir, get_retriever_file, get_bm25_parameters
-from converter import Document
-from converter.clean_text import clean_text
-
-BASE_DIR: str = get_base_directory()
-CONFIG_PATH: str = os.path.join(BASE_DIR, "config.ini")
-output_path: str = os.path.join(BASE_DIR, get_output_dir(CONFIG_PATH))
-retriever_file: str = os.path.join(BASE_DIR, get_retriever_file(CONFIG_PATH))
-
-b, k1 = get_bm25_parameters(CONFIG_PATH)
+from bm25Tool.metrics import metrics
+from bm25Tool.print_result import other_locations
+from bm25Tool.query_engine import BM25Engine, get_engine
+from bm25Tool.retrieval_client import RetrievalClient
+from converter.Document import Document
 
 
 class BM25Tool(Tool):
@@ -46,52 +33,45 @@ class BM25Tool(Tool):
     }
     output_type = "string"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, server_address: Optional[str] = None, **kwargs):
+        """
+        :param server_address: "host:port" of a running retrieval server. When given, queries are sent to the
+            server instead of being scored in-process.
+        """
         super().__init__(*args, **kwargs)
-        self.output_dir = output_path
-        self.retriever_file = retriever_file
-        self.documents = []
-        self.avgdl = 0
-        self.N = 0
-        self.term_document_freq = {}
-        self.k1 = k1
-        self.b = b
-        self.is_initialized = False
-        self.load_retriever_state()
+        self.engine: Union[BM25Engine, RetrievalClient] = (RetrievalClient.from_address(server_address)
+                                                           if server_address else get_engine())
         self.is_initialized = True
 
     def load_retriever_state(self):
         """
-        Retrieves the current state of the bm25_retriever.
+        Reloads the state of the bm25_retriever into the shared engine. The server owns its index in client mode.
         :return:
         """
-        if os.path.exists(self.retriever_file):
-            with open(self.retriever_file, "rb") as file:
-                state = pickle.load(file)
-                self.documents = state.get("documents", [])
-                self.avgdl = state.get("avgdl", 0)
-                self.N = state.get("N", 0)
-                self.term_document_freq = state.get("term_document_freq", {})
+        if isinstance(self.engine, BM25Engine):
+            self.engine.load()
 
-    @staticmethod
-    def bm25_score(query: str)-> List[Tuple[Document, float]]:
+    def bm25_score(self, query: str)-> List[Tuple[Document, float]]:
         """
         Calculates the bm25 score for a document in relevance to the query.
         :param query: User input (question or request).
         :return: returns a list of Tuple containing the document and its score
         """
-        doc_scores: List = query_bm25_tool(query)
-        return sorted(doc_scores, key=lambda x: x[1], reverse=True)
+        return self.engine.query(query)
 
     def forward(self, query: str, num_snippets: int = 5):
         return self.main(query, num_snippets)
 
     def main(self, query: str, num_snippets: int = 5):
         num_snippets = min(num_snippets, 5)
-        if not query:
+        if not query or num_snippets < 1:
             return ""
-        results = self.bm25_score(query)
-        results = results[:num_snippets]
+        results = self.engine.query(query, num_snippets)
+        with metrics.timer("format"):
+            return self._format_results(results)
+
+    def _format_results(self, results: List[Tuple[Document, float]]) -> str:
+        """Formats the results grouped by file, with the table of content of every file."""
         results.sort(key=lambda doc_: (doc_[0].metadata["filename"]))
         grouped_results = groupby(results, key=lambda  doc_: doc_[0].metadata["filename"])
 
@@ -99,12 +79,9 @@ class BM25Tool(Tool):
 
         for doc_name, group in grouped_results:
             output.append(f"============================{doc_name}============================")
-            toc_filename: str = doc_name.rsplit(".", 1)[0] + "_toc.md"
-
-            toc_file_path = os.path.join(output_path, toc_filename)
+            toc_content = self.engine.get_toc(doc_name)
 
-            if os.path.exists(toc_file_path):
-                toc_content: str = read_file_content(toc_file_path)
+            if toc_content is not None:
                 output.append("Table of Content\n")
                 output.append(toc_content)
                 output.append("\n===========\n")
@@ -112,6 +89,9 @@ class BM25Tool(Tool):
             for doc, score in group:
                 section_title = doc.metadata.get("section", "Unknown Section")
                 output.append(f"Section: {section_title}")
+                also_in: Optional[str] = other_locations(doc)
+                if also_in is not None:
+                    output.append(also_in)
                 snippet_content = "\n".join(doc.chunk_content.split("\n")[3:])
                 output.append(f"\nRelevant Snippet: \n{snippet_content}\nScore: {score:.1f}")
                 output.append("\n==============\n")
@@ -0,0 +1,261 @@
+"""bench_bm25.py"""
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from benchmarks.corpus import generate_corpus, generate_queries
+from bm25Tool.build_document_index import build_document_index
+from bm25Tool.calculate_BM25_score import k1, b
+from bm25Tool.compressed_postings import CompressedInvertedIndex
+from bm25Tool.impact_matrix import ImpactMatrix
+from bm25Tool.load_build_retriever_file import load_or_build_retriever_state
+from bm25Tool.mmap_index import get_index_path, write_mmap_index
+from bm25Tool.query_engine import BM25Engine
+from bm25Tool.rank_document import rank_documents
+from bm25Tool.toc_store import build_toc_store
+from bm25Tool.top_k import score_at_a_time
+from converter.analyzer import Analyzer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SHORT_QUERY_TERMS: int = 2
+LONG_QUERY_TERMS: int = 12
+PERCENTILES: List[int] = [50, 95, 99]
+RECALL_K: int = 5
+TIME_BUDGETS_MS: List[float] = [0.25, 1.0, 5.0]
+POSTINGS_BUDGETS: List[int] = [1000, 10000, 100000]
+# Shard counts above the number of CPUs are left out of the default sweep.
+SHARD_COUNTS: List[int] = [1, 2, 4, 8]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Returns the peak resident set size of the process in MiB, None where the platform does not report it."""
+    if resource is None:
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary(run_query: Callable[[Any], Any], queries: List[Any]) -> Dict[str, float]:
+    """
+    Runs every query once and summarizes the latencies.
+    :param run_query: Runs one query.
+    :param queries: The queries, as taken by run_query.
+    :return: The mean and the percentile latencies in milliseconds.
+    """
+    latencies: List[float] = []
+    for query in queries:
+        start: float = time.perf_counter()
+        run_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    summary: Dict[str, float] = {f"p{p}_ms": float(np.percentile(latencies, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(np.mean(latencies))
+    return summary
+
+
+def postings_summary(inverted_index: Dict[str, List], doc_lens: List[int]) -> Dict[str, Any]:
+    """
+    Compresses the postings and measures the compression ratio and the decode throughput.
+    :param inverted_index: term -> postings of (chunk id, term frequency).
+    :param doc_lens: Length of every chunk.
+    :return: The sizes in bytes, the ratios and the timings.
+    """
+    num_postings: int = sum(len(postings) for postings in inverted_index.values())
+    start: float = time.perf_counter()
+    compressed = CompressedInvertedIndex.from_inverted_index(inverted_index, doc_lens)
+    compress_seconds: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for term in compressed:
+        for _ in compressed.iter_blocks(term):
+            pass
+    decode_seconds: float = time.perf_counter() - start
+
+    pickled_bytes: int = len(pickle.dumps(inverted_index, pickle.HIGHEST_PROTOCOL))
+    array_bytes: int = num_postings * 2 * np.dtype(np.int64).itemsize
+    compressed_bytes: int = compressed.nbytes()
+    return {"postings": num_postings, "pickled_lists_bytes": pickled_bytes, "int64_arrays_bytes": array_bytes,
+            "compressed_bytes": compressed_bytes,
+            "ratio_vs_pickled_lists": pickled_bytes / compressed_bytes if compressed_bytes else None,
+            "ratio_vs_int64_arrays": array_bytes / compressed_bytes if compressed_bytes else None,
+            "bits_per_posting": 8 * compressed_bytes / num_postings if num_postings else None,
+            "compress_seconds": compress_seconds,
+            "decode_postings_per_second": num_postings / decode_seconds if decode_seconds else None}
+
+
+def recall_at_k(expected: List[Tuple[int, float]], actual: List[Tuple[int, float]], k: int) -> float:
+    """Returns the fraction of the expected top k chunk ids found in the actual top k, 1.0 when nothing is expected."""
+    expected_ids: Set[int] = {chunk_id for chunk_id, _ in expected[:k]}
+    if not expected_ids:
+        return 1.0
+    return len(expected_ids & {chunk_id for chunk_id, _ in actual[:k]}) / len(expected_ids)
+
+
+def approximate_summary(matrix: ImpactMatrix, analyzer: Analyzer, queries: List[str], k: int) -> Dict[str, Any]:
+    """
+    Runs the score-at-a-time approximate ranking at every time and postings budget.
+    :param matrix: The impact matrix of the engine.
+    :param analyzer: The analyzer of the engine.
+    :param queries: The queries.
+    :param k: Number of results.
+    :return: The mean recall@k against the exhaustive ranking and the latencies, keyed by budget.
+    """
+    queries_terms: List[List[str]] = [analyzer.analyze(query) for query in queries]
+    expected: List[List[Tuple[int, float]]] = [matrix.rank(query_terms, k) for query_terms in queries_terms]
+    matrix.impact_ordered()
+    budgets: Dict[str, Dict[str, Any]] = {}
+    for name, budget in ([(f"time_{ms}ms", {"time_budget": ms / 1000}) for ms in TIME_BUDGETS_MS]
+                         + [(f"postings_{count}", {"max_postings": count}) for count in POSTINGS_BUDGETS]):
+        rankings: List[List[Tuple[int, float]]] = []
+        summary: Dict[str, Any] = latency_summary(
+            lambda query_terms: rankings.append(score_at_a_time(matrix, query_terms, k, **budget)), queries_terms)
+        summary[f"recall_at_{k}"] = float(np.mean([recall_at_k(exact, ranked, k)
+                                                   for exact, ranked in zip(expected, rankings)]))
+        budgets[name] = summary
+    return budgets
+
+
+def shard_summary(retriever_file: str, output_dir: str, query_sets: Dict[str, List[str]],
+                  shard_counts: List[int]) -> Dict[str, Any]:
+    """
+    Measures the exhaustive top-5 latency of the engine scattering queries to every number of shards.
+    :return: The number of CPUs and the latencies of every query set by shard count, 1 is the unsharded engine.
+    """
+    latencies: Dict[str, Any] = {}
+    for shards in shard_counts:
+        engine = BM25Engine(retriever_file, output_dir, cache_size=0, reload_interval=0, shards=shards)
+        try:
+            latencies[str(shards)] = {name: latency_summary(lambda query: engine.query(query, 5), queries)
+                                      for name, queries in query_sets.items()}
+        finally:
+            engine.close()
+    return {"cpu_count": os.cpu_count(), "shards": latencies}
+
+
+def git_revision() -> Optional[str]:
+    """Returns the checked out commit so results can be compared between commits, None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(work_dir: str, num_files: int, num_sections: int, vocab_size: int, skew: float,
+                   num_queries: int, seed: int = 0, shard_counts: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Builds, loads and queries an index of a synthetic corpus.
+    :param work_dir: Scratch directory for the corpus and the index files.
+    :param num_files: Number of markdown files.
+    :param num_sections: Number of sections per file.
+    :param vocab_size: Number of distinct words.
+    :param skew: Zipf exponent of the word distribution.
+    :param num_queries: Number of short and of long queries.
+    :param seed: Corpus random seed.
+    :param shard_counts: Shard counts of the sharded engine sweep, the SHARD_COUNTS up to the number of CPUs when None.
+    :return: The results, see the keys of the returned dictionary.
+    """
+    input_dir: str = os.path.join(work_dir, "data")
+    output_dir: str = os.path.join(work_dir, "output")
+    retriever_file: str = os.path.join(work_dir, "retriever.pkl")
+    os.makedirs(input_dir, exist_ok=True)
+    generate_corpus(output_dir, num_files, num_sections, vocab_size=vocab_size, skew=skew, seed=seed)
+    results: Dict[str, Any] = {
+        "config": {"num_files": num_files, "num_sections": num_sections, "vocab_size": vocab_size, "skew": skew,
+                   "num_queries": num_queries, "seed": seed, "k1": k1, "b": b},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "commit": git_revision()},
+    }
+
+    start: float = time.perf_counter()
+    documents, term_frequency, inverted_index = build_document_index(input_dir, output_dir)
+    build_seconds: float = time.perf_counter() - start
+    N: int = len(documents)
+    avgdl: float = sum(doc.doc_len for doc in documents) / N if N else 0
+
+    doc_lens: List[int] = [doc.doc_len for doc in documents]
+    results["postings"] = postings_summary(inverted_index, doc_lens)
+
+    start = time.perf_counter()
+    with open(retriever_file, "wb") as file:
+        pickle.dump({"documents": documents, "avgdl": avgdl, "N": N, "term_document_freq": term_frequency,
+                     "inverted_index": CompressedInvertedIndex.from_inverted_index(inverted_index, doc_lens)}, file)
+    write_mmap_index(get_index_path(retriever_file), documents, avgdl, inverted_index, k1, b)
+    write_seconds: float = time.perf_counter() - start
+    build_toc_store(output_dir, sorted({doc.metadata["filename"] for doc in documents}), get_index_path(retriever_file))
+    results["index"] = {"chunks": N, "terms": len(inverted_index), "build_seconds": build_seconds,
+                        "chunks_per_second": N / build_seconds if build_seconds else None,
+                        "write_seconds": write_seconds, "retriever_file_bytes": os.path.getsize(retriever_file),
+                        "index_file_bytes": os.path.getsize(get_index_path(retriever_file)),
+                        "peak_rss_mb": peak_rss_mb()}
+
+    start = time.perf_counter()
+    documents, N, avgdl, term_frequency, compressed_index = load_or_build_retriever_state(retriever_file)
+    pickle_load_seconds: float = time.perf_counter() - start
+    start = time.perf_counter()
+    engine = BM25Engine(retriever_file, output_dir, cache_size=0, reload_interval=0)
+    engine_load_seconds: float = time.perf_counter() - start
+    results["load"] = {"pickle_seconds": pickle_load_seconds, "engine_seconds": engine_load_seconds,
+                       "peak_rss_mb": peak_rss_mb()}
+
+    query_sets: Dict[str, List[str]] = {
+        "short": generate_queries(num_queries, SHORT_QUERY_TERMS, vocab_size, skew, seed + 1),
+        "long": generate_queries(num_queries, LONG_QUERY_TERMS, vocab_size, skew, seed + 2),
+    }
+    runners: Dict[str, Callable[[str], Any]] = {
+        "rank_documents": lambda query: rank_documents(query, documents, N, avgdl, term_frequency, inverted_index),
+        "rank_documents_compressed": lambda query: rank_documents(query, documents, N, avgdl, term_frequency,
+                                                                  compressed_index),
+        "engine": lambda query: engine.query(query, 5),
+        "engine_wand": lambda query: engine.query(query, 5, mode="wand"),
+        "engine_approximate": lambda query: engine.query(query, 5, mode="approximate"),
+    }
+    results["query"] = {name: {path: latency_summary(run_query, queries) for path, run_query in runners.items()}
+                        for name, queries in query_sets.items()}
+    results["approximate"] = {name: approximate_summary(engine.impact_matrix, engine.analyzer, queries, RECALL_K)
+                              for name, queries in query_sets.items()}
+    if shard_counts is None:
+        shard_counts = [shards for shards in SHARD_COUNTS if shards == 1 or shards <= (os.cpu_count() or 1)]
+    results["sharded"] = shard_summary(retriever_file, output_dir, query_sets, shard_counts)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexing throughput, index load time, query latency "
+                                                 "and memory on a synthetic corpus.")
+    parser.add_argument("--files", type=int, default=50, help="Number of markdown files.")
+    parser.add_argument("--sections", type=int, default=20, help="Number of sections per file.")
+    parser.add_argument("--vocab-size", type=int, default=20000, help="Number of distinct words.")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the word distribution.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of short and of long queries.")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed.")
+    parser.add_argument("--shards", type=int, nargs="+",
+                        help="Shard counts of the sharded engine sweep, 1, 2, 4 and 8 up to the number of CPUs by default.")
+    parser.add_argument("--work-dir", help="Keep the corpus and index in this directory instead of a temporary one.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        work_dir: str = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        report = run_benchmarks(work_dir, args.files, args.sections, args.vocab_size, args.skew, args.queries,
+                                args.seed, args.shards)
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,134 @@
+"""bench_near_duplicates.py"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.bench_bm25 import LONG_QUERY_TERMS, SHORT_QUERY_TERMS, git_revision, latency_summary
+from benchmarks.corpus import add_near_duplicates, generate_corpus, generate_queries
+from bm25Tool.build_document_index import build_document_index
+from bm25Tool.calculate_BM25_score import k1, b
+from bm25Tool.mmap_index import write_mmap_index
+from bm25Tool.near_duplicates import NearDuplicateIndex, snippet_text
+from bm25Tool.query_engine import BM25Engine
+from bm25Tool.toc_store import build_toc_store
+from converter.Document import Document
+
+TOP_K: int = 5
+# Results at least this similar to a better ranked result of the same query are not counted as distinct.
+DISTINCT_THRESHOLD: float = 0.8
+
+
+def distinct_results(ranked: List[Tuple[Document, float]]) -> int:
+    """Returns the number of results of a query that are not near duplicates of a better ranked one."""
+    seen = NearDuplicateIndex(DISTINCT_THRESHOLD)
+    if not ranked:
+        return 0
+    signatures = seen.signatures([snippet_text(doc.chunk_content) for doc, _ in ranked])
+    return seen.find_or_add(signatures, 0).count(None)
+
+
+def build_and_query(markdown_dir: str, work_dir: str, threshold: float,
+                    query_sets: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Indexes a directory of markdown files and queries the index.
+    :param markdown_dir: The directory of the markdown files.
+    :param work_dir: Scratch directory for the index files.
+    :param threshold: The near-duplicate threshold, 0 disables the detection.
+    :param query_sets: The queries, by name.
+    :return: The index size, the build time and the query latencies.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    input_dir: str = os.path.join(work_dir, "data")
+    os.makedirs(input_dir, exist_ok=True)
+    index_file: str = os.path.join(work_dir, "retriever.bm25idx")
+
+    start: float = time.perf_counter()
+    documents, _, inverted_index = build_document_index(input_dir, markdown_dir, near_duplicate_threshold=threshold)
+    build_seconds: float = time.perf_counter() - start
+    N: int = len(documents)
+    avgdl: float = sum(doc.doc_len for doc in documents) / N if N else 0
+    write_mmap_index(index_file, documents, avgdl, inverted_index, k1, b)
+    build_toc_store(markdown_dir, sorted({doc.metadata["filename"] for doc in documents}), index_file)
+
+    collapsed: int = sum(len(doc.metadata.get("locations", [None])) - 1 for doc in documents)
+    index_bytes: int = sum(os.path.getsize(os.path.join(work_dir, name)) for name in os.listdir(work_dir)
+                           if name.startswith("retriever."))
+    engine = BM25Engine(os.path.join(work_dir, "retriever.pkl"), markdown_dir, index_file=index_file, cache_size=0,
+                        reload_interval=0)
+    try:
+        query: Dict[str, Any] = {name: latency_summary(lambda query: engine.query(query, TOP_K), queries)
+                                 for name, queries in query_sets.items()}
+        # Top results that are near duplicates of each other crowd out distinct ones.
+        distinct: Dict[str, float] = {}
+        for name, queries in query_sets.items():
+            rankings: List[List[Tuple[Document, float]]] = [engine.query(query, TOP_K) for query in queries]
+            distinct[name] = (sum(map(distinct_results, rankings))
+                              / max(sum(len(ranked) for ranked in rankings), 1))
+    finally:
+        engine.close()
+    return {"threshold": threshold, "chunks": N, "collapsed_chunks": collapsed,
+            "postings": sum(len(postings) for postings in inverted_index.values()), "index_bytes": index_bytes,
+            "build_seconds": build_seconds, "query": query, "distinct_result_fraction": distinct}
+
+
+def run_benchmarks(markdown_dir: str, work_dir: str, thresholds: List[float], num_queries: int,
+                   seed: int = 0) -> Dict[str, Any]:
+    """
+    Compares the index built without near-duplicate detection with those built at every threshold.
+    :return: The results of every build and their reductions relative to the build without detection.
+    """
+    query_sets: Dict[str, List[str]] = {
+        "short": generate_queries(num_queries, SHORT_QUERY_TERMS, seed=seed + 1),
+        "long": generate_queries(num_queries, LONG_QUERY_TERMS, seed=seed + 2),
+    }
+    results: Dict[str, Any] = {"revision": git_revision(), "builds": []}
+    baseline: Optional[Dict[str, Any]] = None
+    for threshold in [0.0, *thresholds]:
+        build: Dict[str, Any] = build_and_query(markdown_dir, os.path.join(work_dir, f"threshold_{threshold}"),
+                                                threshold, query_sets)
+        if baseline is None:
+            baseline = build
+        else:
+            build["reduction"] = {
+                "chunks": 1 - build["chunks"] / baseline["chunks"] if baseline["chunks"] else None,
+                "index_bytes": 1 - build["index_bytes"] / baseline["index_bytes"],
+                **{f"{name}_mean_ms": 1 - build["query"][name]["mean_ms"] / baseline["query"][name]["mean_ms"]
+                   for name in query_sets}}
+        results["builds"].append(build)
+    return results
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Measure the index size and query latency reduction of "
+                                                 "near-duplicate chunk detection.")
+    parser.add_argument("--input", help="Directory of markdown files, e.g. the converted output directory. "
+                                        "A synthetic corpus with near duplicates is generated when omitted.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.9, 0.8, 0.6],
+                        help="Near-duplicate thresholds compared with the build without detection.")
+    parser.add_argument("--files", type=int, default=50, help="Number of synthetic markdown files.")
+    parser.add_argument("--sections", type=int, default=20, help="Number of sections per synthetic file.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2,
+                        help="Probability of a synthetic section to be followed by a near-duplicate copy.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of short and of long queries.")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic corpus random seed.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        work_dir: str = stack.enter_context(tempfile.TemporaryDirectory())
+        markdown_dir: str = args.input
+        if markdown_dir is None:
+            markdown_dir = os.path.join(work_dir, "markdown")
+            add_near_duplicates(generate_corpus(markdown_dir, args.files, args.sections, seed=args.seed),
+                                args.duplicate_rate, seed=args.seed)
+        report = run_benchmarks(markdown_dir, work_dir, args.thresholds, args.queries, args.seed)
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
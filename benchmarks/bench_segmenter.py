@@ -0,0 +1,156 @@
+"""bench_segmenter.py"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import nltk
+
+from benchmarks.bench_bm25 import git_revision
+from benchmarks.corpus import generate_corpus
+from bm25Tool.build_document_index import is_indexed_markdown, split_content_into_sections, split_section_into_chunks
+from bm25Tool.file_io import read_file_content
+from bm25Tool.sentence_segmenter import PunktSegmenter, RegexSegmenter
+
+# Sentences of every section of every file.
+FileSentences = List[List[List[str]]]
+
+
+def load_sections(markdown_dir: str) -> Dict[str, List[Tuple[str, str]]]:
+    """Returns the sections of every indexed markdown file of a directory, by filename."""
+    return {filename: split_content_into_sections(read_file_content(os.path.join(markdown_dir, filename)))
+            for filename in sorted(os.listdir(markdown_dir)) if is_indexed_markdown(filename)}
+
+
+def time_segmentation(segment_file: Callable[[List[str]], List[List[str]]],
+                      files: Dict[str, List[Tuple[str, str]]]) -> Tuple[FileSentences, float]:
+    """
+    Segments every file.
+    :param segment_file: Returns the sentences of every section content of one file.
+    :param files: The sections of every file.
+    :return: The sentences and the elapsed seconds.
+    """
+    start: float = time.perf_counter()
+    sentences: FileSentences = [segment_file([content for _, content in sections]) for sections in files.values()]
+    return sentences, time.perf_counter() - start
+
+
+def sentence_ends(text: str, sentences: List[str]) -> Set[int]:
+    """Returns the offsets in text where the sentences end."""
+    ends: Set[int] = set()
+    position: int = 0
+    for sentence in sentences:
+        start: int = text.find(sentence, position)
+        if start < 0:
+            continue
+        position = start + len(sentence)
+        ends.add(position)
+    return ends
+
+
+def boundary_agreement(files: Dict[str, List[Tuple[str, str]]], expected: FileSentences,
+                       actual: FileSentences) -> Dict[str, float]:
+    """Returns the precision, recall and F1 of the sentence ends of actual against those of expected."""
+    matched, expected_count, actual_count = 0, 0, 0
+    for sections, expected_file, actual_file in zip(files.values(), expected, actual):
+        for (_, content), expected_sentences, actual_sentences in zip(sections, expected_file, actual_file):
+            expected_ends: Set[int] = sentence_ends(content, expected_sentences)
+            actual_ends: Set[int] = sentence_ends(content, actual_sentences)
+            matched += len(expected_ends & actual_ends)
+            expected_count += len(expected_ends)
+            actual_count += len(actual_ends)
+    precision: float = matched / actual_count if actual_count else 1.0
+    recall: float = matched / expected_count if expected_count else 1.0
+    return {"precision": precision, "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0}
+
+
+def chunk_contents(files: Dict[str, List[Tuple[str, str]]], sentences: FileSentences) -> Counter:
+    """Returns the chunk texts the chunker builds from the given sentences."""
+    contents: Counter = Counter()
+    for (filename, sections), file_sentences in zip(files.items(), sentences):
+        for section, section_sentences in zip(sections, file_sentences):
+            metadata: Dict[str, str] = {"filename": filename, "section": section[0]}
+            contents.update(chunk.chunk_content for chunk in split_section_into_chunks(section, metadata,
+                                                                                       section_sentences))
+    return contents
+
+
+def run_benchmarks(markdown_dir: str) -> Dict[str, Any]:
+    """
+    Compares the sentence segmenters with the per-section nltk.sent_tokenize calls of the chunker before them.
+    Throughput is measured on the section contents, agreement on the sentence ends and on the chunks built.
+    :param markdown_dir: The directory of the markdown files.
+    :return: The results.
+    """
+    files: Dict[str, List[Tuple[str, str]]] = load_sections(markdown_dir)
+    total_bytes: int = sum(len(content.encode("utf-8")) for sections in files.values() for _, content in sections)
+    results: Dict[str, Any] = {"revision": git_revision(), "files": len(files),
+                               "sections": sum(len(sections) for sections in files.values()),
+                               "megabytes": total_bytes / 1024 ** 2, "segmenters": {}}
+
+    regex = RegexSegmenter()
+    segmenters: Dict[str, Callable[[List[str]], List[List[str]]]] = {
+        "sent_tokenize_per_section": lambda contents: [nltk.sent_tokenize(content, "english") for content in contents],
+        "regex_per_section": lambda contents: [regex.segment(content) for content in contents],
+        "regex_batch": regex.segment_batch,
+    }
+    try:
+        punkt: Optional[PunktSegmenter] = PunktSegmenter()
+    except LookupError as e:
+        punkt = None
+        results["punkt_error"] = str(e).strip().splitlines()[0]
+    if punkt is not None:
+        segmenters["punkt_per_section"] = lambda contents: [punkt.segment(content) for content in contents]
+        segmenters["punkt_batch"] = punkt.segment_batch
+
+    baseline: Optional[FileSentences] = None
+    baseline_chunks: Optional[Counter] = None
+    for name, segment_file in segmenters.items():
+        try:
+            sentences, seconds = time_segmentation(segment_file, files)
+        except LookupError as e:
+            results["segmenters"][name] = {"error": str(e).strip().splitlines()[0]}
+            continue
+        count: int = sum(len(section) for file_sentences in sentences for section in file_sentences)
+        report: Dict[str, Any] = {"seconds": seconds, "sentences": count,
+                                  "megabytes_per_second": results["megabytes"] / seconds if seconds else None,
+                                  "sentences_per_second": count / seconds if seconds else None}
+        chunks: Counter = chunk_contents(files, sentences)
+        if baseline is None:
+            baseline, baseline_chunks = sentences, chunks
+        else:
+            report["boundaries"] = boundary_agreement(files, baseline, sentences)
+            report["chunk_agreement"] = (sum((chunks & baseline_chunks).values())
+                                         / max(sum(chunks.values()), sum(baseline_chunks.values()), 1))
+        results["segmenters"][name] = report
+    return results
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sentence segmentation throughput and its agreement with "
+                                                 "nltk.sent_tokenize on markdown files.")
+    parser.add_argument("--input", help="Directory of markdown files, e.g. the converted output directory. "
+                                        "A synthetic corpus is generated when omitted.")
+    parser.add_argument("--files", type=int, default=50, help="Number of synthetic markdown files.")
+    parser.add_argument("--sections", type=int, default=20, help="Number of sections per synthetic file.")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic corpus random seed.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        markdown_dir: str = args.input
+        if markdown_dir is None:
+            markdown_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            generate_corpus(markdown_dir, args.files, args.sections, seed=args.seed)
+        report = run_benchmarks(markdown_dir)
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,78 @@
+"""bench_startup.py"""
+import argparse
+import json
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.bench_bm25 import git_revision
+
+DEFAULT_COMMANDS: List[List[str]] = [
+    ["-m", "bm25Reader", "summarize the text", "--top-k", "5"],
+    ["-m", "bm25Tool.query_bm25", "summarize the text", "--test"],
+    ["-c", "import agent.bm25"],
+]
+# "import time: <self us> | <cumulative us> | <indented module>"
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)")
+
+
+def time_command(arguments: List[str], runs: int) -> Dict[str, float]:
+    """
+    Runs a Python command in fresh interpreters.
+    :param arguments: The interpreter arguments, e.g. ["-m", "module", "query"].
+    :param runs: Number of runs.
+    :return: The median, minimum and maximum wall time in milliseconds.
+    """
+    timings: List[float] = []
+    for _ in range(runs):
+        start: float = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings)}
+
+
+def slowest_imports(arguments: List[str], top: int) -> List[Tuple[str, float]]:
+    """
+    Runs a Python command with -X importtime.
+    :return: The top-level packages whose modules took the longest to import, summing their own import
+        times, in milliseconds.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", *arguments], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    packages: Dict[str, float] = {}
+    for match in _IMPORT_TIME.finditer(completed.stderr):
+        package: str = match.group(2).split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(match.group(1)) / 1000
+    return [(package, round(ms, 1)) for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]]
+
+
+def run_benchmarks(commands: List[List[str]], runs: int, top: int) -> Dict[str, Any]:
+    """Measures the cold start of every command and the imports it spends the most time in."""
+    return {"revision": git_revision(), "python": sys.version.split()[0], "runs": runs,
+            "commands": {" ".join(arguments): {**time_command(arguments, runs),
+                                               "slowest_imports_ms": slowest_imports(arguments, top)}
+                         for arguments in commands}}
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold-start time of query invocations in fresh "
+                                                 "interpreters, run from the repository root.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per command.")
+    parser.add_argument("--top", type=int, default=8, help="Number of slowest top-level imports reported.")
+    parser.add_argument("--command", action="append", help="Interpreter arguments of a command to time, "
+                                                           "e.g. \"-m bm25Reader 'a query'\". Repeatable.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    commands: List[List[str]] = [shlex.split(command) for command in args.command] if args.command else DEFAULT_COMMANDS
+    report = run_benchmarks(commands, args.runs, args.top)
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
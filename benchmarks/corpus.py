@@ -0,0 +1,133 @@
+"""corpus.py"""
+import itertools
+import os
+import random
+from typing import List
+
+SYLLABLES: List[str] = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "qu", "ph", "an", "el", "or", "is", "um"]
+
+
+def make_vocabulary(vocab_size: int) -> List[str]:
+    """
+    Returns vocab_size distinct pseudo-words, the most frequent ones are the shortest like in natural text.
+    :param vocab_size: Number of words.
+    """
+    words: List[str] = []
+    for length in itertools.count(2):
+        for syllables in itertools.product(SYLLABLES, repeat=length):
+            words.append("".join(syllables))
+            if len(words) == vocab_size:
+                return words
+    return words
+
+
+class ZipfSampler:
+    """
+    Draws words with a Zipf distribution: the probability of the word of rank r is proportional to 1 / r ** skew.
+    """
+
+    def __init__(self, vocabulary: List[str], skew: float, seed: int):
+        """
+        :param vocabulary: The words ordered by rank.
+        :param skew: Zipf exponent, higher values concentrate the text on fewer words.
+        :param seed: Random seed, the same seed always draws the same words.
+        """
+        self.vocabulary: List[str] = vocabulary
+        self.cum_weights: List[float] = list(itertools.accumulate(1 / rank ** skew
+                                                                  for rank in range(1, len(vocabulary) + 1)))
+        self.random = random.Random(seed)
+
+    def words(self, count: int) -> List[str]:
+        """Draws count words."""
+        return self.random.choices(self.vocabulary, cum_weights=self.cum_weights, k=count)
+
+    def sentence(self, min_words: int = 6, max_words: int = 24) -> str:
+        """Draws a capitalized sentence ending with a period."""
+        return " ".join(self.words(self.random.randint(min_words, max_words))).capitalize() + "."
+
+
+def generate_corpus(output_dir: str, num_files: int = 50, num_sections: int = 20, paragraphs_per_section: int = 4,
+                    sentences_per_paragraph: int = 5, vocab_size: int = 20000, skew: float = 1.1,
+                    seed: int = 0) -> List[str]:
+    """
+    Writes a deterministic synthetic markdown corpus in the layout of the converted files of the output directory.
+    :param output_dir: The directory the markdown files are written to.
+    :param num_files: Number of markdown files.
+    :param num_sections: Number of "##" sections per file.
+    :param paragraphs_per_section: Number of paragraphs per section.
+    :param sentences_per_paragraph: Number of sentences per paragraph.
+    :param vocab_size: Number of distinct words.
+    :param skew: Zipf exponent of the word distribution.
+    :param seed: Random seed.
+    :return: The written file paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sampler = ZipfSampler(make_vocabulary(vocab_size), skew, seed)
+    paths: List[str] = []
+    for file_number in range(num_files):
+        lines: List[str] = [f"# Synthetic document {file_number}", ""]
+        for section_number in range(num_sections):
+            lines.append(f"## Section {section_number} {' '.join(sampler.words(3))}")
+            for _ in range(paragraphs_per_section):
+                lines.append(" ".join(sampler.sentence() for _ in range(sentences_per_paragraph)))
+                lines.append("")
+        path: str = os.path.join(output_dir, f"synthetic_{file_number:05d}.md")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines))
+        paths.append(path)
+    return paths
+
+
+def generate_queries(num_queries: int, num_terms: int, vocab_size: int = 20000, skew: float = 1.1,
+                     seed: int = 1) -> List[str]:
+    """
+    Draws deterministic queries from the corpus word distribution.
+    :param num_queries: Number of queries.
+    :param num_terms: Number of words per query.
+    :param vocab_size: Number of distinct words, the same as the corpus.
+    :param skew: Zipf exponent, the same as the corpus.
+    :param seed: Random seed, use a different one than the corpus.
+    """
+    sampler = ZipfSampler(make_vocabulary(vocab_size), skew, seed)
+    return [" ".join(sampler.words(num_terms)) for _ in range(num_queries)]
+
+
+def add_near_duplicates(paths: List[str], duplicate_rate: float = 0.2, edit_rate: float = 0.03,
+                        boilerplate_every: int = 5, seed: int = 0) -> int:
+    """
+    Adds the near-duplicate text of converted PDFs to corpus files: repeated page headers and footers
+    differing in their page number, and sections copied from other files with a few words replaced.
+    :param paths: The markdown files, see generate_corpus.
+    :param duplicate_rate: Probability of a section to be followed by a copy of a section of another file.
+    :param edit_rate: Fraction of the words of a copy that are replaced.
+    :param boilerplate_every: A header and footer section is added every this many sections, 0 for none.
+    :param seed: Random seed.
+    :return: The number of sections added.
+    """
+    rng = random.Random(seed)
+    sections_by_file: List[List[str]] = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            head, *sections = file.read().split("\n## ")
+        sections_by_file.append([head] + ["## " + section for section in sections])
+    added: int = 0
+    for file_number, (path, sections) in enumerate(zip(paths, sections_by_file)):
+        output: List[str] = [sections[0]]
+        for section_number, section in enumerate(sections[1:], 1):
+            output.append(section)
+            if boilerplate_every and section_number % boilerplate_every == 0:
+                output.append(f"## Page {section_number} header\nQuarterly report of the synthetic corporation. "
+                              f"Confidential, do not distribute outside of the organization. Page {section_number} "
+                              f"of {len(sections) - 1}, printed from the document management system.\n")
+                added += 1
+            if len(paths) > 1 and rng.random() < duplicate_rate:
+                other: List[str] = sections_by_file[rng.choice([i for i in range(len(paths)) if i != file_number])]
+                title, _, body = rng.choice(other[1:]).partition("\n")
+                words: List[str] = body.split(" ")
+                for i in rng.sample(range(len(words)), int(len(words) * edit_rate)):
+                    words[i] = rng.choice(words)
+                output.append(f"{title} (copy)\n{' '.join(words)}")
+                added += 1
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(output))
+    return added
@@ -0,0 +1,10 @@
+"""
+Query-only entry point to the BM25 index.
+It imports the index, scoring and client code only; document conversion and indexing are imported
+when a missing index has to be built.
+"""
+from bm25Tool.query_engine import BM25Engine, get_engine
+from bm25Tool.retrieval_client import RetrievalClient
+from settings import Settings, get_settings
+
+__all__ = ["BM25Engine", "RetrievalClient", "Settings", "get_engine", "get_settings"]
@@ -0,0 +1,38 @@
+"""__main__.py"""
+import argparse
+import json
+from typing import List, Tuple, Union
+
+from bm25Tool.print_result import print_results
+from bm25Tool.query_engine import QUERY_MODES, BM25Engine
+from bm25Tool.retrieval_client import RetrievalClient
+from converter.Document import Document
+from settings import get_settings
+
+DEFAULT_TOP_K: int = 5
+
+
+def main() -> None:
+    """Answers one query from the index, or from a running retrieval server, and prints the results."""
+    parser = argparse.ArgumentParser(prog="python -m bm25Reader", description="Query the BM25 index.")
+    parser.add_argument("query", help="The search query.")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Number of results.")
+    parser.add_argument("--mode", choices=QUERY_MODES, default="exhaustive", help="Query mode of the engine.")
+    parser.add_argument("--server", help="\"host:port\" of a running retrieval server to send the query to.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--full", action="store_true", help="Print the full snippets.")
+    args = parser.parse_args()
+
+    engine: Union[BM25Engine, RetrievalClient] = (RetrievalClient.from_address(args.server) if args.server
+                                                  else BM25Engine(reload_interval=0))
+    results: List[Tuple[Document, float]] = (engine.query(args.query, args.top_k) if args.server
+                                             else engine.query(args.query, args.top_k, args.mode))
+    if args.json:
+        print(json.dumps([{"score": score, "metadata": doc.metadata, "chunk_content": doc.chunk_content}
+                          for doc, score in results]))
+    else:
+        print_results(results, get_settings().output_dir, args.full, engine.get_toc)
+
+
+if __name__=="__main__":
+    main()
@@ -2,69 +2,101 @@
 import logging
 import os
 import re
-from typing import List, Dict, Set, Any, Tuple, Optional
-
-import docx
-import nltk
-import pymupdf4llm
-
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Set, Any, Tuple, Optional, Iterable, Iterator
+
+from bm25Tool.file_io import read_file_content
+from bm25Tool.inverted_index import InvertedIndex, add_postings
+from bm25Tool.metrics import metrics
+from bm25Tool.near_duplicates import NearDuplicateIndex, collapse_duplicate, get_near_duplicate_threshold, snippet_text
+from bm25Tool.sentence_segmenter import get_segmenter
 from bm25Tool.setup_logger import setup_logger
-from config_reader import get_output_dir, get_base_directory, get_data_dir, get_chunk_size
-from converter.Document import Document
+from converter.Document import METADATA, Document
+from settings import get_settings, read_config
 
-BASE_DIR = get_base_directory()
+BASE_DIR = get_settings().base_dir
 
-CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
-DATA_PATH = os.path.join(BASE_DIR, get_data_dir(CONFIG_PATH))
-OUTPUT_PATH = os.path.join(BASE_DIR, get_output_dir(CONFIG_PATH))
+CONFIG_PATH = get_settings().config_path
+DATA_PATH = get_settings().data_dir
+OUTPUT_PATH = get_settings().output_dir
 LOG_PATH = os.path.join(BASE_DIR, 'logs/build_document.log')
 
 FILE_TYPES: Set[str] = {".pdf", ".docx"}
-chunk_size = get_chunk_size(CONFIG_PATH)
+chunk_size = get_settings().chunk_size
 
 logger: logging.Logger = setup_logger(__file__)
 
 
 def _convert_pdf_to_markdown(input_path: str, output_path: str) -> None:
-    """Asynchronously converts PDF to Markdown using pymupdf4llm."""
-    try:
-        markdown_text: str = pymupdf4llm.to_markdown(input_path)
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(markdown_text)
-        logger.info(f"Successfully converted PDF: {input_path} to {output_path}")
-    except FileNotFoundError as e:
-        logger.error(f"PDF file not found: {input_path}. Error: {e}")
-    except Exception:
-        logger.exception(f"An unexpected error occurred during PDF conversion: {input_path}")
+    """Converts PDF to Markdown using pymupdf4llm, imported on first use as it is slow to load."""
+    import pymupdf4llm
+    markdown_text: str = pymupdf4llm.to_markdown(input_path)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(markdown_text)
 
 def _convert_docx_to_markdown(input_path: str, output_path: str) -> None:
-    """Asynchronously converts DOCX to Markdown."""
+    """Converts DOCX to Markdown using python-docx, imported on first use."""
+    import docx
+    doc = docx.Document(input_path)
+    markdown_text = ""
+    for paragraph in doc.paragraphs:
+        markdown_text += paragraph.text + "\n"
+    with open(output_path, "w", encoding="utf-8") as f: #Include encoding
+        f.write(markdown_text)
+
+def _convert_file(input_path: str, output_path: str) -> Tuple[str, Optional[str]]:
+    """
+    Converts a single file without logging, so it can run in a pool process.
+    Errors are isolated to the file and returned to the caller to be logged.
+
+    Returns:
+        ("ok", None), ("not_found", error message) or ("error", formatted traceback).
+    """
     try:
-        doc = docx.Document(input_path)
-        markdown_text = ""
-        for paragraph in doc.paragraphs:
-            markdown_text += paragraph.text + "\n"
-        with open(output_path, "w", encoding="utf-8") as f: #Include encoding
-            f.write(markdown_text)
-        logger.info(f"Successfully converted DOCX: {input_path} to {output_path}")
+        if input_path.lower().endswith(".pdf"):
+            _convert_pdf_to_markdown(input_path, output_path)
+        elif input_path.lower().endswith(".docx"):
+            _convert_docx_to_markdown(input_path, output_path)
+        return "ok", None
     except FileNotFoundError as e:
-        logger.error(f"DOCX file not found: {input_path}. Error: {e}")
+        return "not_found", str(e)
     except Exception:
-        logger.exception(f"An unexpected error occurred during DOCX conversion: {input_path}")
+        return "error", traceback.format_exc()
+
+def _log_conversion(input_path: str, output_path: str, status: str, detail: Optional[str]) -> None:
+    """Logs the outcome of a file conversion."""
+    file_type: str = os.path.splitext(input_path)[1].lstrip(".").upper()
+    if status == "ok":
+        logger.info(f"Successfully converted {file_type}: {input_path} to {output_path}")
+    elif status == "not_found":
+        logger.error(f"{file_type} file not found: {input_path}. Error: {detail}")
+    else:
+        logger.error(f"An unexpected error occurred during {file_type} conversion: {input_path}\n{detail}")
+
+def get_conversion_workers(config_path: str) -> int:
+    """Reads the number of conversion processes from the [indexing] section, defaults to the CPU count."""
+    config = read_config(config_path)
+    return config.getint("indexing", "conversion_workers", fallback=os.cpu_count() or 1)
 
 def convert_files_to_markdown(
-    input_dir: str, output_dir: str, file_extensions: Set[str]
+    input_dir: str, output_dir: str, file_extensions: Set[str], filenames: Optional[Set[str]] = None,
+    workers: Optional[int] = None
 ) -> Dict[str, str]:
     """
-    Asynchronously converts files with specified extensions to Markdown.
+    Converts files with specified extensions to Markdown.
+    With more than one worker the files are converted in a process pool; a failing file is logged
+    and does not stop the others.
 
     Args:
         input_dir: Path to the input directory.
         output_dir: Path to the output directory.
         file_extensions: Set of file extensions to convert (e.g., {'.pdf', '.docx'}).
+        filenames: Only convert these filenames of the input directory, all files when None.
+        workers: Number of conversion processes, conversion_workers from config.ini when None.
 
     Returns:
-        A dictionary mapping input file paths to output file paths.
+        A dictionary mapping input file paths to output file paths, ordered by input filename.
 
     Raises:
         FileNotFoundError: If the input directory does not exist.
@@ -78,17 +110,25 @@ def convert_files_to_markdown(
         os.makedirs(output_dir, exist_ok=True)
         converted_files: Dict[str, str] = {}
 
-        for filename in os.listdir(input_dir):
+        for filename in sorted(os.listdir(input_dir)):
+            if filenames is not None and filename not in filenames:
+                continue
             if any(filename.lower().endswith(ext) for ext in file_extensions):
                 input_filepath: str = os.path.join(input_dir, filename)
                 output_filename: str = os.path.splitext(filename)[0] + ".md"
-                output_filepath: str = os.path.join(output_dir, output_filename)
-
-                if filename.lower().endswith(".pdf"):
-                    _convert_pdf_to_markdown(input_filepath, output_filepath)
-                elif filename.lower().endswith(".docx"):
-                    _convert_docx_to_markdown(input_filepath, output_filepath)
-                converted_files[input_filepath] = output_filepath
+                converted_files[input_filepath] = os.path.join(output_dir, output_filename)
+
+        workers = get_conversion_workers(CONFIG_PATH) if workers is None else workers
+        with metrics.timer("convert"):
+            if workers > 1 and len(converted_files) > 1:
+                with ProcessPoolExecutor(max_workers=min(workers, len(converted_files))) as executor:
+                    outcomes = executor.map(_convert_file, converted_files.keys(), converted_files.values())
+                    for (input_filepath, output_filepath), (status, detail) in zip(converted_files.items(), outcomes):
+                        _log_conversion(input_filepath, output_filepath, status, detail)
+            else:
+                for input_filepath, output_filepath in converted_files.items():
+                    _log_conversion(input_filepath, output_filepath, *_convert_file(input_filepath, output_filepath))
+        metrics.increment("files_converted", len(converted_files))
 
         return converted_files
 
@@ -102,30 +142,53 @@ def convert_files_to_markdown(
         logger.exception("An unexpected error occurred:") #log full stack trace
         raise
 
-def build_document_index(input_dir: str, output_dir: str) -> Tuple[List, Dict]:
-    """ Asynchronously builds an index of Markdown documents from specified file types."""
+def build_document_index(input_dir: str, output_dir: str,
+                         near_duplicate_threshold: Optional[float] = None) -> Tuple[List, Dict, InvertedIndex]:
+    """
+    Builds an index of Markdown documents from specified file types.
+
+    With a near-duplicate threshold, a chunk similar enough to an earlier chunk is not indexed,
+    its location is added to the "locations" metadata of the earlier chunk, see near_duplicates.
+    The threshold is near_duplicate_threshold from config.ini when None, 0 disables the detection.
+
+    Returns:
+        The chunk documents, the document frequency of every term and the inverted index
+        mapping every term to its postings of (chunk id, term frequency).
+    """
     try:
         converted_docs: Dict[str, str] = convert_files_to_markdown(input_dir, output_dir, FILE_TYPES)
         documents: List[Document] = []
         term_frequency: Dict[str,int|Any] = {}
+        inverted_index: InvertedIndex = {}
+        threshold: float = (get_near_duplicate_threshold(CONFIG_PATH) if near_duplicate_threshold is None
+                            else near_duplicate_threshold)
+        duplicates: Optional[NearDuplicateIndex] = NearDuplicateIndex(threshold) if threshold else None
 
 
         for filename in os.listdir(output_dir):
-            if filename.lower().endswith(".md") and not filename.lower().endswith("_toc.md"):
-                filepath: str = os.path.join(output_dir, filename)
-                content: str =  read_file_content(filepath)
-                sections = split_content_into_sections(content)
-                for section_title, section_content in sections:
-                    metadata: Dict[str, str] = {"filename": filename, "section": section_title}
-                    chunks: List[Document] = split_section_into_chunks((section_title, section_content), metadata)
-
-                    for chunk in chunks:
-                        chunk.update_derived_attributes()
-                        unique_terms: Set[str] = {*chunk.clean_terms}
-                        for term in unique_terms:
+            if is_indexed_markdown(filename):
+                chunks: List[Document] = index_markdown_file(os.path.join(output_dir, filename), filename)
+                representatives: List[Optional[int]] = [None] * len(chunks)
+                if duplicates is not None and chunks:
+                    with metrics.timer("near_duplicates"):
+                        representatives = duplicates.find_or_add(
+                            duplicates.signatures([snippet_text(chunk.chunk_content) for chunk in chunks]),
+                            len(documents))
+                for chunk, representative in zip(chunks, representatives):
+                    if representative is not None:
+                        collapse_duplicate(documents[representative], chunk)
+                        metrics.increment("chunks_collapsed")
+                        continue
+                    with metrics.timer("index"):
+                        term_freq: Dict[str, int] = chunk.compute_term_freq()
+                        for term in term_freq:
                             term_frequency[term] = term_frequency.get(term, 0) + 1
-                    documents.extend(chunks)
-        return documents, term_frequency
+                        add_postings(inverted_index, len(documents), term_freq)
+                        chunk.drop_terms()
+                    documents.append(chunk)
+                metrics.increment("files_indexed")
+        metrics.increment("chunks_indexed", len(documents))
+        return documents, term_frequency, inverted_index
     except FileNotFoundError as e:
         logger.error(f"Input or output directory not found: {e}")
         raise
@@ -134,10 +197,40 @@ def build_document_index(input_dir: str, output_dir: str) -> Tuple[List, Dict]:
         raise
 
 
-def split_section_into_chunks(section: Tuple[str, str], metadata: Dict[str, str]) -> List[Document]:
-    """Splits a section into chunks of sentences."""
+def is_indexed_markdown(filename: str) -> bool:
+    """Returns True for the markdown files of the output directory that are indexed, TOC files are not."""
+    return filename.lower().endswith(".md") and not filename.lower().endswith("_toc.md")
+
+
+def index_markdown_file(filepath: str, filename: str) -> List[Document]:
+    """
+    Splits a markdown file into sections and the sections into chunk documents.
+    The sentences of all sections are segmented in one batch.
+    :param filepath: The path of the markdown file.
+    :param filename: The filename stored in the chunk metadata.
+    :return: The chunks of the file with their terms computed.
+    """
+    content: str = read_file_content(filepath)
+    chunks: List[Document] = []
+    with metrics.timer("section_split"):
+        sections: List[Tuple[str, str]] = split_content_into_sections(content)
+    with metrics.timer("sentence_tokenize"):
+        section_sentences: List[List[str]] = get_segmenter().segment_batch([content for _, content in sections])
+    for section, sentences in zip(sections, section_sentences):
+        metadata: Dict[str, str] = METADATA.intern({"filename": filename, "section": section[0]})
+        with metrics.timer("chunk"):
+            chunks.extend(split_section_into_chunks(section, metadata, sentences))
+    return chunks
+
+
+def split_section_into_chunks(section: Tuple[str, str], metadata: Dict[str, str],
+                              sentences: Optional[List[str]] = None) -> List[Document]:
+    """
+    Splits a section into chunks of sentences.
+    :param sentences: The sentences of the section when already segmented, see index_markdown_file.
+    """
     section_title, section_content = section
-    _sentences: List[str] = tokenize_sentences(section_content)
+    _sentences: List[str] = tokenize_sentences(section_content) if sentences is None else sentences
     _chunks: List[Document] = []
     _current_chunk: List[str] = []
     _current_length: int = 0
@@ -146,7 +239,7 @@ def split_section_into_chunks(section: Tuple[str, str], metadata: Dict[str, str]
         for sentence in _sentences:
             _sentence_length: int = len(sentence)
             if _current_length + _sentence_length > chunk_size:
-                chunk_content = f"Document: {metadata["filename"]}\nSection: {section_title}\n Snippet: {''.join(_current_chunk)}"
+                chunk_content = f"Document: {metadata['filename']}\nSection: {section_title}\n Snippet: {''.join(_current_chunk)}"
                 _chunks.append(create_document_chunk(chunk_content, metadata))
                 _current_chunk.clear()
                 _current_chunk.append(sentence)
@@ -156,7 +249,7 @@ def split_section_into_chunks(section: Tuple[str, str], metadata: Dict[str, str]
                 _current_length+=_sentence_length
 
         if _current_chunk:
-            chunk_content = f"Document: {metadata["filename"]}\nSection: {section_title}\n Snippet: {''.join(_current_chunk)}"
+            chunk_content = f"Document: {metadata['filename']}\nSection: {section_title}\n Snippet: {''.join(_current_chunk)}"
             _chunks.append(create_document_chunk(chunk_content, metadata))
 
         return _chunks
@@ -173,35 +266,29 @@ def create_document_chunk(chunk_content: str, metadata: Dict[str, str]) -> Docum
 
 
 def tokenize_sentences(text: str) -> List[str]:
-    """Tokenizes text into sentences."""
-    return nltk.sent_tokenize(text, "english")
+    """Tokenizes text into sentences with the configured segmenter, see sentence_segmenter."""
+    with metrics.timer("sentence_tokenize"):
+        return get_segmenter().segment(text)
 
 
 def split_content_into_sections(content: str) -> List[Tuple[str, str]]:
     """Splits content into sections based on Markdown headers (##, ***, etc.)."""
-    sections: List[Tuple[str, str]] = []
+    return list(iter_sections(content.splitlines()))
+
+
+def iter_sections(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """Yields the (title, content) sections of markdown lines one at a time, see split_content_into_sections."""
     current_section: List[str] = []
     section_title: Optional[str] = None
 
-    for line in content.splitlines():
+    for line in lines:
         match = re.match(r"^([#|*|$]+)\s*(.*)", line) # Added \s* to handle whitespace
         if match and len(match.group(1)) > 1 and len(match.group(2).strip()) >= 5:
             if current_section and section_title is not None:
-                sections.append((section_title, "\n".join(current_section[1:])))
+                yield section_title, "\n".join(current_section[1:])
                 current_section = []
             section_title = match.group(2).strip()
         current_section.append(line)
 
     if current_section and section_title is not None:
-        sections.append((section_title, "\n".join(current_section[1:])))
-    return sections
-
-
-def read_file_content(filepath: str) -> str:
-    """ Reads the content of a file. """
-    try:
-        with open(filepath, 'r', encoding="UTF-8") as file:
-            return file.read()
-    except Exception as e:
-        logger.error(f"Error reading {filepath}: {e}")
-        raise
\ No newline at end of file
+        yield section_title, "\n".join(current_section[1:])
\ No newline at end of file
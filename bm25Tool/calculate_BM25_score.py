@@ -1,16 +1,15 @@
 """calculate_BM25_score"""
 import math
-import os.path
 from typing import Dict, List
 
-from config_reader import get_bm25_parameters, get_base_directory
 from converter.Document import Document
-from converter.clean_text import clean_text
+from converter.analyzer import get_analyzer
+from settings import get_settings
 
-BASE_DIR:str = get_base_directory()
-CONFIG_PATH:str = os.path.join(BASE_DIR, "config.ini")
+BASE_DIR:str = get_settings().base_dir
+CONFIG_PATH:str = get_settings().config_path
 
-k1, b = get_bm25_parameters(CONFIG_PATH) # BM25 parameters
+k1, b = get_settings().k1, get_settings().b # BM25 parameters
 
 def calculate_bm25_score(query: str, document: Document, N: int, avgdl: float, term_frequency: Dict[str, int]) -> float:
     """
@@ -22,14 +21,30 @@ def calculate_bm25_score(query: str, document: Document, N: int, avgdl: float, t
     :param term_frequency:
     :return:
     """
-    query_terms: List[str] = clean_text(query).split()
+    query_terms: List[str] = get_analyzer().analyze(query)
+    term_freq: Dict[str, int] = document.compute_term_freq()
     score: float = 0.0
 
     for term in query_terms:
-        if term in document.term_freq:
+        if term in term_freq:
             df: int = term_frequency.get(term, 1)
-            idf: float = math.log((N - df + 0.5) / (df + 0.5) + 1)
-            tf: int = document.term_freq[term]
-            score: float = score + idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (document.doc_len / avgdl))))
+            tf: int = term_freq[term]
+            score: float = score + calculate_term_score(tf, df, document.doc_len, N, avgdl)
 
     return score
+
+
+def calculate_term_score(tf: int, df: int, doc_len: int, N: int, avgdl: float, k1: float = k1, b: float = b) -> float:
+    """
+    Calculates the BM25 contribution of a single query term to a document.
+    :param tf: Frequency of the term in the document.
+    :param df: Number of documents containing the term.
+    :param doc_len: Length of the document in terms.
+    :param N: Number of documents in the corpus.
+    :param avgdl: Average document length.
+    :param k1: Term frequency saturation, defaults to the configured value.
+    :param b: Length normalization, defaults to the configured value.
+    :return: The term score.
+    """
+    idf: float = math.log((N - df + 0.5) / (df + 0.5) + 1)
+    return idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_len / avgdl))))
@@ -0,0 +1,204 @@
+"""compressed_postings.py"""
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25Tool.inverted_index import InvertedIndex
+
+POSTINGS_BLOCK_SIZE: int = 128
+
+
+def encode_varints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes non-negative integers as LEB128 varints, 7 bits per byte with the high bit set on every byte
+    but the last one of a value.
+    :param values: The values.
+    :return: The encoded bytes and the byte length of every value.
+    """
+    values = values.astype(np.uint64, copy=False)
+    lengths: np.ndarray = np.ones(values.size, dtype=np.int64)
+    remaining: np.ndarray = values >> np.uint64(7)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(7)
+
+    encoded: np.ndarray = np.empty(int(lengths.sum()), dtype=np.uint8)
+    starts: np.ndarray = np.cumsum(lengths) - lengths
+    for position in range(int(lengths.max(initial=0))):
+        mask: np.ndarray = lengths > position
+        payload: np.ndarray = (values[mask] >> np.uint64(7 * position)) & np.uint64(0x7F)
+        more: np.ndarray = (lengths[mask] > position + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + position] = (payload | more).astype(np.uint8)
+    return encoded, lengths
+
+
+def decode_varints(encoded: np.ndarray) -> np.ndarray:
+    """
+    Decodes a run of LEB128 varints, see encode_varints.
+    :param encoded: The bytes of whole values.
+    :return: The values as int64.
+    """
+    ends: np.ndarray = np.flatnonzero(encoded < 0x80)
+    if ends.size == encoded.size:
+        return encoded.astype(np.int64)
+    starts: np.ndarray = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    value_ids: np.ndarray = np.repeat(np.arange(ends.size), ends - starts + 1)
+    shifts: np.ndarray = (7 * (np.arange(encoded.size) - starts[value_ids])).astype(np.uint64)
+    payload: np.ndarray = (encoded & 0x7F).astype(np.uint64) << shifts
+    return np.add.reduceat(payload, starts).astype(np.int64)
+
+
+class CompressedInvertedIndex(Mapping[str, List[Tuple[int, int]]]):
+    """
+    Postings compressed in blocks of POSTINGS_BLOCK_SIZE.
+
+    Every block holds the chunk id gaps followed by the term frequencies of its postings as varints.
+    The first gap of a block is taken from the last chunk id of the previous block of the term, so
+    the skip table (last chunk id and byte offset of every block) allows decoding any block on
+    its own. It reads like an InvertedIndex, decoding the postings of a term on access.
+    """
+
+    def __init__(self, terms: Dict[str, int], term_block_ptr: np.ndarray, block_offsets: np.ndarray,
+                 block_last: np.ndarray, doc_freqs: np.ndarray, doc_lens: np.ndarray, data: np.ndarray):
+        """
+        :param terms: term -> term number.
+        :param term_block_ptr: The blocks of term t are term_block_ptr[t] to term_block_ptr[t + 1].
+        :param block_offsets: The bytes of block i are data[block_offsets[i]:block_offsets[i + 1]].
+        :param block_last: The last chunk id of every block.
+        :param doc_freqs: The number of postings of every term.
+        :param doc_lens: Length of every chunk, indexed by chunk id.
+        :param data: The encoded blocks.
+        """
+        self.terms: Dict[str, int] = terms
+        self.term_block_ptr: np.ndarray = term_block_ptr
+        self.block_offsets: np.ndarray = block_offsets
+        self.block_last: np.ndarray = block_last
+        self.doc_freqs: np.ndarray = doc_freqs
+        self.doc_lens: np.ndarray = doc_lens
+        self.data: np.ndarray = data
+
+    @classmethod
+    def from_inverted_index(cls, inverted_index: InvertedIndex, doc_lens: Sequence[int],
+                            block_size: int = POSTINGS_BLOCK_SIZE) -> "CompressedInvertedIndex":
+        """
+        Compresses the postings of the retriever state.
+        :param inverted_index: term -> postings of (chunk id, term frequency), chunk ids ascending.
+        :param doc_lens: Length of every chunk, indexed by chunk id.
+        :param block_size: Number of postings per block.
+        :return: The compressed index.
+        """
+        terms: Dict[str, int] = {}
+        doc_freqs: np.ndarray = np.fromiter((len(postings) for postings in inverted_index.values()),
+                                            dtype=np.int64, count=len(inverted_index))
+        chunk_ids: np.ndarray = np.empty(int(doc_freqs.sum()), dtype=np.int64)
+        term_freqs: np.ndarray = np.empty(chunk_ids.size, dtype=np.int64)
+        position: int = 0
+        for term, postings in inverted_index.items():
+            terms[term] = len(terms)
+            if postings:
+                chunk_ids[position:position + len(postings)], term_freqs[position:position + len(postings)] = zip(*postings)
+            position += len(postings)
+
+        # Block of every posting and its position in the block.
+        term_starts: np.ndarray = np.cumsum(doc_freqs) - doc_freqs
+        term_blocks: np.ndarray = -(-doc_freqs // block_size)
+        term_block_ptr: np.ndarray = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(term_blocks, out=term_block_ptr[1:])
+        posting_terms: np.ndarray = np.repeat(np.arange(len(terms)), doc_freqs)
+        rank_in_term: np.ndarray = np.arange(chunk_ids.size) - term_starts[posting_terms]
+        posting_blocks: np.ndarray = term_block_ptr[posting_terms] + rank_in_term // block_size
+        rank_in_block: np.ndarray = rank_in_term % block_size
+
+        previous: np.ndarray = np.empty_like(chunk_ids)
+        previous[1:] = chunk_ids[:-1]
+        previous[term_starts[doc_freqs > 0]] = -1
+        gaps: np.ndarray = chunk_ids - previous
+
+        # Every block stores its gaps then its term frequencies.
+        block_sizes: np.ndarray = np.bincount(posting_blocks, minlength=int(term_block_ptr[-1]))
+        block_value_starts: np.ndarray = 2 * (np.cumsum(block_sizes) - block_sizes)
+        values: np.ndarray = np.empty(2 * chunk_ids.size, dtype=np.int64)
+        gap_slots: np.ndarray = block_value_starts[posting_blocks] + rank_in_block
+        values[gap_slots] = gaps
+        values[gap_slots + block_sizes[posting_blocks]] = term_freqs
+
+        data, lengths = encode_varints(values)
+        value_offsets: np.ndarray = np.zeros(values.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=value_offsets[1:])
+        block_offsets: np.ndarray = value_offsets[np.append(block_value_starts, values.size)]
+        block_ends: np.ndarray = np.cumsum(block_sizes) - 1
+        block_last: np.ndarray = chunk_ids[block_ends] if chunk_ids.size else np.zeros(0, dtype=np.int64)
+
+        index_dtype = np.int32 if max(data.size, len(doc_lens)) < 2 ** 31 else np.int64
+        return cls(terms, term_block_ptr.astype(index_dtype), block_offsets.astype(index_dtype),
+                   block_last.astype(index_dtype), doc_freqs.astype(index_dtype), np.asarray(doc_lens, dtype=np.int32),
+                   data)
+
+    def __getitem__(self, term: str) -> List[Tuple[int, int]]:
+        if term not in self.terms:
+            raise KeyError(term)
+        chunk_ids, term_freqs = self.postings(term)
+        return list(zip(chunk_ids.tolist(), term_freqs.tolist()))
+
+    def __contains__(self, term: object) -> bool:
+        return term in self.terms
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def decode_block(self, block: int, first_block: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Decodes one block.
+        :param block: The block number.
+        :param first_block: The first block of the block's term, the base chunk id of other blocks comes from the skip table.
+        :return: The chunk ids and term frequencies of the block.
+        """
+        values: np.ndarray = decode_varints(self.data[self.block_offsets[block]:self.block_offsets[block + 1]])
+        count: int = values.size // 2
+        base: int = -1 if block == first_block else int(self.block_last[block - 1])
+        return base + np.cumsum(values[:count]), values[count:]
+
+    def iter_blocks(self, term: str, min_chunk_id: int = 0) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Decodes the postings of a term one block at a time.
+        :param term: The term.
+        :param min_chunk_id: Blocks that end before this chunk id are skipped without decoding.
+        :return: An iterator of the (chunk ids, term frequencies) of every block.
+        """
+        term_id: Optional[int] = self.terms.get(term)
+        if term_id is None:
+            return
+        first, end = int(self.term_block_ptr[term_id]), int(self.term_block_ptr[term_id + 1])
+        start: int = first + int(np.searchsorted(self.block_last[first:end], min_chunk_id)) if min_chunk_id else first
+        for block in range(start, end):
+            yield self.decode_block(block, first)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the chunk ids and term frequencies of a term, empty arrays for an unknown term."""
+        blocks = list(self.iter_blocks(term))
+        if not blocks:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate([ids for ids, _ in blocks]), np.concatenate([tfs for _, tfs in blocks])
+
+    def term_frequency(self, term: str, chunk_id: int) -> int:
+        """Returns the frequency of a term in a chunk, decoding only the block the skip table points to."""
+        for chunk_ids, term_freqs in self.iter_blocks(term, chunk_id):
+            position: int = int(np.searchsorted(chunk_ids, chunk_id))
+            if position < chunk_ids.size and chunk_ids[position] == chunk_id:
+                return int(term_freqs[position])
+            break
+        return 0
+
+    def to_inverted_index(self) -> InvertedIndex:
+        """Decompresses the postings into an InvertedIndex that can be updated."""
+        return {term: self[term] for term in self.terms}
+
+    def nbytes(self) -> int:
+        """Returns the size of the encoded postings and the skip table in bytes."""
+        return int(self.data.nbytes + self.block_offsets.nbytes + self.block_last.nbytes
+                   + self.term_block_ptr.nbytes + self.doc_freqs.nbytes)
@@ -3,15 +3,15 @@ import os
 import os.path
 from logging import Logger
 
-from bm25Tool.build_document_index import read_file_content
+from bm25Tool.file_io import read_file_content
 from bm25Tool.gen_toc import generate_toc
 from bm25Tool.setup_logger import setup_logger
-from config_reader import get_base_directory, get_output_dir
 from converter.SaveFile import save_file_to_path
+from settings import get_settings
 
-BASE_DIR: str = get_base_directory()
-CONFIG_PATH: str = os.path.join(BASE_DIR, "config.ini")
-OUTPUT_DIRECTORY: str = os.path.join(BASE_DIR, get_output_dir(CONFIG_PATH))
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+OUTPUT_DIRECTORY: str = get_settings().output_dir
 
 
 def create_toc(output_path: str) -> None:
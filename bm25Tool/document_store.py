@@ -0,0 +1,91 @@
+"""document_store.py"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Sequence
+
+import numpy as np
+
+DEFAULT_SNIPPET_CACHE_SIZE: int = 256
+
+
+class DocumentStore:
+    """
+    Chunk text and metadata addressed by chunk id: record i is the JSON of Document.to_dict() stored at
+    data[offsets[i]:offsets[i + 1]]. Records are decoded on access and the most recent ones are kept
+    in an LRU, so only the displayed hits are ever read.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray, cache_size: int = DEFAULT_SNIPPET_CACHE_SIZE):
+        """
+        :param offsets: Start offset of every record followed by the total length.
+        :param data: The records, usually a view of a memory-mapped file.
+        :param cache_size: Number of decoded records kept.
+        """
+        self.offsets: np.ndarray = offsets
+        self.data: np.ndarray = data
+        self.get = lru_cache(maxsize=cache_size)(self._read)
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def _read(self, chunk_id: int) -> Dict[str, Any]:
+        """Decodes the record of a chunk."""
+        return json.loads(self.data[self.offsets[chunk_id]:self.offsets[chunk_id + 1]].tobytes())
+
+
+class LazyDocument:
+    """
+    A chunk of the index that reads its text and metadata from the document store on first use.
+    It answers the attributes of Document that are used to display results.
+    """
+    __slots__ = ("chunk_id", "store", "doc_len")
+
+    def __init__(self, chunk_id: int, store: DocumentStore, doc_len: int):
+        self.chunk_id: int = chunk_id
+        self.store: DocumentStore = store
+        self.doc_len: int = doc_len
+
+    @property
+    def chunk_content(self) -> str:
+        return self.store.get(self.chunk_id)["chunk_content"]
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        return self.store.get(self.chunk_id)["metadata"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns a dictionary representation of the document.
+        """
+        return {"chunk_content": self.chunk_content, "metadata": self.metadata}
+
+    def __str__(self) -> str:
+        return f"Document(content='{self.chunk_content[:50]}...', metadata={self.metadata})"
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyDocument):
+            return self.store is other.store and self.chunk_id == other.chunk_id
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.chunk_id))
+
+
+class LazyDocuments(Sequence[LazyDocument]):
+    """The chunks of an index by chunk id, nothing is read from the store until a chunk's text is used."""
+
+    def __init__(self, store: DocumentStore, doc_lens: np.ndarray):
+        self.store: DocumentStore = store
+        self.doc_lens: np.ndarray = doc_lens
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, chunk_id: int) -> LazyDocument:
+        if not -len(self) <= chunk_id < len(self):
+            raise IndexError(chunk_id)
+        chunk_id %= len(self)
+        return LazyDocument(chunk_id, self.store, int(self.doc_lens[chunk_id]))
+
+    def __iter__(self) -> Iterator[LazyDocument]:
+        return (self[chunk_id] for chunk_id in range(len(self)))
@@ -0,0 +1,16 @@
+"""file_io.py"""
+import logging
+
+from bm25Tool.setup_logger import setup_logger
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+def read_file_content(filepath: str) -> str:
+    """ Reads the content of a file. """
+    try:
+        with open(filepath, 'r', encoding="UTF-8") as file:
+            return file.read()
+    except Exception as e:
+        logger.error(f"Error reading {filepath}: {e}")
+        raise
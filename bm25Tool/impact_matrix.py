@@ -0,0 +1,303 @@
+"""impact_matrix.py"""
+import threading
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from bm25Tool.inverted_index import InvertedIndex
+
+BLOCK_SIZE: int = 64
+# Number of slices per result whose maxima bound the k-th largest score, see _kth_largest.
+_KTH_SLICES: int = 16
+
+
+class ImpactMatrix:
+    """
+    Precomputed BM25 impacts of every (term, chunk) pair.
+    Rows are terms and columns are chunk ids, so scoring a query gathers the rows of its terms
+    and sums them. Term frequencies are kept next to the impacts so a change of k1 or b only
+    re-derives the impacts and never re-tokenizes the corpus.
+    The maximum impact of every term and of every block of postings is kept as the score
+    upper bounds used by dynamic pruning.
+    """
+
+    def __init__(self, vocabulary: Mapping[str, int], term_freqs: csr_matrix, doc_lens: np.ndarray,
+                 N: int, avgdl: float, k1: float, b: float, block_size: int = BLOCK_SIZE,
+                 impacts: Optional[np.ndarray] = None, bounds: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Initialize the matrix and derive the impacts, unless impacts and bounds derived with the
+        same k1 and b are given, as they are by an on-disk index.
+        :param vocabulary: term -> row of the matrix.
+        :param term_freqs: terms x chunks matrix of term frequencies.
+        :param doc_lens: Length of every chunk in terms.
+        :param N: Number of chunks in the corpus.
+        :param avgdl: Average chunk length.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        :param block_size: Number of postings summarized by one block-max bound.
+        :param impacts: Precomputed impacts aligned with the term frequencies.
+        :param bounds: Precomputed term_max, block_ptr, block_max and block_last arrays.
+        """
+        self.vocabulary: Mapping[str, int] = vocabulary
+        self.term_freqs: csr_matrix = term_freqs
+        self.doc_lens: np.ndarray = doc_lens
+        self.N: int = N
+        self.avgdl: float = avgdl
+        df: np.ndarray = np.diff(term_freqs.indptr)
+        self.idf: np.ndarray = np.log((N - df + 0.5) / (df + 0.5) + 1)
+        self.k1: float = k1
+        self.b: float = b
+        self.length_norms: np.ndarray = np.empty(0)
+        self.impacts: csr_matrix = csr_matrix(term_freqs.shape)
+        self.block_size: int = block_size
+        self.term_max: np.ndarray = np.empty(0)
+        self.block_ptr: np.ndarray = np.empty(0)
+        self.block_max: np.ndarray = np.empty(0)
+        self.block_last: np.ndarray = np.empty(0)
+        self._impact_ordered: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._accumulators = threading.local()
+        if impacts is None or bounds is None:
+            self._derive_impacts(k1, b)
+        else:
+            self.length_norms = self._length_norms(k1, b)
+            self.impacts = csr_matrix((impacts, term_freqs.indices, term_freqs.indptr), shape=term_freqs.shape)
+            self.term_max, self.block_ptr = bounds["term_max"], bounds["block_ptr"]
+            self.block_max, self.block_last = bounds["block_max"], bounds["block_last"]
+
+    @classmethod
+    def from_inverted_index(cls, inverted_index: InvertedIndex, doc_lens: List[int], avgdl: float,
+                            k1: float, b: float) -> "ImpactMatrix":
+        """
+        Builds the matrix from the postings of the retriever state.
+        :param inverted_index: term -> postings of (chunk id, term frequency).
+        :param doc_lens: Length of every chunk, indexed by chunk id.
+        :param avgdl: Average chunk length.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        :return: The impact matrix.
+        """
+        vocabulary: Dict[str, int] = {}
+        indptr: List[int] = [0]
+        chunk_ids: List[int] = []
+        term_freqs: List[int] = []
+        for term, postings in inverted_index.items():
+            vocabulary[term] = len(vocabulary)
+            for chunk_id, tf in postings:
+                chunk_ids.append(chunk_id)
+                term_freqs.append(tf)
+            indptr.append(len(chunk_ids))
+
+        N: int = len(doc_lens)
+        matrix = csr_matrix((np.asarray(term_freqs, dtype=np.float64), np.asarray(chunk_ids, dtype=np.int32),
+                             np.asarray(indptr, dtype=np.int64)), shape=(len(vocabulary), N))
+        return cls(vocabulary, matrix, np.asarray(doc_lens, dtype=np.float64), N, avgdl, k1, b)
+
+    def _derive_impacts(self, k1: float, b: float) -> None:
+        """
+        Derives the per-chunk length norms, the impacts and their bounds from the term frequencies.
+        A matrix is never reweighted once queries can read it, other parameters get a new matrix.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        """
+        self.k1, self.b = k1, b
+        self.length_norms = self._length_norms(k1, b)
+
+        tf: np.ndarray = self.term_freqs.data
+        rows: np.ndarray = np.repeat(np.arange(self.term_freqs.shape[0]), np.diff(self.term_freqs.indptr))
+        data: np.ndarray = self.idf[rows] * ((tf * (k1 + 1)) / (tf + self.length_norms[self.term_freqs.indices]))
+        self.impacts = csr_matrix((data, self.term_freqs.indices, self.term_freqs.indptr), shape=self.term_freqs.shape)
+        self._impact_ordered = None
+        self._compute_bounds()
+
+    def _length_norms(self, k1: float, b: float) -> np.ndarray:
+        """Returns k1 * (1 - b + b * doc_len / avgdl) for every chunk."""
+        avgdl: float = self.avgdl if self.avgdl else 1.0
+        return k1 * (1 - b + b * (self.doc_lens / avgdl))
+
+    def bounds(self) -> Dict[str, np.ndarray]:
+        """Returns the score upper bound arrays, keyed like the bounds argument of the constructor."""
+        return {"term_max": self.term_max, "block_ptr": self.block_ptr,
+                "block_max": self.block_max, "block_last": self.block_last}
+
+    def impact_ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the chunk ids and the impacts of the postings of every term ordered by descending impact,
+        computed on first use. The postings of term t stay at indptr[t]:indptr[t + 1],
+        ties by ascending chunk id. Sorting every posting takes seconds on large indexes, so a server calls
+        this before it serves the matrix, see BM25Engine._open_state.
+        """
+        if self._impact_ordered is None:
+            self._impact_ordered = self._order_by_impact()
+        return self._impact_ordered
+
+    def accumulator(self) -> np.ndarray:
+        """
+        Returns the score accumulator of the calling thread, one zero per chunk, allocated on first use.
+        The caller zeroes the entries it added to before it returns, see score_at_a_time.
+        """
+        scores: Optional[np.ndarray] = getattr(self._accumulators, "scores", None)
+        if scores is None:
+            scores = self._accumulators.scores = np.zeros(self.N)
+        return scores
+
+    def _order_by_impact(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorts the postings of every term by descending impact, see impact_ordered."""
+        indptr: np.ndarray = self.impacts.indptr
+        rows: np.ndarray = np.repeat(np.arange(indptr.size - 1), np.diff(indptr))
+        order: np.ndarray = np.lexsort((-self.impacts.data, rows))
+        return self.impacts.indices[order], self.impacts.data[order]
+
+    def _compute_bounds(self) -> None:
+        """
+        Computes the per-term and per-block maximum impacts.
+        Blocks of term t are block_ptr[t]:block_ptr[t + 1], each with its maximum impact and last chunk id.
+        """
+        indptr: np.ndarray = self.impacts.indptr
+        lengths: np.ndarray = np.diff(indptr)
+        n_blocks: np.ndarray = (lengths + self.block_size - 1) // self.block_size
+        self.block_ptr = np.concatenate(([0], np.cumsum(n_blocks))).astype(np.int64)
+
+        block_rows: np.ndarray = np.repeat(np.arange(lengths.size), n_blocks)
+        block_starts: np.ndarray = indptr[block_rows] + (np.arange(block_rows.size) - self.block_ptr[block_rows]) * self.block_size
+        block_ends: np.ndarray = np.minimum(block_starts + self.block_size, indptr[block_rows + 1])
+
+        self.term_max = np.zeros(lengths.size)
+        if block_rows.size:
+            self.block_max = np.maximum.reduceat(self.impacts.data, block_starts)
+            self.block_last = self.impacts.indices[block_ends - 1]
+            np.maximum.at(self.term_max, block_rows, self.block_max)
+        else:
+            self.block_max = np.empty(0)
+            self.block_last = np.empty(0, dtype=np.int32)
+
+    def query_rows(self, query_terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Maps query terms to matrix rows, repeated terms are weighted by their count.
+        :param query_terms: The cleaned query terms.
+        :return: The rows and their weights.
+        """
+        counts = Counter(term for term in query_terms if term in self.vocabulary)
+        rows = np.fromiter((self.vocabulary[term] for term in counts), dtype=np.int64, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        return rows, weights
+
+    def score(self, query_terms: List[str]) -> np.ndarray:
+        """
+        Scores every chunk against the query.
+        The rows are added in query order so the sums are reproducible by the pruned top-k search.
+        :param query_terms: The cleaned query terms.
+        :return: The BM25 score of every chunk, indexed by chunk id.
+        """
+        rows, weights = self.query_rows(query_terms)
+        scores: np.ndarray = np.zeros(self.N)
+        indptr, indices, data = self.impacts.indptr, self.impacts.indices, self.impacts.data
+        for row, weight in zip(rows, weights):
+            start, end = indptr[row], indptr[row + 1]
+            scores[indices[start:end]] += weight * data[start:end]
+        return scores
+
+    def rank(self, query_terms: List[str], top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Ranks the chunks that contain at least one query term.
+        :param query_terms: The cleaned query terms.
+        :param top_k: Maximum number of results, all matching chunks when None.
+        :return: (chunk id, score) pairs by descending score, ties by ascending chunk id.
+        """
+        scores: np.ndarray = self.score(query_terms)
+        return rank_scores(scores, top_k)
+
+    def query_matrix(self, queries_terms: List[List[str]]) -> csr_matrix:
+        """
+        Builds the sparse queries x terms matrix of query term counts.
+        Every distinct term of the batch is looked up in the vocabulary once.
+        :param queries_terms: The cleaned terms of every query.
+        :return: The query matrix.
+        """
+        rows: Dict[str, Optional[int]] = {}
+        indptr: List[int] = [0]
+        columns: List[int] = []
+        counts: List[int] = []
+        for query_terms in queries_terms:
+            for term, count in Counter(query_terms).items():
+                if term not in rows:
+                    rows[term] = self.vocabulary.get(term)
+                if rows[term] is not None:
+                    columns.append(rows[term])
+                    counts.append(count)
+            indptr.append(len(columns))
+        return csr_matrix((np.asarray(counts, dtype=np.float64), np.asarray(columns, dtype=np.int64),
+                           np.asarray(indptr, dtype=np.int64)), shape=(len(queries_terms), self.impacts.shape[0]))
+
+    def rank_batch(self, queries_terms: List[List[str]], top_k: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks many queries with one sparse product of the query matrix and the impacts.
+        :param queries_terms: The cleaned terms of every query.
+        :param top_k: Maximum number of results per query, all matching chunks when None.
+        :return: The ranking of every query, in the order of the queries.
+        """
+        scores: csr_matrix = self.query_matrix(queries_terms) @ self.impacts
+        rankings: List[List[Tuple[int, float]]] = []
+        for i in range(len(queries_terms)):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            rankings.append(rank_candidates(scores.indices[start:end], scores.data[start:end], top_k))
+        return rankings
+
+
+def check_top_k(top_k: Optional[int]) -> None:
+    """
+    Checks a maximum number of results.
+    :raises ValueError: If top_k is not None or a positive integer.
+    """
+    if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, (int, np.integer)) or top_k < 1):
+        raise ValueError(f"top_k must be a positive integer or None, got {top_k!r}")
+
+
+def rank_scores(scores: np.ndarray, top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+    """
+    Orders the non-zero entries of a dense score vector.
+    :param scores: The score of every chunk.
+    :param top_k: Maximum number of results, all matching chunks when None.
+    :return: (chunk id, score) pairs by descending score, ties by ascending chunk id.
+    """
+    candidates: np.ndarray = np.flatnonzero(scores)
+    return rank_candidates(candidates, scores[candidates], top_k)
+
+
+def _kth_largest(values: np.ndarray, k: int) -> float:
+    """
+    Returns the k-th largest of the values, 1 <= k < values.size.
+    The k-th largest of the maxima of slices of the values bounds it from below and leaves few values to sort.
+    Sorting them is used rather than np.partition, which slows down several fold on many equal values.
+    """
+    starts: np.ndarray = np.arange(0, values.size, max(1, values.size // (_KTH_SLICES * k)))
+    slice_max: np.ndarray = np.maximum.reduceat(values, starts)
+    bound: float = np.sort(slice_max)[-k] if slice_max.size >= k else values.min()
+    return float(np.sort(values[values >= bound])[-k])
+
+
+def rank_candidates(chunk_ids: np.ndarray, scores: np.ndarray, top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+    """
+    Orders scored candidate chunks.
+    :param chunk_ids: The candidate chunk ids.
+    :param scores: The score of every candidate.
+    :param top_k: Maximum number of results, all candidates when None.
+    :return: (chunk id, score) pairs by descending score, ties by ascending chunk id.
+    :raises ValueError: If top_k is not None or a positive integer.
+    """
+    check_top_k(top_k)
+    if top_k is not None and top_k < chunk_ids.size:
+        kth: float = _kth_largest(scores, top_k)
+        above: np.ndarray = np.flatnonzero(scores > kth)
+        # Partial scores tie often, only the smallest chunk ids of the tie at the cut are sorted.
+        tied: np.ndarray = np.flatnonzero(scores == kth)
+        needed: int = top_k - above.size
+        if tied.size > needed:
+            tied = tied[np.argpartition(chunk_ids[tied], needed - 1)[:needed]]
+        keep: np.ndarray = np.concatenate((above, tied))
+        chunk_ids, scores = chunk_ids[keep], scores[keep]
+    order: np.ndarray = np.lexsort((chunk_ids, -scores))
+    if top_k is not None:
+        order = order[:top_k]
+    return [(int(chunk_id), float(score)) for chunk_id, score in zip(chunk_ids[order], scores[order])]
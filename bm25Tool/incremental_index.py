@@ -0,0 +1,122 @@
+"""incremental_index.py"""
+import logging
+import os
+from typing import Dict, List, Set, Tuple
+
+from bm25Tool.build_document_index import FILE_TYPES, convert_files_to_markdown, index_markdown_file, is_indexed_markdown
+from bm25Tool.inverted_index import InvertedIndex, add_postings, remove_chunks, shift_chunk_id
+from bm25Tool.manifest import Manifest, chunk_ids_by_filename, diff_directory, new_manifest
+from bm25Tool.setup_logger import setup_logger
+from converter.Document import Document
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+def list_source_files(input_dir: str) -> List[str]:
+    """Returns the filenames of the input directory that are converted to markdown."""
+    return [filename for filename in os.listdir(input_dir)
+            if any(filename.lower().endswith(ext) for ext in FILE_TYPES)]
+
+
+def list_markdown_files(output_dir: str) -> List[str]:
+    """Returns the filenames of the output directory that are indexed."""
+    return [filename for filename in os.listdir(output_dir) if is_indexed_markdown(filename)]
+
+
+def build_manifest(input_dir: str, output_dir: str, documents: List[Document]) -> Manifest:
+    """
+    Creates the manifest of a full build.
+    :param input_dir: The directory of the source documents.
+    :param output_dir: The directory of the converted markdown files.
+    :param documents: The indexed chunks, the chunk id is the list position.
+    :return: The manifest.
+    """
+    manifest: Manifest = new_manifest()
+    manifest["sources"], _, _ = diff_directory(input_dir, list_source_files(input_dir), {})
+    manifest["markdown"], _, _ = diff_directory(output_dir, list_markdown_files(output_dir), {})
+    chunk_ids: Dict[str, List[int]] = chunk_ids_by_filename(documents)
+    for filename, entry in manifest["markdown"].items():
+        entry["chunk_ids"] = chunk_ids.get(filename, [])
+    return manifest
+
+
+def files_sharing_chunks(markdown: Dict[str, Dict], filenames: Set[str]) -> Set[str]:
+    """
+    Returns the files that share chunks with the given files, directly or through other files.
+    A chunk collapsed from near duplicates of several files is listed under each of them in the manifest,
+    see near_duplicates, and is removed when any of them changes, so the others are re-indexed too.
+    :param markdown: The markdown entries of the manifest.
+    :param filenames: The changed or deleted markdown files.
+    :return: The other files to re-index.
+    """
+    files_by_chunk: Dict[int, Set[str]] = {}
+    for filename, entry in markdown.items():
+        for chunk_id in entry["chunk_ids"]:
+            files_by_chunk.setdefault(chunk_id, set()).add(filename)
+    sharing: Set[str] = set()
+    pending: List[str] = [filename for filename in filenames if filename in markdown]
+    while pending:
+        for chunk_id in markdown[pending.pop()]["chunk_ids"]:
+            for other in files_by_chunk[chunk_id] - filenames - sharing:
+                sharing.add(other)
+                pending.append(other)
+    return sharing
+
+
+def update_document_index(input_dir: str, output_dir: str, documents: List[Document], term_frequency: Dict[str, int],
+                          inverted_index: InvertedIndex, manifest: Manifest
+                          ) -> Tuple[List[Document], Dict[str, int], InvertedIndex, Manifest]:
+    """
+    Brings a saved index up to date with the input and output directories.
+    Only added or changed source files are converted and only added or changed markdown files are
+    chunked; chunks of changed or deleted files are removed and the postings and document
+    frequencies are patched in place. Files sharing a collapsed near-duplicate chunk with a changed or
+    deleted file are re-indexed with it, the chunks of an update are not checked for near duplicates.
+    :param input_dir: The directory of the source documents.
+    :param output_dir: The directory of the converted markdown files.
+    :param documents: The indexed chunks of the last build.
+    :param term_frequency: The document frequencies of the last build, updated in place.
+    :param inverted_index: The postings of the last build, updated in place.
+    :param manifest: The manifest of the last build.
+    :return: The documents, document frequencies, inverted index and manifest of the updated index.
+    """
+    sources, changed_sources, deleted_sources = diff_directory(input_dir, list_source_files(input_dir), manifest["sources"])
+    if changed_sources:
+        logger.info(f"Converting {len(changed_sources)} added or changed files.")
+        convert_files_to_markdown(input_dir, output_dir, FILE_TYPES, changed_sources)
+    for filename in deleted_sources:
+        markdown_path: str = os.path.join(output_dir, os.path.splitext(filename)[0] + ".md")
+        if os.path.exists(markdown_path):
+            os.remove(markdown_path)
+    # a failed conversion is retried on the next update
+    sources = {filename: entry for filename, entry in sources.items()
+               if os.path.exists(os.path.join(output_dir, os.path.splitext(filename)[0] + ".md"))}
+
+    markdown, changed, deleted = diff_directory(output_dir, list_markdown_files(output_dir), manifest["markdown"])
+    previous: Dict[str, Dict] = manifest["markdown"]
+    changed |= files_sharing_chunks(previous, changed | deleted) & set(markdown)
+    removed_ids: List[int] = sorted({chunk_id for filename in changed | deleted if filename in previous
+                                     for chunk_id in previous[filename]["chunk_ids"]})
+    logger.info(f"Updating index: {len(changed)} added or changed, {len(deleted)} deleted markdown files, "
+                f"{len(removed_ids)} chunks removed.")
+
+    documents = remove_chunks(inverted_index, term_frequency, documents, removed_ids)
+    unchanged: Set[str] = set(markdown) - changed
+    for filename in unchanged:
+        markdown[filename]["chunk_ids"] = [shift_chunk_id(chunk_id, removed_ids) for chunk_id in previous[filename]["chunk_ids"]]
+
+    for filename in sorted(changed):
+        chunk_ids: List[int] = []
+        for chunk in index_markdown_file(os.path.join(output_dir, filename), filename):
+            term_freq: Dict[str, int] = chunk.compute_term_freq()
+            for term in term_freq:
+                term_frequency[term] = term_frequency.get(term, 0) + 1
+            chunk_ids.append(len(documents))
+            add_postings(inverted_index, len(documents), term_freq)
+            chunk.drop_terms()
+            documents.append(chunk)
+        markdown[filename]["chunk_ids"] = chunk_ids
+
+    updated: Manifest = new_manifest()
+    updated["sources"], updated["markdown"] = sources, markdown
+    return documents, term_frequency, inverted_index, updated
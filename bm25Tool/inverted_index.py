@@ -0,0 +1,79 @@
+"""inverted_index.py"""
+from bisect import bisect_left
+from typing import Dict, List, Set, Tuple
+
+from converter.Document import Document
+
+# term -> postings of (chunk id, term frequency), chunk ids in ascending order
+InvertedIndex = Dict[str, List[Tuple[int, int]]]
+
+
+def add_postings(inverted_index: InvertedIndex, chunk_id: int, term_freq: Dict[str, int]) -> None:
+    """
+    Appends the postings of a single chunk to the inverted index.
+    :param inverted_index: The index to update in place.
+    :param chunk_id: The position of the chunk in the documents list.
+    :param term_freq: The term frequencies of the chunk.
+    """
+    for term, tf in term_freq.items():
+        postings = inverted_index.get(term)
+        if postings is None:
+            inverted_index[term] = [(chunk_id, tf)]
+        else:
+            postings.append((chunk_id, tf))
+
+
+def build_inverted_index(documents: List[Document]) -> InvertedIndex:
+    """
+    Builds an inverted index from the term frequencies of the documents, recomputed from the text of
+    documents whose terms were dropped, see Document.drop_terms.
+    Used for retriever files that were saved before postings were persisted.
+    :param documents: The indexed chunks, the chunk id is the list position.
+    :return: The inverted index.
+    """
+    inverted_index: InvertedIndex = {}
+    for chunk_id, document in enumerate(documents):
+        add_postings(inverted_index, chunk_id, document.compute_term_freq())
+    return inverted_index
+
+
+def remove_chunks(inverted_index: InvertedIndex, term_frequency: Dict[str, int], documents: List[Document],
+                  removed_ids: List[int]) -> List[Document]:
+    """
+    Removes chunks from the index, patching the postings and document frequencies in place.
+    The remaining chunks are renumbered to stay contiguous, see shift_chunk_id.
+    :param inverted_index: The index to update in place.
+    :param term_frequency: The document frequencies to update in place.
+    :param documents: The indexed chunks, the chunk id is the list position.
+    :param removed_ids: The sorted ids of the chunks to remove.
+    :return: The remaining chunks.
+    """
+    if not removed_ids:
+        return documents
+    removed: Set[int] = set(removed_ids)
+    affected_terms: Set[str] = set()
+    for chunk_id in removed_ids:
+        for term in documents[chunk_id].compute_term_freq():
+            affected_terms.add(term)
+            term_frequency[term] -= 1
+            if term_frequency[term] == 0:
+                del term_frequency[term]
+
+    first_removed: int = removed_ids[0]
+    for term in list(inverted_index):
+        postings = inverted_index[term]
+        if term in affected_terms:
+            postings = [(chunk_id, tf) for chunk_id, tf in postings if chunk_id not in removed]
+            if not postings:
+                del inverted_index[term]
+                continue
+        if postings[-1][0] > first_removed:
+            postings = [(shift_chunk_id(chunk_id, removed_ids), tf) for chunk_id, tf in postings]
+        inverted_index[term] = postings
+
+    return [document for chunk_id, document in enumerate(documents) if chunk_id not in removed]
+
+
+def shift_chunk_id(chunk_id: int, removed_ids: List[int]) -> int:
+    """Returns the id a remaining chunk gets once the sorted removed_ids are taken out."""
+    return chunk_id - bisect_left(removed_ids, chunk_id)
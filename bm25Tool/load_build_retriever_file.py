@@ -5,41 +5,90 @@ import pickle
 from typing import Any, Dict
 
 from bm25Tool.build_document_index import build_document_index
-from config_reader import get_base_directory, get_data_dir, get_output_dir
+from bm25Tool.calculate_BM25_score import k1, b
+from bm25Tool.compressed_postings import CompressedInvertedIndex
+from bm25Tool.incremental_index import build_manifest, update_document_index
+from bm25Tool.inverted_index import build_inverted_index
+from bm25Tool.manifest import get_manifest_path, load_manifest, save_manifest
+from bm25Tool.mmap_index import get_index_path, write_mmap_index
+from bm25Tool.snapshot import atomic_write
+from bm25Tool.toc_store import build_toc_store
+from converter.analyzer import LEGACY_SIGNATURE, get_analyzer
+from settings import get_settings
 
-BASE_DIR = get_base_directory()
+BASE_DIR = get_settings().base_dir
 
-CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
-DATA_PATH = os.path.join(BASE_DIR, get_data_dir(CONFIG_PATH))
-OUTPUT_PATH = os.path.join(BASE_DIR, get_output_dir(CONFIG_PATH))
+CONFIG_PATH = get_settings().config_path
+DATA_PATH = get_settings().data_dir
+OUTPUT_PATH = get_settings().output_dir
 LOG_PATH = os.path.join(BASE_DIR, 'logs/build_document.log')
 
 
-def load_or_build_retriever_state(retriever_file: str = None, refresh: bool = False)-> tuple[Any, Any, Any, Any]:
+def load_or_build_retriever_state(retriever_file: str = None, refresh: bool = False,
+                                  full_rebuild: bool = False)-> tuple[Any, Any, Any, Any, Any]:
     """
-    Loads a retriever file from the path provided.
-    :param refresh: boolean
+    Loads a retriever file from the path provided, building and saving it if it does not exist.
+    A refresh of a retriever file that has a manifest beside it only converts and re-chunks the
+    files that were added or changed since the last build. Every build also writes the
+    memory-mapped index that query processes open, see mmap_index.get_index_path, and the tables
+    of content of the added or changed files, see toc_store.
+    Every file is written to a temporary path and renamed into place, the index file last, so
+    readers see the previous or the new state but never a partially written one.
+    A retriever file built with another analyzer than the configured one is rebuilt in full.
+    The postings are saved compressed and a loaded retriever file returns them as a CompressedInvertedIndex.
+    :param refresh: Rebuild the retriever state even if the file exists.
     :param retriever_file: The retriever file path.
-    :return: the retriever file content as string.
+    :param full_rebuild: Ignore the manifest and rebuild every file.
+    :return: the documents, N, avgdl, the term document frequencies and the inverted index.
     """
     try:
         if retriever_file is None:
             raise ValueError("Retriever file cannot be None")
-        if os.path.exists(retriever_file) and refresh:
-            with open(retriever_file, "rb", encoding="utf-8") as file:
+        analyzer_signature: Dict[str, Any] = get_analyzer().signature
+        if os.path.exists(retriever_file) and not refresh:
+            with open(retriever_file, "rb") as file:
                 state: pickle = pickle.load(file)
-                return state.get("documents", []), state.get("N", 0), state.get("avgdl", 0), state.get("term_document_freq", {})
+            if state.get("analyzer", LEGACY_SIGNATURE) == analyzer_signature:
+                documents = state.get("documents", [])
+                inverted_index = state.get("inverted_index")
+                if inverted_index is None:
+                    inverted_index = build_inverted_index(documents)
+                # Retriever files written before avgdl was a mean stored the total length, it is recomputed.
+                N = len(documents)
+                avgdl = sum(doc.doc_len for doc in documents) / N if N else 0
+                return documents, N, avgdl, state.get("term_document_freq", {}), inverted_index
+            logging.warning(f"{retriever_file} was built with analyzer {state.get('analyzer', LEGACY_SIGNATURE)}, "
+                            f"rebuilding with {analyzer_signature}")
+            full_rebuild = True
 
-        documents, term_frequency = build_document_index(input_dir=DATA_PATH, output_dir=OUTPUT_PATH)
+        manifest_path: str = get_manifest_path(retriever_file)
+        manifest = None if full_rebuild or not os.path.exists(retriever_file) else load_manifest(manifest_path)
+        if manifest is not None and manifest.get("analyzer", LEGACY_SIGNATURE) != analyzer_signature:
+            manifest = None
+        if manifest is not None:
+            documents, _, _, term_frequency, inverted_index = load_or_build_retriever_state(retriever_file)
+            if isinstance(inverted_index, CompressedInvertedIndex):
+                inverted_index = inverted_index.to_inverted_index()
+            documents, term_frequency, inverted_index, manifest = update_document_index(
+                DATA_PATH, OUTPUT_PATH, documents, term_frequency, inverted_index, manifest)
+        else:
+            documents, term_frequency, inverted_index = build_document_index(input_dir=DATA_PATH, output_dir=OUTPUT_PATH)
+            manifest = build_manifest(DATA_PATH, OUTPUT_PATH, documents)
         N: int = len(documents) if documents else 0
-        avgdl: float = sum(doc.doc_len for doc in documents)
+        avgdl: float = sum(doc.doc_len for doc in documents) / N if N else 0
 
-        state: Dict = {"documents": documents, "avgdl": avgdl, "N": N, "term_document_freq": term_frequency}
+        state: Dict = {"documents": documents, "avgdl": avgdl, "N": N, "term_document_freq": term_frequency,
+                       "inverted_index": CompressedInvertedIndex.from_inverted_index(
+                           inverted_index, [doc.doc_len for doc in documents]),
+                       "analyzer": analyzer_signature}
 
-        with open(retriever_file, "w+b") as f:
+        with atomic_write(retriever_file) as f:
             pickle.dump(state, f)
+        save_manifest(manifest, manifest_path)
+        build_toc_store(OUTPUT_PATH, manifest["markdown"], get_index_path(retriever_file), manifest["markdown"])
+        write_mmap_index(get_index_path(retriever_file), documents, avgdl, inverted_index, k1, b)
 
-        return documents, N, avgdl, term_frequency
+        return documents, N, avgdl, term_frequency, inverted_index
     except ValueError as e:
         logging.error(e)
         raise
@@ -0,0 +1,102 @@
+"""manifest.py"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bm25Tool.near_duplicates import location_filenames
+from bm25Tool.snapshot import atomic_write
+from converter.Document import Document
+from converter.analyzer import get_analyzer
+
+MANIFEST_VERSION: int = 1
+HASH_BLOCK_SIZE: int = 1 << 20
+
+# {"version": int, "analyzer": signature, "sources": {filename: entry}, "markdown": {filename: entry}}
+# entry: {"size": int, "mtime": float, "sha256": str} and for markdown files also "chunk_ids": [int]
+Manifest = Dict[str, Any]
+
+
+def get_manifest_path(retriever_file: str) -> str:
+    """Returns the path of the manifest stored beside the retriever file."""
+    return retriever_file + ".manifest.json"
+
+
+def new_manifest() -> Manifest:
+    """Returns an empty manifest for the configured analyzer."""
+    return {"version": MANIFEST_VERSION, "analyzer": get_analyzer().signature, "sources": {}, "markdown": {}}
+
+
+def load_manifest(manifest_path: str) -> Optional[Manifest]:
+    """
+    Loads a manifest file.
+    :param manifest_path: The manifest file path.
+    :return: The manifest, or None if it does not exist or has another version.
+    """
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest: Manifest = json.load(file)
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def save_manifest(manifest: Manifest, manifest_path: str) -> None:
+    """Writes the manifest file atomically."""
+    with atomic_write(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+
+
+def hash_file(filepath: str) -> str:
+    """Returns the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_file(filepath: str, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Returns the size, mtime and content hash of a file.
+    The hash of the previous entry is reused when size and mtime did not change.
+    :param filepath: The file path.
+    :param previous: The manifest entry of the last build, if any.
+    :return: The fingerprint entry.
+    """
+    stat = os.stat(filepath)
+    if previous is not None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": previous["sha256"]}
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": hash_file(filepath)}
+
+
+def diff_directory(directory: str, filenames: Iterable[str], entries: Dict[str, Dict[str, Any]]
+                   ) -> Tuple[Dict[str, Dict[str, Any]], Set[str], Set[str]]:
+    """
+    Compares the files of a directory with their manifest entries.
+    :param directory: The directory holding the files.
+    :param filenames: The filenames currently tracked in the directory.
+    :param entries: The manifest entries of the last build.
+    :return: The fresh fingerprint of every file, the added or changed filenames and the deleted filenames.
+    """
+    fingerprints: Dict[str, Dict[str, Any]] = {}
+    changed: Set[str] = set()
+    for filename in filenames:
+        previous: Optional[Dict[str, Any]] = entries.get(filename)
+        fingerprint: Dict[str, Any] = fingerprint_file(os.path.join(directory, filename), previous)
+        fingerprints[filename] = fingerprint
+        if previous is None or previous["sha256"] != fingerprint["sha256"]:
+            changed.add(filename)
+    deleted: Set[str] = set(entries) - set(fingerprints)
+    return fingerprints, changed, deleted
+
+
+def chunk_ids_by_filename(documents: List[Document]) -> Dict[str, List[int]]:
+    """
+    Groups the chunk ids of the documents by the markdown file they come from.
+    A chunk collapsed from near duplicates is listed under every file of its locations.
+    """
+    chunk_ids: Dict[str, List[int]] = {}
+    for chunk_id, document in enumerate(documents):
+        for filename in location_filenames(document):
+            chunk_ids.setdefault(filename, []).append(chunk_id)
+    return chunk_ids
@@ -0,0 +1,132 @@
+"""metrics.py"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+MetricsHook = Callable[[str, str, float], None]
+
+
+class _NullTimer:
+    """The timer handed out while metrics are disabled, entering and leaving it does nothing."""
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageTimer:
+    """Times one run of a stage and records it when the block exits."""
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics: Metrics = metrics
+        self.stage: str = stage
+        self.start: float = 0.0
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Stage timers and counters of the build and query pipelines.
+
+    Stages are timed with ``with metrics.timer("score"):`` and counted with ``metrics.increment("queries")``.
+    Stages may nest, e.g. sentence_tokenize runs inside chunk. Every recorded value is also passed to
+    the hooks as (kind, name, value) with kind "timer" or "counter", so it can be forwarded elsewhere.
+    While disabled the timer is a shared no-op and increment returns immediately.
+    """
+
+    def __init__(self, enabled: bool = False):
+        """
+        :param enabled: Record timings and counters.
+        """
+        self.enabled: bool = enabled
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.hooks: List[MetricsHook] = []
+        self.lock = threading.Lock()
+
+    def timer(self, stage: str):
+        """Returns a context manager timing a run of the stage."""
+        return StageTimer(self, stage) if self.enabled else _NULL_TIMER
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Records one run of a stage."""
+        if not self.enabled:
+            return
+        with self.lock:
+            totals: Dict[str, float] = self.stages.setdefault(stage, {"count": 0, "total_seconds": 0.0,
+                                                                      "max_seconds": 0.0})
+            totals["count"] += 1
+            totals["total_seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+        for hook in self.hooks:
+            hook("timer", stage, seconds)
+
+    def increment(self, counter: str, value: float = 1) -> None:
+        """Adds value to a counter."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        for hook in self.hooks:
+            hook("counter", counter, value)
+
+    def add_hook(self, hook: MetricsHook) -> None:
+        """Registers a callable receiving (kind, name, value) for every recorded timing and counter."""
+        self.hooks.append(hook)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the stage totals, with the mean duration, and the counters."""
+        with self.lock:
+            stages: Dict[str, Dict[str, float]] = {
+                stage: dict(totals, mean_seconds=totals["total_seconds"] / totals["count"])
+                for stage, totals in self.stages.items()}
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def dump(self, path: str) -> None:
+        """Writes the snapshot as JSON."""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def reset(self) -> None:
+        """Clears the recorded timings and counters."""
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+def get_metrics_settings(config_path: str) -> tuple[bool, Optional[str]]:
+    """
+    Reads the [metrics] section: enabled (default false) and dump_file, a JSON file relative to the
+    base directory the metrics are written to at exit.
+    """
+    config = read_config(config_path)
+    dump_file: Optional[str] = config.get("metrics", "dump_file", fallback=None)
+    return (config.getboolean("metrics", "enabled", fallback=False),
+            os.path.join(BASE_DIR, dump_file) if dump_file else None)
+
+
+_enabled, _dump_file = get_metrics_settings(CONFIG_PATH)
+metrics: Metrics = Metrics(_enabled)
+if _enabled and _dump_file:
+    atexit.register(metrics.dump, _dump_file)
@@ -0,0 +1,430 @@
+"""mmap_index.py"""
+import json
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from bm25Tool.document_store import DEFAULT_SNIPPET_CACHE_SIZE, DocumentStore, LazyDocuments
+from bm25Tool.impact_matrix import BLOCK_SIZE, ImpactMatrix
+from bm25Tool.inverted_index import InvertedIndex, build_inverted_index
+from bm25Tool.positional_index import PositionalIndex, encode_positions, get_positions_enabled
+from bm25Tool.snapshot import get_snapshot_path, get_temp_path, remove_old_snapshots, sync_file
+from converter.Document import Document
+from converter.analyzer import LEGACY_SIGNATURE, Analyzer, get_analyzer
+from settings import get_settings
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+# Layout: prefix | 8-byte aligned array sections | JSON header.
+# prefix: magic, format version (uint32), reserved (uint32), header offset (uint64), header length (uint64).
+MAGIC: bytes = b"BM25IDX\x00"
+FORMAT_VERSION: int = 1
+_PREFIX = struct.Struct("<8sIIQQ")
+_ALIGNMENT: int = 8
+COPY_BLOCK_SIZE: int = 1 << 20
+
+
+def get_index_path(retriever_file: str) -> str:
+    """Returns the path of the memory-mapped index built next to the retriever file."""
+    return os.path.splitext(retriever_file)[0] + ".bm25idx"
+
+
+def get_document_store_path(index_file: str) -> str:
+    """Returns the path of the document store written next to the index file."""
+    return os.path.splitext(index_file)[0] + ".docstore"
+
+
+def get_positions_path(index_file: str) -> str:
+    """Returns the path of the term positions written next to the index file."""
+    return os.path.splitext(index_file)[0] + ".positions"
+
+
+class IndexWriter:
+    """
+    Writes named arrays into an index file, the header is written last by close().
+    The file is written to a temporary path and renamed over the index file by close(), so readers
+    never open a partially written index.
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file: str = index_file
+        self.temp_file: str = get_temp_path(index_file)
+        self.file = open(self.temp_file, "wb")
+        self.file.write(b"\x00" * _PREFIX.size)
+        self.sections: Dict[str, Dict[str, Any]] = {}
+
+    def _align(self) -> None:
+        padding: int = -self.file.tell() % _ALIGNMENT
+        self.file.write(b"\x00" * padding)
+
+    def add_array(self, name: str, array: np.ndarray) -> None:
+        """
+        Appends an array section.
+        :param name: The section name.
+        :param array: A one dimensional array, stored little-endian.
+        """
+        self._align()
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        self.sections[name] = {"offset": self.file.tell(), "dtype": array.dtype.str, "count": int(array.size)}
+        self.file.write(array.tobytes())
+
+    def add_array_file(self, name: str, dtype: np.dtype, array_file: str) -> None:
+        """
+        Appends an array section from a file of raw little-endian values, copying it in blocks.
+        :param name: The section name.
+        :param dtype: The type of the values in the file.
+        :param array_file: The file path.
+        """
+        self._align()
+        dtype = np.dtype(dtype).newbyteorder("<")
+        size: int = os.path.getsize(array_file)
+        self.sections[name] = {"offset": self.file.tell(), "dtype": dtype.str, "count": size // dtype.itemsize}
+        with open(array_file, "rb") as source:
+            shutil.copyfileobj(source, self.file, COPY_BLOCK_SIZE)
+
+    def close(self, meta: Dict[str, Any]) -> None:
+        """
+        Writes the header and the prefix pointing at it, then closes the file and renames it over the index file.
+        :param meta: Index wide values stored in the header, e.g. N and avgdl.
+        """
+        header: bytes = json.dumps({"meta": meta, "sections": self.sections}).encode("utf-8")
+        header_offset: int = self.file.tell()
+        self.file.write(header)
+        self.file.seek(0)
+        self.file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, header_offset, len(header)))
+        sync_file(self.file)
+        self.file.close()
+        os.replace(self.temp_file, self.index_file)
+
+    def abort(self) -> None:
+        """Closes and removes the temporary file, the index file is left unchanged."""
+        self.file.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+
+class MmapVocabulary:
+    """A read-only term -> row mapping answered by binary search over the sorted terms of the index."""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets: np.ndarray = offsets
+        self.data: np.ndarray = data
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def term(self, row: int) -> str:
+        """Returns the term stored in a row."""
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def get(self, term: str, default: Optional[int] = None) -> Optional[int]:
+        """Returns the row of a term, or default if the term is not indexed."""
+        key: bytes = term.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle: int = (low + high) // 2
+            stored: bytes = self.data[self.offsets[middle]:self.offsets[middle + 1]].tobytes()
+            if stored < key:
+                low = middle + 1
+            elif stored > key:
+                high = middle
+            else:
+                return middle
+        return default
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def __getitem__(self, term: str) -> int:
+        row: Optional[int] = self.get(term)
+        if row is None:
+            raise KeyError(term)
+        return row
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    """
+    Reads the header of a file written by IndexWriter without mapping it.
+    :return: The header, with the meta values and the sections.
+    :raises ValueError: If the file is not an index or has an unsupported format version.
+    """
+    with open(path, "rb") as file:
+        prefix: bytes = file.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"Not a BM25 index file: {path}")
+        magic, version, _, header_offset, header_length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"Not a BM25 index file: {path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version {version} in {path}, expected {FORMAT_VERSION}")
+        file.seek(header_offset)
+        return json.loads(file.read(header_length))
+
+
+def next_generation(index_file: str) -> int:
+    """
+    Returns the generation number of the next index written to index_file, 1 for a new index.
+    The numbers restart when the index file is removed, e.g. with the output directory, see new_build_id.
+    """
+    try:
+        generation = read_header(index_file)["meta"].get("generation")
+    except (FileNotFoundError, ValueError):
+        return 1
+    return generation + 1 if isinstance(generation, int) else 1
+
+
+def new_build_id() -> str:
+    """
+    Returns a unique id for an index build, written with the generation number to every file of the build.
+    Unlike the number it never repeats, so it identifies the index in query cache keys.
+    """
+    return uuid.uuid4().hex
+
+
+def _map_file(path: str) -> Tuple[mmap.mmap, Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Maps a file written by IndexWriter.
+    :return: The mapped buffer, the meta values and the sections of the header.
+    :raises ValueError: If the file is not an index or has an unsupported format version.
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, header_offset, header_length = _PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Not a BM25 index file: {path}")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {version} in {path}, expected {FORMAT_VERSION}")
+    header: Dict[str, Any] = json.loads(buffer[header_offset:header_offset + header_length])
+    return buffer, header["meta"], header["sections"]
+
+
+def _section_array(buffer: mmap.mmap, section: Dict[str, Any]) -> np.ndarray:
+    """Returns a read-only view of a section of a mapped file."""
+    return np.frombuffer(buffer, dtype=np.dtype(section["dtype"]), count=section["count"], offset=section["offset"])
+
+
+class MmapIndex:
+    """
+    A BM25 index opened with mmap.
+    Every array is a zero-copy NumPy view of the mapped file, so opening costs only the header
+    parse and processes serving the same file share its pages through the page cache.
+    Chunk text and metadata live in a separate document store file and are read only for the
+    chunks whose text is used. Term positions, when the index has them, are mapped on the first
+    phrase or proximity query.
+    """
+
+    def __init__(self, index_file: str, snippet_cache_size: int = DEFAULT_SNIPPET_CACHE_SIZE):
+        """
+        Opens an index file and its document store.
+        :param index_file: The index file path.
+        :param snippet_cache_size: Number of decoded chunk records kept, see DocumentStore.
+        :raises ValueError: If the file is not an index or has an unsupported format version.
+        """
+        self.index_file: str = index_file
+        self.buffer, self.meta, self.sections = _map_file(index_file)
+
+        self.N: int = self.meta["N"]
+        self.avgdl: float = self.meta["avgdl"]
+        self.filenames: List[str] = self.meta["filenames"]
+        stat = os.stat(index_file)
+        # Indexes written before build ids are told apart by the size and time of their file.
+        self.build_id: str = self.meta.get("build_id") or f"{stat.st_size}-{stat.st_mtime_ns}"
+        self.generation: str = (f"{self.meta['generation']}-{self.build_id}" if self.meta.get("generation")
+                                else self.build_id)
+        self.analyzer_signature: Optional[Dict[str, Any]] = self.meta.get("analyzer")
+        self.vocabulary = MmapVocabulary(self.array("vocab_offsets"), self.array("vocab_data"))
+        self.doc_lens: np.ndarray = self.array("doc_lens")
+        # Indexes written before the document store was split out keep the records in their own file.
+        self.store_buffer: Optional[mmap.mmap] = None
+        if "doc_data" in self.sections:
+            doc_offsets, doc_data = self.array("doc_offsets"), self.array("doc_data")
+        else:
+            store_file: str = os.path.join(os.path.dirname(index_file), self.meta["document_store"])
+            self.store_buffer, store_meta, store_sections = _map_file(store_file)
+            self._check_build(store_meta, store_file)
+            doc_offsets = _section_array(self.store_buffer, store_sections["doc_offsets"])
+            doc_data = _section_array(self.store_buffer, store_sections["doc_data"])
+        self.store = DocumentStore(doc_offsets, doc_data, snippet_cache_size)
+        self.documents = LazyDocuments(self.store, self.doc_lens)
+        self.doc_file_ids: Optional[np.ndarray] = self.array("doc_file_ids") if "doc_file_ids" in self.sections else None
+        self.positions_buffer: Optional[mmap.mmap] = None
+        self.positional_index: Optional[PositionalIndex] = None
+
+    @property
+    def has_positions(self) -> bool:
+        """True when term positions were written with the index."""
+        return "positions" in self.meta
+
+    def positions(self) -> PositionalIndex:
+        """
+        Returns the term positions of the postings, mapping their file on first use.
+        :raises ValueError: If the index was written without positions or the positions file belongs to another index.
+        """
+        if self.positional_index is None:
+            if not self.has_positions:
+                raise ValueError(f"{self.index_file} has no term positions, "
+                                 f"set positions = true in the [indexing] section and rebuild the index")
+            positions_file: str = os.path.join(os.path.dirname(self.index_file), self.meta["positions"])
+            self.positions_buffer, meta, sections = _map_file(positions_file)
+            self._check_build(meta, positions_file)
+            self.positional_index = PositionalIndex(_section_array(self.positions_buffer, sections["positions_offsets"]),
+                                                    _section_array(self.positions_buffer, sections["positions_data"]))
+        return self.positional_index
+
+    def _check_build(self, meta: Dict[str, Any], path: str) -> None:
+        """
+        Checks that a file of the index, e.g. the document store, was written by the same build.
+        :raises ValueError: If its generation number or build id differ from the index file's.
+        """
+        if meta.get("generation") != self.meta.get("generation") or meta.get("build_id") != self.meta.get("build_id"):
+            raise ValueError(f"{path} was not written with {self.index_file}")
+
+    def chunk_file_ids(self) -> np.ndarray:
+        """Returns the position in filenames of every chunk's source file."""
+        if self.doc_file_ids is not None:
+            return self.doc_file_ids
+        file_ids: Dict[str, int] = {filename: i for i, filename in enumerate(self.filenames)}
+        return np.fromiter((file_ids[doc.metadata["filename"]] for doc in self.documents), dtype=np.int32, count=self.N)
+
+    def array(self, name: str) -> np.ndarray:
+        """Returns a read-only view of a section."""
+        return _section_array(self.buffer, self.sections[name])
+
+    def impact_matrix(self, k1: float, b: float) -> ImpactMatrix:
+        """
+        Returns the impact matrix over the mapped postings.
+        The stored impacts and bounds are used as is when they were derived with the same k1 and b.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        """
+        term_freqs = csr_matrix((self.array("postings_tfs"), self.array("postings_chunk_ids"), self.array("postings_indptr")),
+                                shape=(len(self.vocabulary), self.N))
+        matches: bool = self.meta["k1"] == k1 and self.meta["b"] == b
+        return ImpactMatrix(self.vocabulary, term_freqs, self.doc_lens, self.N, self.avgdl, k1, b,
+                            block_size=self.meta["block_size"],
+                            impacts=self.array("impacts") if matches else None,
+                            bounds={name: self.array(name) for name in ("term_max", "block_ptr", "block_max", "block_last")}
+                            if matches else None)
+
+    def close(self) -> None:
+        """
+        Drops the views the index holds and unmaps the files.
+        A file that is still viewed elsewhere, e.g. by an impact matrix of a query in flight, is
+        unmapped when the last view is released.
+        """
+        self.vocabulary = self.doc_lens = self.store = self.documents = self.doc_file_ids = None
+        self.positional_index = None
+        for buffer in (self.buffer, self.store_buffer, self.positions_buffer):
+            if buffer is not None:
+                try:
+                    buffer.close()
+                except BufferError:
+                    pass
+
+
+def write_mmap_index(index_file: str, documents: List[Document], avgdl: float, inverted_index: InvertedIndex,
+                     k1: float, b: float, analyzer_signature: Optional[Dict[str, Any]] = None,
+                     positions: Optional[bool] = None) -> None:
+    """
+    Writes the retriever state in the memory-mapped index format.
+    Every write is a new generation: the document store and the positions are written to files
+    numbered with the generation, then the index file pointing at them is atomically replaced.
+    Processes serving the previous generation keep reading its files, see BM25Engine.reload_if_changed.
+    Term positions are only written for chunks analyzed with the configured analyzer, an index built
+    with another one is rebuilt when it is opened.
+    :param index_file: The index file path.
+    :param documents: The indexed chunks, the chunk id is the list position.
+    :param avgdl: Average chunk length.
+    :param inverted_index: term -> postings of (chunk id, term frequency).
+    :param k1: BM25 term frequency saturation the stored impacts are derived with.
+    :param b: BM25 length normalization the stored impacts are derived with.
+    :param analyzer_signature: The analyzer the terms were produced with, the configured one when None.
+    :param positions: Also write the term positions of every posting, positions from config.ini when None.
+    """
+    terms: List[str] = sorted(inverted_index)
+    matrix: ImpactMatrix = ImpactMatrix.from_inverted_index({term: inverted_index[term] for term in terms},
+                                                            [doc.doc_len for doc in documents], avgdl, k1, b)
+    nnz: int = matrix.term_freqs.nnz
+    index_dtype = np.int32 if max(nnz, len(documents)) < 2 ** 31 else np.int64
+
+    encoded_terms: List[bytes] = [term.encode("utf-8") for term in terms]
+    encoded_docs: List[bytes] = [json.dumps(doc.to_dict()).encode("utf-8") for doc in documents]
+
+    generation: int = next_generation(index_file)
+    build_id: str = new_build_id()
+    store_file: str = get_snapshot_path(get_document_store_path(index_file), generation)
+    store = IndexWriter(store_file)
+    store.add_array("doc_offsets", _offsets(encoded_docs))
+    store.add_array("doc_data", np.frombuffer(b"".join(encoded_docs), dtype=np.uint8))
+    store.close({"N": len(documents), "generation": generation, "build_id": build_id})
+
+    analyzer: Analyzer = get_analyzer()
+    analyzer_signature = analyzer_signature or analyzer.signature
+    positions = get_positions_enabled(CONFIG_PATH) if positions is None else positions
+    positions_file: Optional[str] = None
+    if positions and analyzer_signature == analyzer.signature:
+        positions_file = get_snapshot_path(get_positions_path(index_file), generation)
+        positions_offsets, positions_data = encode_positions(documents, {term: row for row, term in enumerate(terms)},
+                                                             analyzer, nnz)
+        positions_writer = IndexWriter(positions_file)
+        positions_writer.add_array("positions_offsets",
+                                   positions_offsets.astype(np.int32 if positions_data.size < 2 ** 31 else np.int64))
+        positions_writer.add_array("positions_data", positions_data)
+        positions_writer.close({"N": len(documents), "generation": generation, "build_id": build_id})
+
+    writer = IndexWriter(index_file)
+    writer.add_array("vocab_offsets", _offsets(encoded_terms))
+    writer.add_array("vocab_data", np.frombuffer(b"".join(encoded_terms), dtype=np.uint8))
+    writer.add_array("postings_indptr", matrix.term_freqs.indptr.astype(index_dtype))
+    writer.add_array("postings_chunk_ids", matrix.term_freqs.indices.astype(index_dtype))
+    writer.add_array("postings_tfs", matrix.term_freqs.data.astype(np.int32))
+    writer.add_array("impacts", matrix.impacts.data)
+    for name, array in matrix.bounds().items():
+        writer.add_array(name, array)
+    writer.add_array("doc_lens", np.asarray([doc.doc_len for doc in documents], dtype=np.int32))
+    filenames: List[str] = sorted({doc.metadata["filename"] for doc in documents})
+    file_ids: Dict[str, int] = {filename: i for i, filename in enumerate(filenames)}
+    writer.add_array("doc_file_ids", np.asarray([file_ids[doc.metadata["filename"]] for doc in documents], dtype=np.int32))
+    meta: Dict[str, Any] = {"N": len(documents), "avgdl": avgdl, "k1": k1, "b": b, "block_size": BLOCK_SIZE,
+                            "document_store": os.path.basename(store_file),
+                            "filenames": filenames, "generation": generation, "build_id": build_id,
+                            "analyzer": analyzer_signature}
+    if positions_file is not None:
+        meta["positions"] = os.path.basename(positions_file)
+    writer.close(meta)
+    remove_old_snapshots(get_document_store_path(index_file), generation)
+    remove_old_snapshots(get_positions_path(index_file), generation)
+
+
+def convert_pickle_to_mmap(retriever_file: str, index_file: str, k1: float, b: float) -> None:
+    """
+    Converts a pickled retriever file into the memory-mapped index format.
+    :param retriever_file: The pickled retriever file path.
+    :param index_file: The index file path.
+    :param k1: BM25 term frequency saturation the stored impacts are derived with.
+    :param b: BM25 length normalization the stored impacts are derived with.
+    """
+    with open(retriever_file, "rb") as file:
+        state: Dict[str, Any] = pickle.load(file)
+    documents: List[Document] = state.get("documents", [])
+    inverted_index: Optional[InvertedIndex] = state.get("inverted_index")
+    if inverted_index is None:
+        inverted_index = build_inverted_index(documents)
+    # Retriever files written before avgdl was a mean stored the total length, it is recomputed.
+    avgdl: float = sum(doc.doc_len for doc in documents) / len(documents) if documents else 0
+    write_mmap_index(index_file, documents, avgdl, inverted_index, k1, b, state.get("analyzer", LEGACY_SIGNATURE))
+
+
+def _offsets(items: List[bytes]) -> np.ndarray:
+    """Returns the start offset of every item followed by the total length."""
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(item) for item in items), dtype=np.int64, count=len(items)), out=offsets[1:])
+    return offsets
@@ -0,0 +1,178 @@
+"""near_duplicates.py"""
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from converter.Document import Document
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+NUM_PERMUTATIONS: int = 128
+SHINGLE_SIZE: int = 3
+# Minimum probability of two chunks at the threshold similarity to be compared, see lsh_parameters.
+LSH_RECALL: float = 0.95
+# Number of shingles hashed by all permutations at once in NearDuplicateIndex.signatures,
+# bounding the hashes at 8 MB for 128 permutations whatever the size of a file.
+SIGNATURE_SLICE: int = 8192
+_WORD = re.compile(r"\w+")
+_SNIPPET_MARKER: str = "\n Snippet: "
+
+
+def get_near_duplicate_threshold(config_path: str) -> float:
+    """
+    Reads near_duplicate_threshold, the estimated Jaccard similarity of the word shingles from which two chunks
+    are collapsed into one, from the [indexing] section. 0 disables the detection, it is disabled by default.
+    """
+    config = read_config(config_path)
+    threshold: float = config.getfloat("indexing", "near_duplicate_threshold", fallback=0.0)
+    if not 0 <= threshold <= 1:
+        raise ValueError(f"near_duplicate_threshold must be between 0 and 1 in {config_path}, got {threshold}")
+    return threshold
+
+
+def snippet_text(chunk_content: str) -> str:
+    """Returns the text of a chunk without the document and section header the chunker prepends."""
+    return chunk_content.partition(_SNIPPET_MARKER)[2] or chunk_content
+
+
+def shingle_hashes(texts: List[str], size: int = SHINGLE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashes the overlapping runs of size lower-cased words of every text.
+    A text shorter than a shingle is represented by the hashes of its words.
+    :return: The 32-bit shingle hashes of all texts, text after text, and the number of hashes of every text.
+    """
+    word_lists: List[List[str]] = [_WORD.findall(text.lower()) for text in texts]
+    counts: np.ndarray = np.fromiter(map(len, word_lists), dtype=np.int64, count=len(word_lists))
+    words: np.ndarray = np.fromiter((zlib.crc32(word.encode("utf-8")) for word_list in word_lists for word in word_list),
+                                    dtype=np.uint64, count=int(counts.sum()))
+    padded: np.ndarray = np.concatenate((words, np.zeros(size - 1, dtype=np.uint64)))
+    shingles: np.ndarray = np.zeros(words.size, dtype=np.uint64)
+    for offset in range(size):
+        shingles = (shingles * np.uint64(0x9E3779B1) + padded[offset:offset + words.size]) & np.uint64(0xFFFFFFFF)
+
+    # A shingle starting in the last size - 1 words of a text would run into the next text.
+    text_counts: np.ndarray = np.repeat(counts, counts)
+    positions: np.ndarray = np.arange(words.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    short: np.ndarray = text_counts < size
+    hashes: np.ndarray = np.where(short, words, shingles)[short | (positions <= text_counts - size)]
+    return hashes, np.where(counts < size, counts, counts - size + 1)
+
+
+def lsh_parameters(threshold: float, num_permutations: int) -> Tuple[int, int]:
+    """
+    Splits the signature into bands, with as many rows per band as possible while a pair at the threshold
+    similarity still shares a band, and is compared, with probability LSH_RECALL at least.
+    More rows per band make fewer dissimilar pairs share a band.
+    :return: The number of bands and of rows per band.
+    """
+    divisors: List[int] = [rows for rows in range(1, num_permutations + 1) if num_permutations % rows == 0]
+    rows: int = max((rows for rows in divisors
+                     if 1 - (1 - threshold ** rows) ** (num_permutations // rows) >= LSH_RECALL), default=1)
+    return num_permutations // rows, rows
+
+
+class NearDuplicateIndex:
+    """
+    Detects near-duplicate chunks with MinHash signatures of their word shingles and locality-sensitive hashing.
+    Chunks are added one at a time: a chunk whose estimated similarity to an earlier representative reaches
+    the threshold is reported as its duplicate, any other chunk becomes a representative.
+    """
+
+    def __init__(self, threshold: float, num_permutations: int = NUM_PERMUTATIONS, seed: int = 0):
+        """
+        :param threshold: Estimated Jaccard similarity from which chunks are duplicates, in (0, 1].
+        :param num_permutations: Length of the MinHash signatures.
+        :param seed: Seed of the hash functions.
+        """
+        rng = np.random.default_rng(seed)
+        self.threshold: float = threshold
+        # Multiply-shift hash functions of 32-bit values, the products wrap around 64 bits.
+        self.multipliers: np.ndarray = rng.integers(0, 2 ** 64, num_permutations, dtype=np.uint64) | np.uint64(1)
+        self.increments: np.ndarray = rng.integers(0, 2 ** 64, num_permutations, dtype=np.uint64)
+        self.bands, self.rows = lsh_parameters(threshold, num_permutations)
+        # A band is bucketed by a hash of its rows, the offsets keep the buckets of different bands apart.
+        self.band_multipliers: np.ndarray = rng.integers(0, 2 ** 64, self.rows, dtype=np.uint64) | np.uint64(1)
+        self.band_offsets: np.ndarray = rng.integers(0, 2 ** 64, self.bands, dtype=np.uint64)
+        self.buckets: Dict[int, List[int]] = {}
+        self.representatives: Dict[int, np.ndarray] = {}
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Computes the MinHash signatures of texts, e.g. of the chunks of a file.
+        The shingles of all texts are hashed in slices of SIGNATURE_SLICE, a text spanning several slices
+        keeps the minimum of its parts.
+        :return: One signature per row, texts without words all get the same signature.
+        """
+        shingles, lengths = shingle_hashes(texts)
+        signatures: np.ndarray = np.full((len(texts), self.multipliers.size), 2 ** 32, dtype=np.uint64)
+        ends: np.ndarray = np.cumsum(lengths)
+        starts: np.ndarray = ends - lengths
+        for low in range(0, shingles.size, SIGNATURE_SLICE):
+            high: int = min(low + SIGNATURE_SLICE, shingles.size)
+            hashes: np.ndarray = ((np.outer(self.multipliers, shingles[low:high]) + self.increments[:, None])
+                                  >> np.uint64(32))
+            # The texts with shingles in the slice, the first and the last can start or end outside of it.
+            sliced: np.ndarray = np.arange(np.searchsorted(ends, low, side="right"), np.searchsorted(starts, high))
+            sliced = sliced[lengths[sliced] > 0]
+            parts: np.ndarray = np.minimum.reduceat(hashes, np.maximum(starts[sliced], low) - low, axis=1).T
+            signatures[sliced] = np.minimum(signatures[sliced], parts)
+        return signatures
+
+    def find_or_add(self, signatures: np.ndarray, first_key: int) -> List[Optional[int]]:
+        """
+        Looks up the representatives of chunks in order, e.g. of the chunks of a file, a chunk can be
+        the duplicate of an earlier chunk of the same call.
+        The band hashes of all the signatures are computed in one pass.
+        :param signatures: The signatures of the chunk texts, see signatures.
+        :param first_key: The key of the first chunk added as a representative, the next ones get the following keys,
+            e.g. the positions in the corpus of the chunks that are kept.
+        :return: For every chunk the key of the most similar representative at or above the threshold, None when
+            the chunk has none and was added as a representative.
+        """
+        band_keys: List[List[int]] = ((signatures.reshape(len(signatures), self.bands, self.rows)
+                                       * self.band_multipliers).sum(axis=2) + self.band_offsets).tolist()
+        representatives: List[Optional[int]] = []
+        key: int = first_key
+        for signature, chunk_band_keys in zip(signatures, band_keys):
+            candidates = {candidate for band_key in chunk_band_keys for candidate in self.buckets.get(band_key, ())}
+            best: Optional[int] = None
+            best_similarity: float = 0.0
+            for candidate in sorted(candidates):
+                similarity: float = float(np.mean(self.representatives[candidate] == signature))
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best, best_similarity = candidate, similarity
+            representatives.append(best)
+            if best is None:
+                self.representatives[key] = signature
+                for band_key in chunk_band_keys:
+                    self.buckets.setdefault(band_key, []).append(key)
+                key += 1
+        return representatives
+
+
+def location(metadata: Dict[str, str]) -> Dict[str, str]:
+    """Returns where a chunk comes from, its filename and section."""
+    return {"filename": metadata["filename"], "section": metadata.get("section")}
+
+
+def collapse_duplicate(representative: Document, duplicate: Document) -> None:
+    """
+    Records the location of a near-duplicate chunk in the "locations" metadata of its representative,
+    the list of every location of the collapsed chunk starting with its own.
+    The representative gets its own metadata dict on its first duplicate, the shared section dict is not modified.
+    """
+    if "locations" not in representative.metadata:
+        representative.metadata = {**representative.metadata, "locations": [location(representative.metadata)]}
+    representative.metadata["locations"].append(location(duplicate.metadata))
+
+
+def location_filenames(document: Document) -> List[str]:
+    """Returns the markdown files a chunk was collapsed from, only its own for a chunk without duplicates."""
+    locations: Optional[List[Dict[str, str]]] = document.metadata.get("locations")
+    if not locations:
+        return [document.metadata["filename"]]
+    return list(dict.fromkeys(entry["filename"] for entry in locations))
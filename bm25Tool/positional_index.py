@@ -0,0 +1,182 @@
+"""positional_index.py"""
+import re
+from typing import List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+from bm25Tool.compressed_postings import decode_varints, encode_varints
+from converter.Document import Document
+from converter.analyzer import Analyzer
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+DEFAULT_PROXIMITY_WINDOW: int = 8
+DEFAULT_PROXIMITY_BOOST: float = 0.5
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+
+def get_positions_enabled(config_path: str) -> bool:
+    """Reads positions from the [indexing] section, term positions are not stored by default."""
+    config = read_config(config_path)
+    return config.getboolean("indexing", "positions", fallback=False)
+
+
+def get_proximity_settings(config_path: str) -> Tuple[int, float]:
+    """Reads proximity_window (in terms) and proximity_boost from the [query] section."""
+    config = read_config(config_path)
+    return (config.getint("query", "proximity_window", fallback=DEFAULT_PROXIMITY_WINDOW),
+            config.getfloat("query", "proximity_boost", fallback=DEFAULT_PROXIMITY_BOOST))
+
+
+def parse_phrases(query: str, analyzer: Analyzer) -> List[List[str]]:
+    """
+    Returns the terms of the double-quoted phrases of a query. The whole query is one phrase when it has
+    no quoted phrase with terms, e.g. no quotes or an unmatched one.
+    :param query: User input (question or request).
+    :param analyzer: The analyzer the index was built with.
+    """
+    phrases: List[List[str]] = ([terms for terms in map(analyzer.analyze, PHRASE_PATTERN.findall(query)) if terms]
+                                if '"' in query else [])
+    if not phrases:
+        terms: List[str] = analyzer.analyze(query)
+        phrases = [terms] if terms else []
+    return phrases
+
+
+def encode_positions(documents: Sequence[Document], term_rows: Mapping[str, int], analyzer: Analyzer,
+                     num_postings: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compresses the term positions of every posting, in the order of the postings of the index.
+    The positions of a posting are delta encoded varints, the first one is the position itself.
+    :param documents: The indexed chunks, the chunk id is the list position.
+    :param term_rows: term -> row of the postings, rows ordered like the postings.
+    :param analyzer: The analyzer the postings were built with.
+    :param num_postings: The number of postings of the index, to check the positions against.
+    :return: The byte offsets of every posting followed by the total length, and the encoded positions.
+    :raises ValueError: If the terms of the chunks do not match the postings.
+    """
+    chunk_rows: List[np.ndarray] = []
+    for doc in documents:
+        terms: List[str] = analyzer.analyze(doc.chunk_content)
+        chunk_rows.append(np.fromiter((term_rows[term] for term in terms), dtype=np.int64, count=len(terms)))
+    lengths: np.ndarray = np.fromiter(map(len, chunk_rows), dtype=np.int64, count=len(chunk_rows))
+    rows: np.ndarray = np.concatenate(chunk_rows) if chunk_rows else np.zeros(0, dtype=np.int64)
+    chunk_ids: np.ndarray = np.repeat(np.arange(len(chunk_rows)), lengths)
+    positions: np.ndarray = np.arange(rows.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # Postings are ordered by row then chunk id, the positions of a posting ascending.
+    order: np.ndarray = np.lexsort((positions, chunk_ids, rows))
+    rows, chunk_ids, positions = rows[order], chunk_ids[order], positions[order]
+    first: np.ndarray = np.ones(rows.size, dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (chunk_ids[1:] != chunk_ids[:-1])
+    posting_starts: np.ndarray = np.flatnonzero(first)
+    if posting_starts.size != num_postings:
+        raise ValueError(f"The chunk terms give {posting_starts.size} postings, the index has {num_postings}")
+
+    gaps: np.ndarray = positions.copy()
+    gaps[1:] -= positions[:-1]
+    gaps[posting_starts] = positions[posting_starts]
+    data, value_lengths = encode_varints(gaps)
+    value_offsets: np.ndarray = np.zeros(gaps.size + 1, dtype=np.int64)
+    np.cumsum(value_lengths, out=value_offsets[1:])
+    return value_offsets[np.append(posting_starts, gaps.size)], data
+
+
+def intersect_postings(indptr: np.ndarray, chunk_ids: np.ndarray,
+                       rows: Sequence[int]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Intersects the postings of terms.
+    :param indptr: The postings of row r are indptr[r] to indptr[r + 1].
+    :param chunk_ids: The chunk id of every posting.
+    :param rows: The rows of the terms.
+    :return: The chunk ids containing every term and, for every row, the posting numbers of those chunks.
+    """
+    start, end = int(indptr[rows[0]]), int(indptr[rows[0] + 1])
+    candidates: np.ndarray = np.asarray(chunk_ids[start:end])
+    postings: List[np.ndarray] = [np.arange(start, end)]
+    for row in rows[1:]:
+        start, end = int(indptr[row]), int(indptr[row + 1])
+        candidates, kept, found = np.intersect1d(candidates, chunk_ids[start:end], assume_unique=True,
+                                                 return_indices=True)
+        postings = [term_postings[kept] for term_postings in postings]
+        postings.append(start + found)
+    return candidates, postings
+
+
+class PositionalIndex:
+    """
+    The term positions of every posting, see encode_positions.
+    Positions are counted in analyzed terms and are decoded one posting at a time.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        """
+        :param offsets: The positions of posting p are data[offsets[p]:offsets[p + 1]].
+        :param data: The encoded positions.
+        """
+        self.offsets: np.ndarray = offsets
+        self.data: np.ndarray = data
+
+    def positions(self, posting: int) -> np.ndarray:
+        """Returns the ascending positions of a posting."""
+        return np.cumsum(decode_varints(self.data[self.offsets[posting]:self.offsets[posting + 1]]))
+
+    def phrase_matches(self, indptr: np.ndarray, chunk_ids: np.ndarray, rows: Sequence[int]) -> np.ndarray:
+        """
+        Finds the chunks containing the terms at consecutive positions.
+        :param indptr: The postings of row r are indptr[r] to indptr[r + 1].
+        :param chunk_ids: The chunk id of every posting.
+        :param rows: The rows of the phrase terms, in phrase order.
+        :return: The matching chunk ids, ascending.
+        """
+        candidates, postings = intersect_postings(indptr, chunk_ids, rows)
+        matches: List[int] = []
+        for i, chunk_id in enumerate(candidates.tolist()):
+            starts: np.ndarray = self.positions(postings[0][i])
+            for offset in range(1, len(rows)):
+                starts = np.intersect1d(starts, self.positions(postings[offset][i]) - offset, assume_unique=True)
+                if not starts.size:
+                    break
+            if starts.size:
+                matches.append(chunk_id)
+        return np.asarray(matches, dtype=np.int64)
+
+    def min_spans(self, indptr: np.ndarray, chunk_ids: np.ndarray,
+                  rows: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Measures the smallest window holding every term in the chunks that contain them all.
+        :param indptr: The postings of row r are indptr[r] to indptr[r + 1].
+        :param chunk_ids: The chunk id of every posting.
+        :param rows: The distinct rows of the terms.
+        :return: The chunk ids and the length in terms of their smallest window.
+        """
+        candidates, postings = intersect_postings(indptr, chunk_ids, rows)
+        spans: np.ndarray = np.empty(candidates.size, dtype=np.int64)
+        for i in range(candidates.size):
+            term_positions: List[np.ndarray] = [self.positions(term_postings[i]) for term_postings in postings]
+            spans[i] = _min_span(term_positions)
+        return candidates, spans
+
+
+def _min_span(term_positions: List[np.ndarray]) -> int:
+    """Returns the length of the smallest window holding a position of every term, by a sweep over the merged positions."""
+    positions: np.ndarray = np.concatenate(term_positions)
+    terms: np.ndarray = np.repeat(np.arange(len(term_positions)), [p.size for p in term_positions])
+    order: np.ndarray = np.argsort(positions, kind="stable")
+    positions, terms = positions[order].tolist(), terms[order].tolist()
+
+    counts: List[int] = [0] * len(term_positions)
+    covered: int = 0
+    best: int = positions[-1] - positions[0] + 1
+    left: int = 0
+    for right, term in enumerate(terms):
+        counts[term] += 1
+        covered += counts[term] == 1
+        while covered == len(counts):
+            best = min(best, positions[right] - positions[left] + 1)
+            counts[terms[left]] -= 1
+            covered -= counts[terms[left]] == 0
+            left += 1
+    return best
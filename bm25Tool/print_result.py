@@ -2,28 +2,54 @@
 
 import os
 from itertools import groupby
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
 
-from bm25Tool.build_document_index import read_file_content
+from bm25Tool.file_io import read_file_content
+from bm25Tool.metrics import metrics
 from converter.Document import Document
 
 
-def print_results(results: List[Tuple[Document, float]], output_directory: str, show_full_text: bool):
-    """Prints the search results."""
+def other_locations(document: Document) -> Optional[str]:
+    """Returns the "Also in:" line listing the other locations of a collapsed near-duplicate chunk, else None."""
+    locations = document.metadata.get("locations")
+    if not locations:
+        return None
+    return "Also in: " + "; ".join(f"{entry['filename']} ({entry['section']})" for entry in locations[1:])
+
+
+def print_results(results: List[Tuple[Document, float]], output_directory: str, show_full_text: bool,
+                  get_toc: Optional[Callable[[str], Optional[str]]] = None):
+    """
+    Prints the search results.
+    When get_toc is given the tables of content are looked up through it instead of being read from disk.
+    """
+    with metrics.timer("format"):
+        _print_results(results, output_directory, show_full_text, get_toc)
+
+
+def _print_results(results: List[Tuple[Document, float]], output_directory: str, show_full_text: bool,
+                   get_toc: Optional[Callable[[str], Optional[str]]]):
+    """Prints the search results, see print_results."""
     results.sort(key=lambda doc_: doc_[0].metadata['filename'])
     grouped_result = groupby(results, key=lambda doc_: doc_[0].metadata['filename'])
 
     for doc_name, group in grouped_result:
         print(f"========================= {doc_name} ============================")
-        toc_filename: str = doc_name.rsplit(".", 1)[0] + "_toc.md"
-        toc_file_path = os.path.join(output_directory, toc_filename)
-        if os.path.exists(toc_file_path):
-            toc_content: str = read_file_content(toc_file_path)
+        if get_toc is not None:
+            toc_content: Optional[str] = get_toc(doc_name)
+        else:
+            toc_filename: str = doc_name.rsplit(".", 1)[0] + "_toc.md"
+            toc_file_path = os.path.join(output_directory, toc_filename)
+            toc_content = read_file_content(toc_file_path) if os.path.exists(toc_file_path) else None
+        if toc_content is not None:
             print("Table of Content\n" + toc_content + "\n=====\n")
 
         for doc, score in group:
             snippet_content = "\n".join(doc.chunk_content.split("\n")[3:])
             snippet = snippet_content if show_full_text else snippet_content[:100] + '...' + snippet_content[-100:]
+            also_in: Optional[str] = other_locations(doc)
+            if also_in is not None:
+                print(also_in)
             print(f"Relevant Snippet:\n{snippet}\nScore: {score:.1f}\n=====\n")
 
         print("\n============\n")
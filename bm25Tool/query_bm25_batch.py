@@ -0,0 +1,46 @@
+"""query_bm25_batch.py"""
+import argparse
+import json
+import sys
+from logging import Logger
+from typing import List, TextIO
+
+from bm25Tool.metrics import metrics
+from bm25Tool.query_bm25 import TOP_K
+from bm25Tool.query_engine import BM25Engine, get_engine
+from bm25Tool.setup_logger import setup_logger
+
+logger: Logger = setup_logger(__name__)
+
+
+def query_bm25_batch(queries: List[str], top_k: int = TOP_K, output: TextIO = sys.stdout) -> None:
+    """
+    Ranks a batch of queries in one pass and writes one JSON line per query.
+    :param queries: The queries.
+    :param top_k: Number of results per query.
+    :param output: The stream the JSON lines are written to.
+    """
+    engine: BM25Engine = get_engine()
+
+    logger.info(f"Ranking {len(queries)} queries.")
+    rankings = engine.query_batch(queries, top_k)
+
+    for query, results in zip(queries, rankings):
+        hits = [{"filename": doc.metadata["filename"], "section": doc.metadata.get("section"), "score": score}
+                for doc, score in results]
+        output.write(json.dumps({"query": query, "results": hits}) + "\n")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Rank a file of queries, one query per line, with BM25.")
+    parser.add_argument("queries", nargs="?", type=argparse.FileType("r", encoding="utf-8"), default=sys.stdin,
+                        help="File with one query per line, standard input when omitted.")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Number of results per query.")
+    parser.add_argument("--output", type=argparse.FileType("w", encoding="utf-8"), default=sys.stdout,
+                        help="File the JSON lines are written to, standard output when omitted.")
+    parser.add_argument("--metrics", help="Record stage timings and counters and write them to this JSON file.")
+    args = parser.parse_args()
+    metrics.enabled = metrics.enabled or args.metrics is not None
+    query_bm25_batch([line.strip() for line in args.queries if line.strip()], args.top_k, args.output)
+    if args.metrics:
+        metrics.dump(args.metrics)
@@ -0,0 +1,96 @@
+"""query_cache.py"""
+import os
+import pickle
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from bm25Tool.snapshot import atomic_write
+
+# (chunk id, score) pairs of a ranking
+Ranking = List[Tuple[int, float]]
+
+
+def make_cache_key(query_terms: Iterable[str], generation: str, *options: Hashable) -> Tuple:
+    """
+    Returns the cache key of a query.
+    The terms are reduced to a bag, so queries differing only in term order or punctuation share a key.
+    :param query_terms: The cleaned query terms.
+    :param generation: Id of the index the ranking was computed on.
+    :param options: Anything else the ranking depends on, e.g. top_k, the query mode and the BM25 parameters.
+    :return: The key.
+    """
+    return generation, tuple(sorted(Counter(query_terms).items())), options
+
+
+class QueryCache:
+    """
+    A size-bounded LRU cache of query rankings with hit and miss counters.
+    Keys carry the index generation and the scoring parameters, so rankings of a previous index or of
+    other parameters are never returned and age out of the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, cache_file: Optional[str] = None):
+        """
+        Initialize the cache.
+        :param max_size: Maximum number of cached rankings.
+        :param cache_file: File the cache is loaded from and saved to, no persistence when None.
+        """
+        self.max_size: int = max_size
+        self.cache_file: Optional[str] = cache_file
+        self.entries: "OrderedDict[Tuple, Ranking]" = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock = threading.Lock()
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def get(self, key: Tuple) -> Optional[Ranking]:
+        """Returns the cached ranking for the key, or None, and counts the hit or miss."""
+        with self.lock:
+            ranking: Optional[Ranking] = self.entries.get(key)
+            if ranking is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return ranking
+
+    def put(self, key: Tuple, ranking: Ranking) -> None:
+        """Caches a ranking, evicting the least recently used one when full."""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = ranking
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drops every cached ranking."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the cache size and the hit and miss counters."""
+        with self.lock:
+            lookups: int = self.hits + self.misses
+            return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def save(self, cache_file: Optional[str] = None) -> None:
+        """Writes the cached rankings, oldest first, to the cache file."""
+        cache_file = cache_file if cache_file is not None else self.cache_file
+        if cache_file is None:
+            return
+        with self.lock:
+            entries: List[Tuple[Tuple, Ranking]] = list(self.entries.items())
+        with atomic_write(cache_file) as file:
+            pickle.dump(entries, file)
+
+    def load(self, cache_file: str) -> None:
+        """Adds the rankings saved in a cache file, keeping the most recent ones when it holds more than max_size."""
+        with open(cache_file, "rb") as file:
+            entries: List[Tuple[Tuple, Ranking]] = pickle.load(file)
+        for key, ranking in entries:
+            self.put(key, ranking)
@@ -0,0 +1,489 @@
+"""query_engine.py"""
+import atexit
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25Tool.impact_matrix import ImpactMatrix, check_top_k, rank_candidates, rank_scores
+from bm25Tool.metrics import metrics
+from bm25Tool.mmap_index import MmapIndex, convert_pickle_to_mmap, get_index_path
+from bm25Tool.positional_index import PositionalIndex, get_proximity_settings, parse_phrases
+from bm25Tool.query_cache import QueryCache, Ranking, make_cache_key
+from bm25Tool.sharded_engine import ShardError, ShardedEngine, get_num_shards
+from bm25Tool.setup_logger import setup_logger
+from bm25Tool.toc_store import TocStore, get_toc_store_path, load_toc_store
+from bm25Tool.top_k import block_max_wand, score_at_a_time
+from converter.Document import Document
+from converter.analyzer import Analyzer, AnalyzerMismatchError, get_analyzer
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+RETRIEVER_FILE: str = get_settings().retriever_file
+OUTPUT_DIRECTORY: str = get_settings().output_dir
+
+QUERY_MODES: Tuple[str, ...] = ("exhaustive", "wand", "phrase", "proximity", "approximate")
+BATCH_SIZE: int = 256
+DEFAULT_RELOAD_INTERVAL: float = 1.0
+DEFAULT_TIME_BUDGET_MS: float = 5.0
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+def get_reload_interval(config_path: str) -> float:
+    """Reads reload_interval, the seconds between checks for a new index generation, from the [query] section, 0 disables them."""
+    config = read_config(config_path)
+    return config.getfloat("query", "reload_interval", fallback=DEFAULT_RELOAD_INTERVAL)
+
+
+def get_approximate_budgets(config_path: str) -> Tuple[Optional[float], Optional[int]]:
+    """
+    Reads time_budget_ms and max_postings, the budgets of the approximate query mode, from the [query] section.
+    A budget of 0 is no limit, it is returned as None.
+    """
+    config = read_config(config_path)
+    time_budget_ms: float = config.getfloat("query", "time_budget_ms", fallback=DEFAULT_TIME_BUDGET_MS)
+    max_postings: int = config.getint("query", "max_postings", fallback=0)
+    return time_budget_ms or None, max_postings or None
+
+
+def _file_id(path: str) -> Tuple[int, int, int]:
+    """Identifies the file at a path, it changes when a new generation is renamed over it."""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class EngineState:
+    """
+    What queries read from one index generation.
+    A query takes the state of the engine once, so swapping in a new generation never mixes two
+    indexes within a query and never waits for the queries in flight.
+    """
+    __slots__ = ("index", "impact_matrix", "tocs", "generation", "file_id", "sharded", "__weakref__")
+
+    def __init__(self, index: MmapIndex, impact_matrix: ImpactMatrix, tocs: Dict[str, str],
+                 file_id: Optional[Tuple[int, int, int]], sharded: Optional[ShardedEngine] = None):
+        """
+        :param index: The mapped index.
+        :param impact_matrix: The impacts of the index for the engine's k1 and b.
+        :param tocs: TOC content keyed by the filename of the indexed markdown file.
+        :param file_id: The identity of the index file the index was opened from, see _file_id.
+        :param sharded: The shard workers of the index, exhaustive queries are scored in-process when None.
+            They are stopped when the state is garbage collected.
+        """
+        self.index: MmapIndex = index
+        self.impact_matrix: ImpactMatrix = impact_matrix
+        self.tocs: Dict[str, str] = tocs
+        self.generation: str = index.generation
+        self.file_id: Optional[Tuple[int, int, int]] = file_id
+        self.sharded: Optional[ShardedEngine] = None
+        self.set_sharded(sharded)
+
+    def set_sharded(self, sharded: Optional[ShardedEngine]) -> None:
+        """Replaces the shard workers of the state, stopping the previous ones."""
+        previous, self.sharded = self.sharded, sharded
+        if previous is not None:
+            previous.close()
+        if sharded is not None:
+            weakref.finalize(self, sharded.close)
+
+
+def _watch(engine_ref: "weakref.ref[BM25Engine]", interval: float, stop: threading.Event) -> None:
+    """Checks for a new index generation every interval seconds until stopped or the engine is garbage collected."""
+    while not stop.wait(interval):
+        engine: Optional[BM25Engine] = engine_ref()
+        if engine is None:
+            return
+        try:
+            engine.reload_if_changed()
+        except Exception:
+            logger.exception("Loading the new index generation failed, serving the loaded one.")
+        del engine
+
+
+class BM25Engine:
+    """
+    A long-lived BM25 query engine.
+    It maps the index file and loads the tables of content once and serves every query from memory.
+    A background thread swaps in the new generation of the index file when a build replaces it.
+    """
+
+    def __init__(self, retriever_file: str = RETRIEVER_FILE, output_dir: str = OUTPUT_DIRECTORY, refresh: bool = False,
+                 index_file: Optional[str] = None, cache_size: int = 1024, cache_file: Optional[str] = None,
+                 reload_interval: Optional[float] = None, shards: Optional[int] = None):
+        """
+        Initialize the engine and load its state.
+        :param retriever_file: The retriever file path.
+        :param output_dir: The directory holding the converted markdown and TOC files.
+        :param refresh: Rebuild the retriever state instead of loading the saved one.
+        :param index_file: The memory-mapped index path, defaults to the one next to the retriever file.
+        :param cache_size: Number of query rankings kept in the LRU result cache, 0 disables it.
+        :param cache_file: File the result cache is restored from and saved to at exit, so a restart
+            starts warm. The cache is not persisted when None.
+        :param reload_interval: Seconds between checks for a new index generation, reload_interval
+            from config.ini when None, 0 disables them.
+        :param shards: Number of worker processes exhaustive queries are scattered to, see ShardedEngine,
+            shards from config.ini when None. 0 or 1 scores in this process.
+        """
+        self.retriever_file: str = retriever_file
+        self.index_file: str = index_file if index_file else get_index_path(retriever_file)
+        self.output_dir: str = output_dir
+        self.state: Optional[EngineState] = None
+        self.checked_file_id: Optional[Tuple[int, int, int]] = None
+        self.reload_lock = threading.Lock()
+        self.cache: QueryCache = QueryCache(cache_size, cache_file)
+        if cache_file is not None:
+            atexit.register(self.cache.save)
+        self.k1, self.b = get_settings().k1, get_settings().b
+        self.proximity_window, self.proximity_boost = get_proximity_settings(CONFIG_PATH)
+        self.time_budget_ms, self.max_postings = get_approximate_budgets(CONFIG_PATH)
+        self.shards: int = get_num_shards(CONFIG_PATH) if shards is None else shards
+        self.analyzer: Analyzer = get_analyzer()
+        self.load(refresh)
+
+        self.reload_interval: float = get_reload_interval(CONFIG_PATH) if reload_interval is None else reload_interval
+        self.stop_watching = threading.Event()
+        if self.reload_interval > 0:
+            threading.Thread(target=_watch, args=(weakref.ref(self), self.reload_interval, self.stop_watching),
+                             name="bm25-index-watcher", daemon=True).start()
+
+    # Views of the current state for callers outside of a query.
+    @property
+    def index(self) -> MmapIndex:
+        return self.state.index
+
+    @property
+    def documents(self) -> Sequence[Document]:
+        return self.state.index.documents
+
+    @property
+    def N(self) -> int:
+        return self.state.index.N
+
+    @property
+    def avgdl(self) -> float:
+        return self.state.index.avgdl
+
+    @property
+    def impact_matrix(self) -> ImpactMatrix:
+        return self.state.impact_matrix
+
+    @property
+    def generation(self) -> str:
+        return self.state.generation
+
+    @property
+    def tocs(self) -> Dict[str, str]:
+        return self.state.tocs
+
+    def load(self, refresh: bool = False) -> None:
+        """
+        Maps the index file, building the retriever state first if needed, and caches the tables of content.
+        A retriever file saved before the index format existed is converted once, and an index built
+        with another analyzer than the configured one is rebuilt.
+        :param refresh: Rebuild the retriever state and the TOC files.
+        """
+        logger.info("Loading or building retriever state.")
+        rebuild: bool = refresh or not (os.path.exists(self.retriever_file) or os.path.exists(self.index_file))
+        if rebuild:
+            self._build()
+        elif not os.path.exists(self.index_file):
+            logger.info(f"Converting {self.retriever_file} to {self.index_file}")
+            convert_pickle_to_mmap(self.retriever_file, self.index_file, self.k1, self.b)
+
+        with metrics.timer("load"):
+            file_id: Tuple[int, int, int] = _file_id(self.index_file)
+            index: MmapIndex = MmapIndex(self.index_file)
+            try:
+                self.analyzer.check(index.analyzer_signature, self.index_file)
+            except AnalyzerMismatchError as e:
+                logger.warning(f"{e}. Rebuilding the index.")
+                index.close()
+                self._build(full_rebuild=True)
+                rebuild = True
+                file_id = _file_id(self.index_file)
+                index = MmapIndex(self.index_file)
+            with self.reload_lock:
+                self.state = self._open_state(index, file_id)
+                self.checked_file_id = file_id
+        logger.info(f"Engine ready with {self.N} chunks and {len(self.tocs)} tables of content.")
+
+    def _build(self, full_rebuild: bool = False) -> None:
+        """
+        Builds the retriever state and its index.
+        The indexing code is imported here, so processes that only query never load it.
+        :param full_rebuild: Rebuild every file instead of the changed ones.
+        """
+        from bm25Tool.load_build_retriever_file import load_or_build_retriever_state
+        load_or_build_retriever_state(self.retriever_file, refresh=True, full_rebuild=full_rebuild)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Swaps in the generation of the index file written since the state was loaded, if any.
+        The new state is loaded beside the current one and replaces it in one assignment: queries in
+        flight finish on the generation they started with, the next ones use the new one. The files of
+        the previous generation are unmapped once its last query is done. A generation built with
+        another analyzer is not swapped in.
+        :return: True if a new generation was swapped in.
+        """
+        try:
+            file_id: Tuple[int, int, int] = _file_id(self.index_file)
+        except FileNotFoundError:
+            return False
+        if file_id == self.checked_file_id:
+            return False
+        with self.reload_lock:
+            if file_id == self.checked_file_id:
+                return False
+            self.checked_file_id = file_id
+            with metrics.timer("load"):
+                index: MmapIndex = MmapIndex(self.index_file)
+                try:
+                    self.analyzer.check(index.analyzer_signature, self.index_file)
+                except AnalyzerMismatchError as e:
+                    logger.warning(f"{e}. Serving generation {self.generation}.")
+                    index.close()
+                    return False
+                previous: str = self.generation
+                self.state = self._open_state(index, file_id)
+        logger.info(f"Swapped index generation {previous} for {self.generation} with {self.N} chunks.")
+        return True
+
+    def _open_state(self, index: MmapIndex, file_id: Optional[Tuple[int, int, int]]) -> EngineState:
+        """
+        Derives the impacts and their order for the approximate mode, loads the tables of content and starts the
+        shard workers of an opened index. A new generation is prepared completely before it is swapped in.
+        """
+        impact_matrix: ImpactMatrix = index.impact_matrix(self.k1, self.b)
+        impact_matrix.impact_ordered()
+        return EngineState(index, impact_matrix, self._load_tocs(index), file_id, self._start_shards(index))
+
+    def _start_shards(self, index: MmapIndex) -> Optional[ShardedEngine]:
+        """
+        Starts the shard workers of an opened index when the engine is sharded.
+        :return: The workers, None when unsharded or when they failed to start, queries are then scored in-process.
+        """
+        if self.shards <= 1:
+            return None
+        try:
+            return ShardedEngine(self.index_file, self.shards, self.k1, self.b, index=index)
+        except ShardError:
+            logger.exception(f"Starting {self.shards} shards of generation {index.generation} failed, "
+                             f"scoring without shards.")
+            return None
+
+    def close(self) -> None:
+        """Stops checking for new generations, stops the shard workers and unmaps the index."""
+        self.stop_watching.set()
+        state, self.state = self.state, None
+        if state is not None:
+            state.set_sharded(None)
+            state.index.close()
+
+    def set_parameters(self, k1: float, b: float) -> None:
+        """
+        Changes the BM25 parameters, deriving new impacts from the stored term frequencies.
+        The impacts are swapped in with a new state like a new generation, queries in flight finish
+        with the impacts they started with.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        """
+        with self.reload_lock:
+            self.k1, self.b = k1, b
+            state: Optional[EngineState] = self.state
+            if state is not None:
+                impact_matrix: ImpactMatrix = state.index.impact_matrix(k1, b)
+                impact_matrix.impact_ordered()
+                self.state = EngineState(state.index, impact_matrix, state.tocs, state.file_id,
+                                         self._start_shards(state.index))
+        self.cache.clear()
+
+    def _load_tocs(self, index: MmapIndex) -> Dict[str, str]:
+        """
+        Reads the tables of content generated with the index into memory.
+        Indexes built before they were stored get them generated once here.
+        :param index: The opened index.
+        :return: TOC content keyed by the filename of the indexed markdown file.
+        """
+        store: TocStore = load_toc_store(get_toc_store_path(self.index_file))
+        if not all(filename in store for filename in index.filenames):
+            from bm25Tool.toc_store import build_toc_store
+            logger.info("Generate tables of content")
+            store = build_toc_store(self.output_dir, [filename for filename in index.filenames
+                                                      if os.path.exists(os.path.join(self.output_dir, filename))],
+                                    self.index_file)
+        return {filename: entry["toc"] for filename, entry in store.items()}
+
+    def get_toc(self, filename: str) -> Optional[str]:
+        """
+        Returns the cached table of content for an indexed file.
+        :param filename: The filename stored in the chunk metadata.
+        :return: The TOC content or None if the file has no TOC.
+        """
+        return self.tocs.get(filename)
+
+    def query(self, query: str, top_k: Optional[int] = None, mode: str = "exhaustive",
+              time_budget_ms: Optional[float] = None, max_postings: Optional[int] = None) -> List[Tuple[Document, float]]:
+        """
+        Ranks the in-memory documents against the query using the precomputed impacts.
+        :param query: User input (question or request).
+        :param top_k: Maximum number of results, all matching documents when None.
+        :param mode: "exhaustive" scores every matching chunk, "wand" retrieves the top_k with
+            block-max pruning, see block_max_wand, and returns the same ranking. "phrase" only keeps the chunks
+            containing every double-quoted phrase of the query, the whole query when it has no quoted phrase.
+            "proximity" boosts the chunks holding all query terms within the proximity window.
+            Both need an index written with term positions. "approximate" scores impact-ordered postings
+            score-at-a-time until a budget runs out, see score_at_a_time, and returns partial scores.
+        :param time_budget_ms: Time budget of a ranking in the approximate mode, time_budget_ms from config.ini when None.
+        :param max_postings: Postings budget of the approximate mode, max_postings from config.ini when None.
+        :return: A list of (document, score) tuples sorted by descending score.
+        :raises ValueError: For an unknown mode, a top_k that is not None or a positive integer, or a positional
+            mode on an index without positions.
+        """
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {mode}")
+        check_top_k(top_k)
+        state: EngineState = self.state
+        query_terms: List[str] = self._indexed_terms(state, self.analyzer.analyze(query))
+        if mode == "approximate":
+            return self._query_approximate(state, query_terms, top_k, time_budget_ms, max_postings)
+        phrases: Tuple[Tuple[str, ...], ...] = (tuple(map(tuple, parse_phrases(query, self.analyzer)))
+                                                if mode == "phrase" else ())
+        key = make_cache_key(query_terms, state.generation, top_k, mode, phrases,
+                             self._scoring_parameters(state, mode))
+        ranked: Optional[Ranking] = self.cache.get(key)
+        metrics.increment("queries")
+        if ranked is None:
+            with metrics.timer("score"):
+                if mode == "wand" and top_k is not None:
+                    ranked = block_max_wand(state.impact_matrix, query_terms, top_k)
+                elif mode == "phrase":
+                    ranked = self._rank_phrases(state, query_terms, phrases, top_k)
+                elif mode == "proximity":
+                    ranked = self._rank_proximity(state, query_terms, top_k)
+                else:
+                    ranked = self._rank_exhaustive(state, query_terms, top_k)
+            self.cache.put(key, ranked)
+        return [(state.index.documents[chunk_id], score) for chunk_id, score in ranked]
+
+    def _query_approximate(self, state: EngineState, query_terms: List[str], top_k: Optional[int],
+                           time_budget_ms: Optional[float], max_postings: Optional[int]) -> List[Tuple[Document, float]]:
+        """
+        Ranks with the budgets of the approximate mode.
+        The rankings are not cached, with a time budget they depend on the load of the machine.
+        """
+        time_budget_ms = self.time_budget_ms if time_budget_ms is None else time_budget_ms
+        max_postings = self.max_postings if max_postings is None else max_postings
+        metrics.increment("queries")
+        with metrics.timer("score"):
+            ranked: Ranking = score_at_a_time(state.impact_matrix, query_terms, top_k, max_postings or None,
+                                              time_budget_ms / 1000 if time_budget_ms else None)
+        return [(state.index.documents[chunk_id], score) for chunk_id, score in ranked]
+
+    @staticmethod
+    def _rank_exhaustive(state: EngineState, query_terms: List[str], top_k: Optional[int]) -> Ranking:
+        """
+        Ranks every matching chunk, on the shard workers when the state has them.
+        A query whose shard worker died is scored in-process, the worker is restarted for the next ones.
+        """
+        if state.sharded is not None:
+            rows, weights = state.impact_matrix.query_rows(query_terms)
+            try:
+                return state.sharded.rank(rows.tolist(), weights.tolist(), top_k)
+            except ShardError:
+                logger.exception("Scattering the query to the shards failed, scoring without shards.")
+                metrics.increment("shard_failures")
+        return state.impact_matrix.rank(query_terms, top_k)
+
+    @staticmethod
+    def _rank_phrases(state: EngineState, query_terms: List[str], phrases: Sequence[Sequence[str]],
+                      top_k: Optional[int]) -> Ranking:
+        """
+        Ranks the chunks containing every phrase by their BM25 score over all query terms.
+        The phrases are matched by intersecting the positional postings of their terms.
+        """
+        positional: PositionalIndex = state.index.positions()
+        vocabulary = state.impact_matrix.vocabulary
+        scores: np.ndarray = state.impact_matrix.score(query_terms)
+        candidates: np.ndarray = np.flatnonzero(scores)
+        for phrase in phrases:
+            if not all(term in vocabulary for term in phrase):
+                return []
+            candidates = np.intersect1d(candidates, positional.phrase_matches(
+                state.index.array("postings_indptr"), state.index.array("postings_chunk_ids"),
+                [vocabulary[term] for term in phrase]), assume_unique=True)
+        return rank_candidates(candidates, scores[candidates], top_k)
+
+    def _rank_proximity(self, state: EngineState, query_terms: List[str], top_k: Optional[int]) -> Ranking:
+        """
+        Ranks by BM25 score, multiplying the score of a chunk holding every distinct query term within
+        proximity_window terms by 1 + proximity_boost * terms / window length, so adjacent terms get the
+        full boost.
+        """
+        scores: np.ndarray = state.impact_matrix.score(query_terms)
+        rows: List[int] = sorted({state.impact_matrix.vocabulary[term] for term in query_terms})
+        if len(rows) > 1:
+            chunk_ids, spans = state.index.positions().min_spans(
+                state.index.array("postings_indptr"), state.index.array("postings_chunk_ids"), rows)
+            near: np.ndarray = spans <= self.proximity_window
+            scores[chunk_ids[near]] *= 1 + self.proximity_boost * len(rows) / spans[near]
+        return rank_scores(scores, top_k)
+
+    def _scoring_parameters(self, state: EngineState, mode: str) -> Tuple[float, ...]:
+        """
+        Returns the parameters the rankings of a query mode depend on besides the index, they are part of the
+        cache keys so a cache file saved with other parameters is not served after a restart.
+        """
+        if mode == "proximity":
+            return state.impact_matrix.k1, state.impact_matrix.b, self.proximity_window, self.proximity_boost
+        return state.impact_matrix.k1, state.impact_matrix.b
+
+    @staticmethod
+    def _indexed_terms(state: EngineState, query_terms: List[str]) -> List[str]:
+        """Drops the query terms that are not in the vocabulary, they cannot change a ranking."""
+        return [term for term in query_terms if term in state.impact_matrix.vocabulary]
+
+    def query_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        Ranks many queries in one pass over the impacts.
+        Cached rankings are reused and the remaining queries are scored together.
+        :param queries: The queries.
+        :param top_k: Maximum number of results per query, all matching documents when None.
+        :return: The (document, score) ranking of every query, in the order of the queries.
+        :raises ValueError: If top_k is not None or a positive integer.
+        """
+        check_top_k(top_k)
+        state: EngineState = self.state
+        queries_terms: List[List[str]] = [self._indexed_terms(state, self.analyzer.analyze(query)) for query in queries]
+        parameters: Tuple[float, ...] = self._scoring_parameters(state, "exhaustive")
+        keys = [make_cache_key(query_terms, state.generation, top_k, "exhaustive", (), parameters)
+                for query_terms in queries_terms]
+        rankings: List[Optional[Ranking]] = [self.cache.get(key) for key in keys]
+
+        missing: List[int] = [i for i, ranked in enumerate(rankings) if ranked is None]
+        metrics.increment("queries", len(queries))
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch: List[int] = missing[start:start + BATCH_SIZE]
+            with metrics.timer("score"):
+                ranked_batch: List[Ranking] = state.impact_matrix.rank_batch([queries_terms[i] for i in batch], top_k)
+            for i, ranked in zip(batch, ranked_batch):
+                rankings[i] = ranked
+                self.cache.put(keys[i], ranked)
+        return [[(state.index.documents[chunk_id], score) for chunk_id, score in ranked] for ranked in rankings]
+
+
+_engine: Optional[BM25Engine] = None
+
+
+def get_engine() -> BM25Engine:
+    """
+    Returns the engine shared by the CLI and the agent tool in this process, creating it on first use.
+    """
+    global _engine
+    if _engine is None:
+        _engine = BM25Engine()
+    return _engine
@@ -1,26 +1,100 @@
 """ rank_document.py"""
-from typing import List, Dict, Tuple
+import math
+from typing import List, Dict, Tuple, Optional, Sequence, Union
 
-from bm25Tool.calculate_BM25_score import calculate_bm25_score
+import numpy as np
+
+from bm25Tool.calculate_BM25_score import calculate_bm25_score, calculate_term_score, k1 as default_k1, b as default_b
+from bm25Tool.compressed_postings import CompressedInvertedIndex
+from bm25Tool.impact_matrix import ImpactMatrix
+from bm25Tool.inverted_index import InvertedIndex
 from converter.Document import Document
+from converter.analyzer import get_analyzer
 
 
-def rank_documents(query: str, documents: List[Document], N: int, avgdl: float, term_frequency: Dict[str, int]) -> List[
-    Tuple[Document, float]]:
+def rank_documents(query: str, documents: List[Document], N: int, avgdl: float, term_frequency: Dict[str, int],
+                   inverted_index: Optional[Union[InvertedIndex, CompressedInvertedIndex]] = None,
+                   k1: float = default_k1, b: float = default_b) -> List[Tuple[Document, float]]:
     """
     Ranks documents based on relevance to query.
+    When an inverted index is given only the postings of the query terms are scored and
+    documents that contain none of the query terms are left out of the ranking.
+    Compressed postings are decoded and scored one block at a time.
     :param query:
     :param documents:
     :param N:
     :param avgdl:
     :param term_frequency:
+    :param inverted_index: term -> postings of (chunk id, term frequency), or the compressed postings.
+    :param k1: BM25 k1 used with the inverted index.
+    :param b: BM25 b used with the inverted index.
     :return:
     """
-    doc_scores: List[Tuple[Document, float]] = []
+    if isinstance(inverted_index, CompressedInvertedIndex):
+        return _rank_compressed(get_analyzer().analyze(query), documents, N, avgdl, term_frequency, inverted_index, k1, b)
+    if inverted_index is None:
+        doc_scores: List[Tuple[Document, float]] = []
+
+        for doc in documents:
+            score: float = calculate_bm25_score(query, doc, N, avgdl, term_frequency)
+            doc_scores.append((doc, score))
+        return sorted(doc_scores, key=lambda  x: x[1], reverse=True)
+
+    scores: Dict[int, float] = {}
+    for term in get_analyzer().analyze(query):
+        postings = inverted_index.get(term)
+        if not postings:
+            continue
+        df: int = term_frequency.get(term, 1)
+        for chunk_id, tf in postings:
+            term_score: float = calculate_term_score(tf, df, documents[chunk_id].doc_len, N, avgdl, k1, b)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + term_score
+
+    ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+    return [(documents[chunk_id], score) for chunk_id, score in ranked]
+
+
+def _rank_compressed(query_terms: List[str], documents: Sequence[Document], N: int, avgdl: float,
+                     term_frequency: Dict[str, int], inverted_index: CompressedInvertedIndex, k1: float,
+                     b: float) -> List[Tuple[Document, float]]:
+    """
+    Scores the postings of the query terms block by block, with the same arithmetic as calculate_term_score
+    so the ranking equals the one of the uncompressed postings.
+    """
+    scores: np.ndarray = np.zeros(N)
+    matched: np.ndarray = np.zeros(N, dtype=bool)
+    doc_lens: np.ndarray = inverted_index.doc_lens
+    for term in query_terms:
+        if term not in inverted_index:
+            continue
+        df: int = term_frequency.get(term, 1)
+        idf: float = math.log((N - df + 0.5) / (df + 0.5) + 1)
+        for chunk_ids, term_freqs in inverted_index.iter_blocks(term):
+            tf: np.ndarray = term_freqs.astype(np.float64)
+            scores[chunk_ids] += idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc_lens[chunk_ids] / avgdl))))
+            matched[chunk_ids] = True
 
-    for doc in documents:
-        score: float = calculate_bm25_score(query, doc, N, avgdl, term_frequency)
-        doc_scores.append((doc, score))
-    return sorted(doc_scores, key=lambda  x: x[1], reverse=True)
+    chunk_ids: np.ndarray = np.flatnonzero(matched)
+    ranked: np.ndarray = chunk_ids[np.lexsort((chunk_ids, -scores[chunk_ids]))]
+    return [(documents[chunk_id], score) for chunk_id, score in zip(ranked.tolist(), scores[ranked].tolist())]
 
 
+def rank_documents_batch(queries: List[str], k: Optional[int], documents: Sequence[Document], impact_matrix: ImpactMatrix,
+                         batch_size: int = 256) -> List[List[Tuple[Document, float]]]:
+    """
+    Ranks many queries at once.
+    Every query is tokenized once and each batch of queries is scored with a single sparse
+    product of the query-term matrix and the impact matrix.
+    :param queries: The queries.
+    :param k: Number of results per query, all matching documents when None.
+    :param documents: The indexed chunks, the chunk id is the position.
+    :param impact_matrix: The BM25 impacts of the index.
+    :param batch_size: Number of queries scored per sparse product, bounds the memory of the score matrix.
+    :return: The (document, score) ranking of every query, in the order of the queries.
+    """
+    queries_terms: List[List[str]] = [get_analyzer().analyze(query) for query in queries]
+    rankings: List[List[Tuple[Document, float]]] = []
+    for start in range(0, len(queries_terms), batch_size):
+        for ranked in impact_matrix.rank_batch(queries_terms[start:start + batch_size], k):
+            rankings.append([(documents[chunk_id], score) for chunk_id, score in ranked])
+    return rankings
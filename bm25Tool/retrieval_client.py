@@ -0,0 +1,106 @@
+"""retrieval_client.py"""
+import http.client
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class RemoteHit:
+    """
+    A chunk returned by the retrieval server.
+    It answers the attributes of Document that are used to display results, its text is not analyzed.
+    """
+    __slots__ = ("chunk_content", "metadata")
+
+    def __init__(self, chunk_content: str, metadata: Dict[str, Any]):
+        self.chunk_content: str = chunk_content
+        self.metadata: Dict[str, Any] = metadata
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns a dictionary representation of the document.
+        """
+        return {"chunk_content": self.chunk_content, "metadata": self.metadata}
+
+    def __str__(self) -> str:
+        return f"Document(content='{self.chunk_content[:50]}...', metadata={self.metadata})"
+
+
+class RetrievalClient:
+    """
+    A thin client of the retrieval server.
+    It answers query and get_toc like BM25Engine, so BM25Tool can use either.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, timeout: float = 30.0):
+        """
+        Initialize the client, the connection is opened on first use and kept alive.
+        :param host: The server host.
+        :param port: The server port.
+        :param timeout: Socket timeout in seconds.
+        """
+        self.host: str = host
+        self.port: int = port
+        self.timeout: float = timeout
+        self.tocs: Dict[str, Optional[str]] = {}
+        self.connection: Optional[http.client.HTTPConnection] = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_address(cls, address: str) -> "RetrievalClient":
+        """Creates a client for a "host:port" address."""
+        host, _, port = address.rpartition(":")
+        return cls(host or "127.0.0.1", int(port))
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Sends a request, reconnecting once if the kept-alive connection was dropped."""
+        body: Optional[bytes] = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers: Dict[str, str] = {"Content-Type": "application/json"} if body is not None else {}
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self.connection.request(method, path, body, headers)
+                    response = self.connection.getresponse()
+                    data: Dict[str, Any] = json.loads(response.read())
+                    break
+                except TimeoutError:
+                    # The response may still arrive on the connection, it can not be reused.
+                    self.connection.close()
+                    self.connection = None
+                    raise
+                except (http.client.HTTPException, ConnectionError):
+                    self.connection.close()
+                    self.connection = None
+                    if attempt:
+                        raise
+        if response.status != 200:
+            raise RuntimeError(f"Retrieval server error {response.status}: {data.get('error')}")
+        return data
+
+    def query(self, query: str, top_k: Optional[int] = None) -> List[Tuple[RemoteHit, float]]:
+        """
+        Ranks documents on the server.
+        :param query: User input (question or request).
+        :param top_k: Maximum number of results, all matching documents when None.
+        :return: A list of (document, score) tuples sorted by descending score, ties by chunk id.
+        """
+        data: Dict[str, Any] = self._request("POST", "/query", {"query": query, "top_k": top_k})
+        self.tocs.update(data.get("tocs", {}))
+        return [(RemoteHit(hit["chunk_content"], hit["metadata"]), hit["score"]) for hit in data["results"]]
+
+    def get_toc(self, filename: str) -> Optional[str]:
+        """Returns the table of content the server sent along with the results of a file."""
+        return self.tocs.get(filename)
+
+    def health(self) -> Dict[str, Any]:
+        """Returns the server status and counters."""
+        return self._request("GET", "/health")
+
+    def close(self) -> None:
+        """Closes the connection."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
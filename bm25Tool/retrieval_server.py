@@ -0,0 +1,195 @@
+"""retrieval_server.py"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from bm25Tool.impact_matrix import check_top_k
+from bm25Tool.query_engine import BM25Engine, get_engine
+from bm25Tool.setup_logger import setup_logger
+from converter.Document import Document
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8765
+DEFAULT_TOP_K: int = 5
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+class MicroBatcher:
+    """
+    Coalesces queries that arrive within a short window into one batched scoring pass.
+    Batches are scored one at a time in an executor thread so the event loop keeps accepting requests.
+    """
+
+    def __init__(self, engine: BM25Engine, window_ms: float = 2.0, max_batch: int = 64):
+        """
+        Initialize the batcher.
+        :param engine: The engine that scores the batches.
+        :param window_ms: How long the first query of a batch waits for others.
+        :param max_batch: Maximum number of queries per batch.
+        """
+        self.engine: BM25Engine = engine
+        self.window: float = window_ms / 1000
+        self.max_batch: int = max_batch
+        self.queue: "asyncio.Queue[Tuple[str, Optional[int], asyncio.Future]]" = asyncio.Queue()
+        self.requests: int = 0
+        self.batches: int = 0
+
+    async def submit(self, query: str, top_k: Optional[int]) -> List[Tuple[Document, float]]:
+        """Queues a query and waits for its ranking, all matching documents when top_k is None."""
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, top_k, future))
+        return await future
+
+    async def run(self) -> None:
+        """Collects and scores batches until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, Optional[int], asyncio.Future]] = [await self.queue.get()]
+            deadline: float = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout: float = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            queries: List[str] = [query for query, _, _ in batch]
+            top_ks: List[Optional[int]] = [top_k for _, top_k, _ in batch]
+            top_k: Optional[int] = None if None in top_ks else max(top_ks)
+            try:
+                rankings = await loop.run_in_executor(None, self.engine.query_batch, queries, top_k)
+            except Exception as e:
+                logger.exception("Batch scoring failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.requests += len(batch)
+            self.batches += 1
+            for (_, request_top_k, future), ranking in zip(batch, rankings):
+                if not future.done():
+                    future.set_result(ranking[:request_top_k])
+
+
+class RetrievalServer:
+    """
+    A local HTTP/1.1 server holding one resident index.
+
+    POST /query with {"query": str, "top_k": int} returns {"results": [{"score", "metadata",
+    "chunk_content"}], "tocs": {filename: toc}}; GET /health returns the index generation and counters.
+    top_k is 5 when omitted and null ranks every matching chunk, as BM25Engine.query does with None.
+    """
+
+    def __init__(self, engine: BM25Engine, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 window_ms: float = 2.0, max_batch: int = 64):
+        """
+        Initialize the server.
+        :param engine: The engine serving the queries.
+        :param host: The interface to listen on, loopback by default.
+        :param port: The port to listen on, 0 picks a free port.
+        :param window_ms: Micro-batching window.
+        :param max_batch: Maximum number of queries per batch.
+        """
+        self.engine: BM25Engine = engine
+        self.host: str = host
+        self.port: int = port
+        self.batcher = MicroBatcher(engine, window_ms, max_batch)
+        self.server: Optional[asyncio.base_events.Server] = None
+        self.batcher_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Starts listening and batching, the bound port is stored in self.port."""
+        self.batcher_task = asyncio.create_task(self.batcher.run())
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Retrieval server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        """Stops listening and batching."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher_task is not None:
+            self.batcher_task.cancel()
+
+    async def serve_forever(self) -> None:
+        """Starts the server and serves until cancelled."""
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves the requests of one keep-alive connection."""
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    line: bytes = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body: bytes = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self._route(method, path, body)
+                data: bytes = json.dumps(payload).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[str, Dict[str, Any]]:
+        """Dispatches a request and returns the status line and the JSON payload."""
+        if method == "GET" and path == "/health":
+            return "200 OK", {"status": "ok", "generation": self.engine.generation, "chunks": self.engine.N,
+                              "requests": self.batcher.requests, "batches": self.batcher.batches,
+                              "cache": self.engine.cache.stats()}
+        if method != "POST" or path != "/query":
+            return "404 Not Found", {"error": f"No route for {method} {path}"}
+        try:
+            request: Dict[str, Any] = json.loads(body)
+            query: str = request["query"]
+            top_k: Optional[int] = request.get("top_k", DEFAULT_TOP_K)
+            if not isinstance(query, str):
+                raise TypeError(f"query must be a string, got {query!r}")
+            # Checked before batching, a bad top_k would fail every query of its batch.
+            check_top_k(top_k)
+        except (ValueError, KeyError, TypeError) as e:
+            return "400 Bad Request", {"error": f"Invalid query request: {e}"}
+        try:
+            results = await self.batcher.submit(query, top_k)
+        except Exception as e:
+            return "500 Internal Server Error", {"error": str(e)}
+
+        filenames = {doc.metadata["filename"] for doc, _ in results}
+        return "200 OK", {
+            "results": [{"score": score, "metadata": doc.metadata, "chunk_content": doc.chunk_content}
+                        for doc, score in results],
+            "tocs": {filename: self.engine.get_toc(filename) for filename in filenames},
+        }
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Serve BM25 queries from one resident index over local HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--window-ms", type=float, default=2.0, help="Micro-batching window in milliseconds.")
+    parser.add_argument("--max-batch", type=int, default=64, help="Maximum number of queries scored together.")
+    args = parser.parse_args()
+    asyncio.run(RetrievalServer(get_engine(), args.host, args.port, args.window_ms, args.max_batch).serve_forever())
@@ -0,0 +1,126 @@
+"""sentence_segmenter.py"""
+import re
+from typing import Dict, FrozenSet, List, Optional, Sequence, Union
+
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+SEGMENTERS: Sequence[str] = ("punkt", "regex")
+DEFAULT_SEGMENTER: str = "punkt"
+
+# Lower-cased tokens, without their final period, that end with a period without ending a sentence.
+ABBREVIATIONS: FrozenSet[str] = frozenset("""
+mr mrs ms dr prof sr jr st vs etc e.g i.e a.m p.m cf al approx appx dept est fig figs eq eqs no nos vol vols
+p pp ch sec ref refs inc ltd co corp jan feb mar apr jun jul aug sep sept oct nov dec min max
+""".split())
+
+# Sentence punctuation, optional closing quotes or brackets, and the whitespace after them.
+_BOUNDARY = re.compile(r"([.!?]+)([\"')\]]*)\s+")
+# Longest token checked against the abbreviations, longer ones always end a sentence.
+_MAX_ABBREVIATION_LENGTH: int = 16
+
+
+class RegexSegmenter:
+    """
+    Rule-based sentence segmentation in one pass of a compiled regex.
+    A sentence ends at ".", "!" or "?" followed by whitespace, unless the token before a period is
+    an abbreviation, a single letter (an initial) or a number (a list item).
+    """
+
+    def __init__(self, abbreviations: FrozenSet[str] = ABBREVIATIONS):
+        """
+        :param abbreviations: Lower-cased abbreviations without their final period.
+        """
+        self.abbreviations: FrozenSet[str] = abbreviations
+
+    def segment(self, text: str) -> List[str]:
+        """Returns the sentences of a text without the whitespace between them."""
+        sentences: List[str] = []
+        start: int = 0
+        for match in _BOUNDARY.finditer(text):
+            if match.group(1) == ".":
+                before: str = text[max(match.start() - _MAX_ABBREVIATION_LENGTH, start):match.start()]
+                word: str = before.rsplit(None, 1)[-1].lstrip("\"'([").lower() if before.strip() else ""
+                if word in self.abbreviations or (len(word) == 1 and word.isalpha()) or word.isdigit():
+                    continue
+            sentence: str = text[start:match.end(2)].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        sentence = text[start:].strip()
+        if sentence:
+            sentences.append(sentence)
+        return sentences
+
+    def segment_batch(self, texts: Sequence[str]) -> List[List[str]]:
+        """Returns the sentences of every text, e.g. of all the sections of a file."""
+        return [self.segment(text) for text in texts]
+
+
+class PunktSegmenter:
+    """
+    NLTK's Punkt sentence segmentation, with the model loaded once per process.
+    It produces the same sentences as nltk.sent_tokenize.
+    """
+
+    def __init__(self, language: str = "english"):
+        """
+        :param language: The Punkt model.
+        :raises LookupError: If the Punkt data is not installed.
+        """
+        import nltk
+        try:
+            from nltk.tokenize import PunktTokenizer
+            self.tokenizer = PunktTokenizer(language)
+        except ImportError:
+            # NLTK before 3.8.2 ships the model as a pickle.
+            self.tokenizer = nltk.data.load(f"tokenizers/punkt/{language}.pickle")
+
+    def segment(self, text: str) -> List[str]:
+        """Returns the sentences of a text without the whitespace between them."""
+        return self.tokenizer.tokenize(text)
+
+    def segment_batch(self, texts: Sequence[str]) -> List[List[str]]:
+        """Returns the sentences of every text, e.g. of all the sections of a file."""
+        tokenize = self.tokenizer.tokenize
+        return [tokenize(text) for text in texts]
+
+
+Segmenter = Union[RegexSegmenter, PunktSegmenter]
+
+
+def get_segmenter_name(config_path: str) -> str:
+    """Reads sentence_segmenter from the [indexing] section, "punkt" or "regex"."""
+    config = read_config(config_path)
+    name: str = config.get("indexing", "sentence_segmenter", fallback=DEFAULT_SEGMENTER)
+    if name not in SEGMENTERS:
+        raise ValueError(f"Unknown sentence segmenter {name!r} in {config_path}, expected one of {SEGMENTERS}")
+    return name
+
+
+_segmenters: Dict[str, Segmenter] = {}
+_configured_name: Optional[str] = None
+
+
+def get_segmenter(name: Optional[str] = None) -> Segmenter:
+    """
+    Returns a sentence segmenter shared by the indexing code of this process, creating it on first use.
+    :param name: "punkt" or "regex", sentence_segmenter from config.ini when None.
+    """
+    global _configured_name
+    if name is None:
+        if _configured_name is None:
+            _configured_name = get_segmenter_name(CONFIG_PATH)
+        name = _configured_name
+    segmenter: Optional[Segmenter] = _segmenters.get(name)
+    if segmenter is None:
+        if name == "regex":
+            segmenter = RegexSegmenter()
+        elif name == "punkt":
+            segmenter = PunktSegmenter()
+        else:
+            raise ValueError(f"Unknown sentence segmenter: {name}")
+        _segmenters[name] = segmenter
+    return segmenter
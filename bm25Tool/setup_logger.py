@@ -3,24 +3,31 @@ import os
 import logging
 from logging import Logger
 
-from config_reader import get_base_directory
+from settings import get_settings
 
 
-BASE_DIR: str = get_base_directory()
-CONFIG_PATH: str = os.path.join(BASE_DIR, "config.ini")
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
 
 
 def setup_logger(name: str) -> Logger:
-    """Sets up a logger for the module."""
+    """
+    Sets up a logger for the module.
+    Calling it again with the same name returns the configured logger without adding another handler,
+    and the log file is appended to so a run does not truncate the lines written earlier.
+    """
     log_file_name: str = os.path.basename(name)
     log_file_path: str = os.path.join(BASE_DIR, "logs", f"{log_file_name}.log")
 
     logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
     logger.setLevel(logging.INFO)
 
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
-    file_handler = logging.FileHandler(log_file_path, mode="w", encoding="utf-8")
+    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+    file_handler = logging.FileHandler(log_file_path, mode="a", encoding="utf-8")
     file_handler.setFormatter(formatter)
 
     logger.addHandler(file_handler)
@@ -0,0 +1,242 @@
+"""sharded_engine.py"""
+import heapq
+import logging
+import multiprocessing
+import threading
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from bm25Tool.impact_matrix import check_top_k, rank_candidates
+from bm25Tool.mmap_index import MmapIndex
+from bm25Tool.setup_logger import setup_logger
+from converter.Document import Document
+from converter.analyzer import Analyzer, get_analyzer
+from settings import read_config
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+class ShardError(RuntimeError):
+    """Raised when a shard worker died, or was started on another index generation than the coordinator's."""
+
+
+def get_num_shards(config_path: str) -> int:
+    """
+    Reads shards, the number of worker processes exhaustive queries are scattered to, from the [query] section.
+    0 or 1 scores in the querying process, it is the default.
+    """
+    config = read_config(config_path)
+    shards: int = config.getint("query", "shards", fallback=0)
+    if shards < 0:
+        raise ValueError(f"shards must not be negative in {config_path}, got {shards}")
+    return shards
+
+
+def partition_by_document(file_ids: np.ndarray, num_shards: int) -> List[np.ndarray]:
+    """
+    Splits the chunks into shards without splitting a source document.
+    Documents are assigned largest first to the shard with the fewest chunks.
+    :param file_ids: The source document of every chunk.
+    :param num_shards: Number of shards.
+    :return: The sorted global chunk ids of every shard.
+    """
+    chunk_counts: np.ndarray = np.bincount(file_ids) if file_ids.size else np.zeros(0, dtype=np.int64)
+    shard_sizes: List[Tuple[int, int]] = [(0, shard) for shard in range(num_shards)]
+    shard_of_file: np.ndarray = np.zeros(chunk_counts.size, dtype=np.int64)
+    for file_id in np.argsort(-chunk_counts, kind="stable"):
+        size, shard = heapq.heappop(shard_sizes)
+        shard_of_file[file_id] = shard
+        heapq.heappush(shard_sizes, (size + int(chunk_counts[file_id]), shard))
+    chunk_shards: np.ndarray = shard_of_file[file_ids]
+    return [np.flatnonzero(chunk_shards == shard) for shard in range(num_shards)]
+
+
+def _shard_worker(connection: Connection, index_file: str, chunk_ids: np.ndarray, k1: float, b: float) -> None:
+    """
+    Holds one shard resident and answers scatter requests until told to stop.
+    The generation of the index file it opened is sent once the shard is loaded.
+    The shard keeps the columns of its chunks from the global impact matrix, so its impacts use the
+    global N, document frequencies and avgdl and its scores equal the unsharded ones.
+    """
+    index = MmapIndex(index_file)
+    impacts: csr_matrix = index.impact_matrix(k1, b).impacts[:, chunk_ids].tocsr()
+    impacts.sort_indices()
+    generation: str = index.generation
+    del index
+    connection.send(generation)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        rows, weights, top_k = message
+        scores: np.ndarray = np.zeros(chunk_ids.size)
+        for row, weight in zip(rows, weights):
+            start, end = impacts.indptr[row], impacts.indptr[row + 1]
+            scores[impacts.indices[start:end]] += weight * impacts.data[start:end]
+        candidates: np.ndarray = np.flatnonzero(scores)
+        ranked = rank_candidates(candidates, scores[candidates], top_k)
+        connection.send([(int(chunk_ids[local_id]), score) for local_id, score in ranked])
+    connection.close()
+
+
+class ShardedEngine:
+    """
+    Scatter-gather BM25 over document shards held by worker processes.
+    The coordinator maps the query to term rows once, every worker ranks its shard in parallel
+    and the per-shard top-k lists are merged into the global top-k.
+    A worker that dies is restarted, the query it was answering raises ShardError.
+    """
+
+    def __init__(self, index_file: str, num_shards: int, k1: float, b: float, index: Optional[MmapIndex] = None):
+        """
+        Partitions the index and starts one worker per shard.
+        :param index_file: The memory-mapped index path.
+        :param num_shards: Number of shards and worker processes.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 length normalization.
+        :param index: The index opened from index_file by the caller, which keeps ownership of it.
+            The index file is opened here when None.
+        :raises AnalyzerMismatchError: If the index was built with another analyzer.
+        :raises ShardError: If a worker failed to start or opened another generation of the index file.
+        """
+        self.index_file: str = index_file
+        self.owns_index: bool = index is None
+        self.index: MmapIndex = MmapIndex(index_file) if index is None else index
+        self.k1, self.b = k1, b
+        self.analyzer: Analyzer = get_analyzer()
+        self.analyzer.check(self.index.analyzer_signature, index_file)
+        self.documents = self.index.documents
+        self.vocabulary = self.index.vocabulary
+        self.shards: List[np.ndarray] = partition_by_document(self.index.chunk_file_ids(), num_shards)
+        self.connections: List[Optional[Connection]] = [None] * num_shards
+        self.workers: List[Optional[multiprocessing.Process]] = [None] * num_shards
+        # A pipe carries one request and one reply at a time.
+        self.lock = threading.Lock()
+        try:
+            for shard in range(num_shards):
+                self._start_worker(shard)
+            for shard in range(num_shards):
+                self._wait_ready(shard)
+        except ShardError:
+            self.close()
+            raise
+        logger.info(f"Started {num_shards} shards of sizes {[shard.size for shard in self.shards]}")
+
+    def _start_worker(self, shard: int) -> None:
+        """Starts the worker process of a shard, see _wait_ready."""
+        parent, child = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=_shard_worker, args=(child, self.index_file, self.shards[shard],
+                                                                     self.k1, self.b), daemon=True)
+        worker.start()
+        # The worker holds the only other end, so its death ends the pipe.
+        child.close()
+        self.connections[shard], self.workers[shard] = parent, worker
+
+    def _wait_ready(self, shard: int) -> None:
+        """
+        Waits until the worker of a shard holds its impacts.
+        :raises ShardError: If it died, or opened another generation than the coordinator's index.
+        """
+        try:
+            generation: str = self.connections[shard].recv()
+        except (EOFError, OSError) as e:
+            raise ShardError(f"Shard {shard} worker exited while starting") from e
+        if generation != self.index.generation:
+            raise ShardError(f"Shard {shard} worker opened generation {generation} of {self.index_file}, "
+                             f"expected {self.index.generation}")
+
+    def _restart_worker(self, shard: int) -> None:
+        """Replaces the worker of a shard, leaving it stopped when the new one fails to start."""
+        self._stop_worker(shard)
+        try:
+            self._start_worker(shard)
+            self._wait_ready(shard)
+        except ShardError:
+            logger.exception(f"Restarting shard {shard} failed.")
+            self._stop_worker(shard)
+
+    def _stop_worker(self, shard: int) -> None:
+        """Closes the pipe of a shard and ends its worker."""
+        connection, worker = self.connections[shard], self.workers[shard]
+        self.connections[shard] = self.workers[shard] = None
+        if connection is not None:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        if worker is not None:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+    def rank(self, rows: Sequence[int], weights: Sequence[float], top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Ranks the chunks of every shard.
+        :param rows: The term rows of the query.
+        :param weights: The count of every term row in the query.
+        :param top_k: Maximum number of results, all matching chunks when None.
+        :return: (chunk id, score) pairs by descending score, ties by ascending chunk id.
+        :raises ShardError: If a worker died, it is restarted for the next queries.
+        :raises ValueError: If top_k is not None or a positive integer, it is checked before reaching the workers.
+        """
+        check_top_k(top_k)
+        with self.lock:
+            failed: List[int] = []
+            for shard, connection in enumerate(self.connections):
+                try:
+                    if connection is None:
+                        raise OSError("stopped")
+                    connection.send((rows, weights, top_k))
+                except OSError:
+                    failed.append(shard)
+            shard_results: List[List[Tuple[int, float]]] = []
+            for shard, connection in enumerate(self.connections):
+                if shard in failed:
+                    continue
+                try:
+                    shard_results.append(connection.recv())
+                except (EOFError, OSError):
+                    failed.append(shard)
+            if failed:
+                for shard in failed:
+                    self._restart_worker(shard)
+                raise ShardError(f"Shard workers {sorted(failed)} exited")
+        merged = heapq.merge(*shard_results, key=lambda hit: (-hit[1], hit[0]))
+        return list(merged) if top_k is None else [hit for _, hit in zip(range(top_k), merged)]
+
+    def query(self, query: str, top_k: Optional[int] = None) -> List[Tuple[Document, float]]:
+        """
+        Ranks the documents of every shard against the query.
+        :param query: User input (question or request).
+        :param top_k: Maximum number of results, all matching documents when None.
+        :return: A list of (document, score) tuples sorted by descending score, ties by chunk id.
+        :raises ShardError: If a worker died.
+        """
+        terms: List[str] = self.analyzer.analyze(query)
+        counts: Dict[int, int] = {}
+        for term in terms:
+            row: Optional[int] = self.vocabulary.get(term)
+            if row is not None:
+                counts[row] = counts.get(row, 0) + 1
+        ranked = self.rank(list(counts), [float(count) for count in counts.values()], top_k)
+        return [(self.documents[chunk_id], score) for chunk_id, score in ranked]
+
+    def close(self) -> None:
+        """Stops the workers, and closes the index when it was opened here."""
+        with self.lock:
+            for shard in range(len(self.connections)):
+                self._stop_worker(shard)
+        if self.owns_index:
+            self.index.close()
+
+    def __enter__(self) -> "ShardedEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
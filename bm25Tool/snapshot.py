@@ -0,0 +1,67 @@
+"""snapshot.py"""
+import contextlib
+import glob
+import os
+import re
+import uuid
+from typing import IO, Iterator, Optional
+
+# Generations of the side files kept next to the index, readers still serving the previous
+# generation can open its files while the new one is swapped in.
+KEEP_SNAPSHOTS: int = 2
+
+
+def get_temp_path(path: str) -> str:
+    """Returns a unique temporary path in the directory of path, so it can be renamed over path."""
+    return f"{path}.{uuid.uuid4().hex[:12]}.tmp"
+
+
+def sync_file(file: IO) -> None:
+    """Flushes a file to disk, so it is complete once it has been renamed."""
+    file.flush()
+    os.fsync(file.fileno())
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wb", encoding: Optional[str] = None) -> Iterator[IO]:
+    """
+    Opens a temporary file that replaces path when the block completes.
+    Readers see either the previous file or the complete new one, never a partially written file.
+    The temporary file is removed if the block raises.
+    :param path: The file path.
+    :param mode: A write mode, "wb" or "w".
+    :param encoding: The text encoding for "w".
+    """
+    temp_path: str = get_temp_path(path)
+    try:
+        with open(temp_path, mode, encoding=encoding) as file:
+            yield file
+            sync_file(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+
+def get_snapshot_path(path: str, generation: int) -> str:
+    """Returns the path of the given generation of a file, e.g. retriever.00000003.docstore for retriever.docstore."""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{generation:08d}{extension}"
+
+
+def remove_old_snapshots(path: str, generation: int, keep: int = KEEP_SNAPSHOTS) -> None:
+    """
+    Removes the generations of a file older than the last keep ones.
+    Processes that still map a removed file keep reading it until they unmap it.
+    :param path: The unnumbered file path, see get_snapshot_path.
+    :param generation: The newest generation.
+    :param keep: Number of generations to keep.
+    """
+    root, extension = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"\.(\d{8})" + re.escape(extension) + "$")
+    for snapshot in glob.glob(f"{glob.escape(root)}.*{glob.escape(extension)}"):
+        match = pattern.match(os.path.basename(snapshot))
+        if match and int(match.group(1)) <= generation - keep:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(snapshot)
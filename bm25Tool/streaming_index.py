@@ -0,0 +1,259 @@
+"""streaming_index.py"""
+import heapq
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from bm25Tool.build_document_index import FILE_TYPES, convert_files_to_markdown, is_indexed_markdown, iter_sections, \
+    split_section_into_chunks
+from bm25Tool.impact_matrix import BLOCK_SIZE
+from bm25Tool.mmap_index import IndexWriter, get_document_store_path, new_build_id, next_generation
+from bm25Tool.setup_logger import setup_logger
+from bm25Tool.snapshot import get_snapshot_path, remove_old_snapshots
+from bm25Tool.toc_store import build_toc_store
+from converter.Document import Document
+from converter.analyzer import get_analyzer
+
+logger: logging.Logger = setup_logger(__file__)
+
+DEFAULT_MEMORY_BUDGET_MB: int = 256
+# Rough resident cost of one buffered posting (two int32 array slots) and of one buffered term.
+POSTING_BYTES: int = 8
+TERM_BYTES: int = 200
+_RUN_TERM = struct.Struct("<II")
+
+# term -> (chunk ids, term frequencies)
+PostingsBuffer = Dict[str, Tuple[array, array]]
+
+
+def iter_markdown_files(output_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yields the (path, filename) of every indexed markdown file, in filename order."""
+    for filename in sorted(os.listdir(output_dir)):
+        if is_indexed_markdown(filename):
+            yield os.path.join(output_dir, filename), filename
+
+
+def iter_file_sections(filepath: str) -> Iterator[Tuple[str, str]]:
+    """Yields the sections of a markdown file while reading it line by line."""
+    with open(filepath, "r", encoding="UTF-8") as file:
+        yield from iter_sections(line.rstrip("\n") for line in file)
+
+
+def iter_chunks(output_dir: str) -> Iterator[Document]:
+    """Yields the chunk documents of every indexed markdown file, one section at a time."""
+    for filepath, filename in iter_markdown_files(output_dir):
+        for section_title, section_content in iter_file_sections(filepath):
+            metadata: Dict[str, str] = {"filename": filename, "section": section_title}
+            yield from split_section_into_chunks((section_title, section_content), metadata)
+
+
+def write_run(buffer: PostingsBuffer, run_file: str) -> None:
+    """
+    Writes buffered postings sorted by term.
+    Each term is stored as its byte length, its postings count, the term and the chunk id and tf arrays.
+    """
+    with open(run_file, "wb") as file:
+        for term in sorted(buffer):
+            chunk_ids, term_freqs = buffer[term]
+            encoded: bytes = term.encode("utf-8")
+            file.write(_RUN_TERM.pack(len(encoded), len(chunk_ids)))
+            file.write(encoded)
+            chunk_ids.tofile(file)
+            term_freqs.tofile(file)
+
+
+def iter_run(run_file: str) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """Yields the (term, chunk ids, term frequencies) of a run file in term order."""
+    with open(run_file, "rb") as file:
+        while True:
+            prefix: bytes = file.read(_RUN_TERM.size)
+            if not prefix:
+                return
+            term_length, count = _RUN_TERM.unpack(prefix)
+            term: str = file.read(term_length).decode("utf-8")
+            chunk_ids: np.ndarray = np.fromfile(file, dtype="<i4", count=count)
+            term_freqs: np.ndarray = np.fromfile(file, dtype="<i4", count=count)
+            yield term, chunk_ids, term_freqs
+
+
+def merge_runs(run_files: List[str]) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Merges sorted runs into one postings list per term.
+    Runs are written in chunk id order, so concatenating a term's postings in run order keeps them sorted.
+    """
+    merged = heapq.merge(*(((term, run, chunk_ids, term_freqs) for term, chunk_ids, term_freqs in iter_run(run_file))
+                           for run, run_file in enumerate(run_files)), key=lambda entry: (entry[0], entry[1]))
+    current: Optional[str] = None
+    parts: List[Tuple[np.ndarray, np.ndarray]] = []
+    for term, _, chunk_ids, term_freqs in merged:
+        if term != current and parts:
+            yield current, np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+            parts = []
+        current = term
+        parts.append((chunk_ids, term_freqs))
+    if parts:
+        yield current, np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+
+
+def build_streaming_index(input_dir: str, output_dir: str, index_file: str, k1: float, b: float,
+                          memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB) -> int:
+    """
+    Builds the memory-mapped index with bounded memory (single-pass in-memory indexing).
+    Chunks stream from file to section to chunk to postings; postings are buffered until the
+    memory budget is reached and then flushed as a sorted run to disk. Chunk records go straight
+    to a temporary file. At the end the runs are merged term by term into the index file, so
+    neither the documents nor the full postings are ever held in memory at once. The tables of
+    content of added or changed files are generated next to the index.
+    :param input_dir: The directory of the source documents.
+    :param output_dir: The directory of the converted markdown files.
+    :param index_file: The index file path.
+    :param k1: BM25 term frequency saturation the stored impacts are derived with.
+    :param b: BM25 length normalization the stored impacts are derived with.
+    :param memory_budget_mb: Memory allowed for buffered postings before a run is flushed.
+    :return: The number of indexed chunks.
+    """
+    convert_files_to_markdown(input_dir, output_dir, FILE_TYPES)
+    work_dir: str = tempfile.mkdtemp(prefix="bm25_spimi_", dir=os.path.dirname(os.path.abspath(index_file)))
+    try:
+        budget: int = memory_budget_mb * 1024 * 1024
+        run_files: List[str] = []
+        buffer: PostingsBuffer = {}
+        buffered: int = 0
+        doc_lens = array("i")
+        doc_offsets = array("q", [0])
+        doc_file_ids = array("i")
+        filenames: List[str] = []
+        total_postings: int = 0
+
+        with open(os.path.join(work_dir, "doc_data"), "wb") as doc_data:
+            for chunk_id, chunk in enumerate(iter_chunks(output_dir)):
+                record: bytes = json.dumps(chunk.to_dict()).encode("utf-8")
+                doc_data.write(record)
+                doc_offsets.append(doc_offsets[-1] + len(record))
+                doc_lens.append(chunk.doc_len)
+                if not filenames or filenames[-1] != chunk.metadata["filename"]:
+                    filenames.append(chunk.metadata["filename"])
+                doc_file_ids.append(len(filenames) - 1)
+
+                term_freq: Dict[str, int] = chunk.compute_term_freq()
+                for term, tf in term_freq.items():
+                    postings = buffer.get(term)
+                    if postings is None:
+                        postings = buffer[term] = (array("i"), array("i"))
+                        buffered += TERM_BYTES
+                    postings[0].append(chunk_id)
+                    postings[1].append(tf)
+                    buffered += POSTING_BYTES
+                total_postings += len(term_freq)
+
+                if buffered >= budget:
+                    run_files.append(_flush_run(buffer, work_dir, len(run_files)))
+                    buffer, buffered = {}, 0
+            if buffer:
+                run_files.append(_flush_run(buffer, work_dir, len(run_files)))
+                buffer = {}
+
+        N: int = len(doc_lens)
+        avgdl: float = sum(doc_lens) / N if N else 0
+        logger.info(f"Inverted {N} chunks into {len(run_files)} runs, merging into {index_file}")
+        build_toc_store(output_dir, filenames, index_file)
+        _write_index(index_file, work_dir, run_files, np.asarray(doc_lens, dtype=np.int32), doc_offsets,
+                     np.asarray(doc_file_ids, dtype=np.int32), total_postings, avgdl, k1, b, filenames)
+        return N
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _flush_run(buffer: PostingsBuffer, work_dir: str, run: int) -> str:
+    """Writes the buffer as the next run file and returns its path."""
+    run_file: str = os.path.join(work_dir, f"run_{run:05d}")
+    write_run(buffer, run_file)
+    logger.info(f"Flushed run {run} with {len(buffer)} terms")
+    return run_file
+
+
+def _write_index(index_file: str, work_dir: str, run_files: List[str], doc_lens: np.ndarray, doc_offsets: array,
+                 doc_file_ids: np.ndarray, total_postings: int, avgdl: float, k1: float, b: float,
+                 filenames: List[str]) -> None:
+    """
+    Merges the runs term by term into section files and assembles the index file from them.
+    The index is written as a new generation, see mmap_index.write_mmap_index.
+    """
+    N: int = doc_lens.size
+    index_dtype = np.int32 if max(total_postings, N) < 2 ** 31 else np.int64
+    length_norms: np.ndarray = k1 * (1 - b + b * (doc_lens / (avgdl if avgdl else 1.0)))
+
+    names: List[str] = ["vocab_data", "postings_chunk_ids", "postings_tfs", "impacts", "block_max", "block_last"]
+    files: Dict[str, BinaryIO] = {name: open(os.path.join(work_dir, name), "wb") for name in names}
+    vocab_offsets = array("q", [0])
+    indptr = array("q", [0])
+    block_ptr = array("q", [0])
+    term_max = array("d")
+    try:
+        for term, chunk_ids, term_freqs in merge_runs(run_files):
+            encoded: bytes = term.encode("utf-8")
+            files["vocab_data"].write(encoded)
+            vocab_offsets.append(vocab_offsets[-1] + len(encoded))
+
+            df: int = chunk_ids.size
+            idf: float = np.log((N - df + 0.5) / (df + 0.5) + 1)
+            impacts: np.ndarray = idf * ((term_freqs * (k1 + 1)) / (term_freqs + length_norms[chunk_ids]))
+            block_starts: np.ndarray = np.arange(0, df, BLOCK_SIZE)
+            block_max: np.ndarray = np.maximum.reduceat(impacts, block_starts)
+
+            chunk_ids.astype(index_dtype).tofile(files["postings_chunk_ids"])
+            term_freqs.astype("<i4").tofile(files["postings_tfs"])
+            impacts.astype("<f8").tofile(files["impacts"])
+            block_max.astype("<f8").tofile(files["block_max"])
+            chunk_ids[np.minimum(block_starts + BLOCK_SIZE, df) - 1].astype(index_dtype).tofile(files["block_last"])
+            indptr.append(indptr[-1] + df)
+            block_ptr.append(block_ptr[-1] + block_starts.size)
+            term_max.append(float(block_max.max()))
+    finally:
+        for file in files.values():
+            file.close()
+
+    generation: int = next_generation(index_file)
+    build_id: str = new_build_id()
+    store_file: str = get_snapshot_path(get_document_store_path(index_file), generation)
+    store = IndexWriter(store_file)
+    store.add_array("doc_offsets", np.frombuffer(doc_offsets, dtype=np.int64))
+    store.add_array_file("doc_data", np.uint8, os.path.join(work_dir, "doc_data"))
+    store.close({"N": N, "generation": generation, "build_id": build_id})
+
+    writer = IndexWriter(index_file)
+    writer.add_array("vocab_offsets", np.frombuffer(vocab_offsets, dtype=np.int64))
+    writer.add_array_file("vocab_data", np.uint8, files["vocab_data"].name)
+    writer.add_array("postings_indptr", np.frombuffer(indptr, dtype=np.int64).astype(index_dtype))
+    writer.add_array_file("postings_chunk_ids", index_dtype, files["postings_chunk_ids"].name)
+    writer.add_array_file("postings_tfs", np.int32, files["postings_tfs"].name)
+    writer.add_array_file("impacts", np.float64, files["impacts"].name)
+    writer.add_array("term_max", np.frombuffer(term_max, dtype=np.float64))
+    writer.add_array("block_ptr", np.frombuffer(block_ptr, dtype=np.int64))
+    writer.add_array_file("block_max", np.float64, files["block_max"].name)
+    writer.add_array_file("block_last", index_dtype, files["block_last"].name)
+    writer.add_array("doc_lens", doc_lens)
+    writer.add_array("doc_file_ids", doc_file_ids)
+    writer.close({"N": N, "avgdl": avgdl, "k1": k1, "b": b, "block_size": BLOCK_SIZE,
+                  "document_store": os.path.basename(store_file),
+                  "filenames": filenames, "generation": generation, "build_id": build_id,
+                  "analyzer": get_analyzer().signature})
+    remove_old_snapshots(get_document_store_path(index_file), generation)
+
+
+if __name__=="__main__":
+    from bm25Tool.calculate_BM25_score import k1, b
+    from bm25Tool.load_build_retriever_file import DATA_PATH, OUTPUT_PATH
+    from bm25Tool.mmap_index import get_index_path
+    from bm25Tool.query_engine import RETRIEVER_FILE
+
+    budget_mb: int = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEMORY_BUDGET_MB
+    build_streaming_index(DATA_PATH, OUTPUT_PATH, get_index_path(RETRIEVER_FILE), k1, b, budget_mb)
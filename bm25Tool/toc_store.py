@@ -0,0 +1,74 @@
+"""toc_store.py"""
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from bm25Tool.file_io import read_file_content
+from bm25Tool.setup_logger import setup_logger
+from bm25Tool.snapshot import atomic_write
+
+# {filename: {"sha256": hash of the markdown file the TOC was generated from, "toc": str}}
+TocStore = Dict[str, Dict[str, str]]
+
+logger: logging.Logger = setup_logger(__file__)
+
+
+def get_toc_store_path(index_file: str) -> str:
+    """Returns the path of the tables of content stored next to the index file."""
+    return os.path.splitext(index_file)[0] + ".tocs.json"
+
+
+def load_toc_store(toc_store_path: str) -> TocStore:
+    """Loads the stored tables of content, an empty store if the file does not exist."""
+    if not os.path.exists(toc_store_path):
+        return {}
+    with open(toc_store_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_toc_store(store: TocStore, toc_store_path: str) -> None:
+    """Writes the tables of content atomically."""
+    with atomic_write(toc_store_path, "w", encoding="utf-8") as file:
+        json.dump(store, file)
+
+
+def update_toc_store(output_dir: str, filenames: Iterable[str], store: TocStore,
+                     fingerprints: Optional[Dict[str, Dict[str, Any]]] = None) -> TocStore:
+    """
+    Brings the tables of content up to date with the markdown files, generating only those of
+    added or changed files.
+    :param output_dir: The directory of the converted markdown files.
+    :param filenames: The indexed markdown filenames.
+    :param store: The tables of content of the last build.
+    :param fingerprints: Manifest entries of the markdown files, fingerprinted here when missing.
+    :return: The tables of content of the indexed files.
+    """
+    # Imported here, so processes that only read the store never load the indexing code.
+    from bm25Tool.gen_toc import generate_toc
+    from bm25Tool.manifest import fingerprint_file
+    updated: TocStore = {}
+    generated: int = 0
+    for filename in filenames:
+        filepath: str = os.path.join(output_dir, filename)
+        fingerprint: Optional[Dict[str, Any]] = (fingerprints or {}).get(filename) or fingerprint_file(filepath)
+        previous: Optional[Dict[str, str]] = store.get(filename)
+        if previous is not None and previous["sha256"] == fingerprint["sha256"]:
+            updated[filename] = previous
+        else:
+            updated[filename] = {"sha256": fingerprint["sha256"], "toc": generate_toc(read_file_content(filepath))}
+            generated += 1
+    logger.info(f"Generated {generated} tables of content, reused {len(updated) - generated}.")
+    return updated
+
+
+def build_toc_store(output_dir: str, filenames: Iterable[str], index_file: str,
+                    fingerprints: Optional[Dict[str, Dict[str, Any]]] = None) -> TocStore:
+    """
+    Updates and saves the tables of content stored next to an index, see update_toc_store.
+    :return: The tables of content of the indexed files.
+    """
+    toc_store_path: str = get_toc_store_path(index_file)
+    store: TocStore = update_toc_store(output_dir, filenames, load_toc_store(toc_store_path), fingerprints)
+    save_toc_store(store, toc_store_path)
+    return store
@@ -0,0 +1,159 @@
+"""top_k.py"""
+import heapq
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from bm25Tool.impact_matrix import ImpactMatrix, rank_candidates
+
+# Relative slack on the upper bounds, so float rounding of a bound never prunes a document
+# whose exact score ties the threshold.
+_BOUND_SLACK: float = 1e-9
+# Number of impact-ordered postings of the first segment of a term in score_at_a_time, every next segment of the
+# term is twice as long up to MAX_SEGMENT_SIZE. The budgets are checked between segments.
+SEGMENT_SIZE: int = 256
+MAX_SEGMENT_SIZE: int = 16384
+# Share of the time budget of score_at_a_time left for ranking the scored chunks, scoring stops when the rest
+# has passed. Both take time proportional to the number of postings scored.
+RANKING_SHARE: float = 0.5
+# Minimum number of blocks with the largest maxima whose chunks block_max_wand scores first.
+SEED_BLOCKS: int = 8
+
+
+def _score_chunks(matrix: ImpactMatrix, rows: np.ndarray, weights: np.ndarray, chunk_ids: np.ndarray) -> np.ndarray:
+    """
+    Scores candidate chunks by binary search of their postings in every query term.
+    The term contributions are added in query term order, as ImpactMatrix.score adds them.
+    :param chunk_ids: Ascending candidate chunk ids.
+    :return: The score of every candidate.
+    """
+    indptr, indices, data = matrix.impacts.indptr, matrix.impacts.indices, matrix.impacts.data
+    scores: np.ndarray = np.zeros(chunk_ids.size)
+    for row, weight in zip(rows, weights):
+        start, end = int(indptr[row]), int(indptr[row + 1])
+        positions: np.ndarray = start + np.searchsorted(indices[start:end], chunk_ids)
+        found: np.ndarray = positions < end
+        found[found] = indices[positions[found]] == chunk_ids[found]
+        scores[found] += weight * data[positions[found]]
+    return scores
+
+
+def _sorted_unique(chunk_ids: np.ndarray) -> np.ndarray:
+    """Returns the distinct chunk ids ascending, sorting is faster than the hashing of np.unique."""
+    chunk_ids = np.sort(chunk_ids)
+    return chunk_ids[np.append(True, chunk_ids[1:] != chunk_ids[:-1])] if chunk_ids.size else chunk_ids
+
+
+def _block_postings(matrix: ImpactMatrix, row: int, blocks: np.ndarray) -> np.ndarray:
+    """Returns the chunk ids of the postings of some blocks of a term, see ImpactMatrix._compute_bounds."""
+    start, end = int(matrix.impacts.indptr[row]), int(matrix.impacts.indptr[row + 1])
+    block_starts: np.ndarray = start + blocks * matrix.block_size
+    lengths: np.ndarray = np.minimum(block_starts + matrix.block_size, end) - block_starts
+    postings: np.ndarray = np.arange(int(lengths.sum())) + np.repeat(block_starts - (np.cumsum(lengths) - lengths),
+                                                                     lengths)
+    return matrix.impacts.indices[postings]
+
+
+def block_max_wand(matrix: ImpactMatrix, query_terms: List[str], k: int) -> List[Tuple[int, float]]:
+    """
+    Retrieves the k best chunks with block-max pruning.
+    The chunks of the blocks with the largest maxima of all terms are scored first, their k-th score is
+    the threshold. Terms whose upper bounds add up to less than the threshold cannot make a chunk
+    on their own, so candidates only come from the other terms, and only from their blocks whose maximum
+    plus the bounds of every other term reaches the threshold. The candidates are scored by binary search
+    in the postings of every term. Only the block arrays and the postings of the candidate blocks are read
+    in full, the result is identical to ranking every chunk and keeping k.
+    :param matrix: The impact matrix with its score bounds.
+    :param query_terms: The cleaned query terms.
+    :param k: Number of results.
+    :return: (chunk id, score) pairs by descending score, ties by ascending chunk id.
+    """
+    rows, weights = matrix.query_rows(query_terms)
+    if k <= 0 or rows.size == 0:
+        return []
+    max_scores: np.ndarray = weights * matrix.term_max[rows]
+    block_maxima: List[np.ndarray] = [weight * matrix.block_max[matrix.block_ptr[row]:matrix.block_ptr[row + 1]]
+                                      for row, weight in zip(rows, weights)]
+
+    # The chunks of the blocks with the largest maxima over all terms give the first threshold.
+    all_maxima: np.ndarray = np.concatenate(block_maxima)
+    if not all_maxima.size:
+        return []
+    num_seeds: int = min(max(SEED_BLOCKS, -(-k // matrix.block_size)), all_maxima.size)
+    cutoff: float = np.partition(all_maxima, all_maxima.size - num_seeds)[all_maxima.size - num_seeds]
+    seeds: np.ndarray = _sorted_unique(np.concatenate(
+        [_block_postings(matrix, int(row), np.flatnonzero(maxima >= cutoff)) for row, maxima in zip(rows, block_maxima)]))
+    seed_scores: np.ndarray = _score_chunks(matrix, rows, weights, seeds)
+    threshold: float = float(np.partition(seed_scores, seeds.size - k)[seeds.size - k]) if seeds.size >= k else 0.0
+
+    # Bounds strictly below the threshold only, a chunk tying the k-th score may still rank before it.
+    by_bound: np.ndarray = np.argsort(max_scores, kind="stable")
+    non_essential: np.ndarray = np.cumsum(max_scores[by_bound]) * (1 + _BOUND_SLACK) < threshold
+    total: float = float(max_scores.sum())
+    candidates: List[np.ndarray] = [seeds]
+    for term in by_bound[~non_essential]:
+        blocks: np.ndarray = np.flatnonzero(
+            (block_maxima[term] + (total - max_scores[term])) * (1 + _BOUND_SLACK) >= threshold)
+        candidates.append(_block_postings(matrix, int(rows[term]), blocks))
+    chunk_ids: np.ndarray = _sorted_unique(np.concatenate(candidates))
+    return rank_candidates(chunk_ids, _score_chunks(matrix, rows, weights, chunk_ids), k)
+
+
+def score_at_a_time(matrix: ImpactMatrix, query_terms: List[str], k: Optional[int],
+                    max_postings: Optional[int] = None, time_budget: Optional[float] = None) -> List[Tuple[int, float]]:
+    """
+    Retrieves approximately the k best chunks by score-at-a-time processing of impact-ordered postings.
+    The postings of every query term are taken in descending impact order in segments of growing length,
+    see SEGMENT_SIZE, and the segment starting with the largest weighted impact of all terms is scored next.
+    The largest contributions are accumulated first, so stopping early mostly misses the low-impact tail.
+    Scoring stops when every posting is scored or a budget runs out, the ranking is exact without budgets.
+    The time budget covers the ranking of the scored chunks, see RANKING_SHARE, and is checked between segments.
+    :param matrix: The impact matrix, see ImpactMatrix.impact_ordered.
+    :param query_terms: The cleaned query terms.
+    :param k: Number of results, all scored chunks when None.
+    :param max_postings: Maximum number of postings scored, no limit when None.
+    :param time_budget: Seconds the retrieval should take at most, no limit when None.
+    :return: (chunk id, partial score) pairs by descending score, ties by ascending chunk id.
+    """
+    deadline: Optional[float] = None
+    if time_budget is not None:
+        deadline = time.perf_counter() + time_budget * (1 - RANKING_SHARE)
+    rows, weights = matrix.query_rows(query_terms)
+    if (k is not None and k <= 0) or rows.size == 0:
+        return []
+    indptr: np.ndarray = matrix.impacts.indptr
+    chunk_ids, impacts = matrix.impact_ordered()
+    # max-heap of (-weighted impact of the next posting, query term, next posting, end of the postings, segment length)
+    heap: List[Tuple[float, int, int, int, int]] = []
+    for i, (row, weight) in enumerate(zip(rows, weights)):
+        start, end = int(indptr[row]), int(indptr[row + 1])
+        if start < end:
+            heap.append((-weight * impacts[start], i, start, end, SEGMENT_SIZE))
+    heapq.heapify(heap)
+
+    scores: np.ndarray = matrix.accumulator()
+    # The chunks scored first by every segment, impacts are positive so their accumulated score is still zero.
+    scored_ids: List[np.ndarray] = []
+    try:
+        remaining: Optional[int] = max_postings
+        while heap and (remaining is None or remaining > 0):
+            _, i, start, end, length = heapq.heappop(heap)
+            stop: int = min(start + length, end)
+            if remaining is not None:
+                stop = min(stop, start + remaining)
+                remaining -= stop - start
+            segment: np.ndarray = chunk_ids[start:stop]
+            scored_ids.append(segment[scores[segment] == 0])
+            scores[segment] += weights[i] * impacts[start:stop]
+            if stop < end:
+                heapq.heappush(heap, (-weights[i] * impacts[stop], i, stop, end, min(2 * length, MAX_SEGMENT_SIZE)))
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+        candidates: np.ndarray = np.concatenate(scored_ids) if scored_ids else np.empty(0, dtype=np.int64)
+        return rank_candidates(candidates, scores[candidates], k)
+    finally:
+        # The accumulator is reused by the next query of the thread.
+        for chunk_ids_scored in scored_ids:
+            scores[chunk_ids_scored] = 0
@@ -1,21 +1,57 @@
+import sys
 from collections import Counter
 from dataclasses import dataclass, field
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 from typing_extensions import LiteralString
 
-from converter.clean_text import clean_text
+from converter.analyzer import VOCABULARY, get_analyzer
 
 
-@dataclass
+class MetadataTable:
+    """
+    Shares one metadata dict between all the chunks with the same metadata, i.e. the chunks of a section,
+    across builds, incremental updates and loads of the in-memory corpus.
+    The streaming build does not intern its chunks, it keeps no table. The shared dicts must not be modified.
+    """
+    __slots__ = ("entries",)
+
+    def __init__(self):
+        self.entries: Dict[Tuple[Tuple[str, Any], ...], Dict[str, Any]] = {}
+
+    def intern(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the shared dict equal to metadata, adding metadata to the table when it is new."""
+        try:
+            key: Tuple[Tuple[str, Any], ...] = tuple(metadata.items())
+            shared: Optional[Dict[str, Any]] = self.entries.get(key)
+        except TypeError:
+            # Unhashable values are not shared.
+            return metadata
+        if shared is None:
+            shared = self.entries[key] = {sys.intern(name): sys.intern(value) if isinstance(value, str) else value
+                                          for name, value in metadata.items()}
+        return shared
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+# The metadata of the chunks of this process, per file and section.
+METADATA = MetadataTable()
+
+
+@dataclass(slots=True)
 class Document:
     """
     A class representation of a document object.
+    The distinct terms are held as interned term ids (see converter.analyzer.VOCABULARY) with their counts
+    until they are folded into an index, see drop_terms. Indexed chunks share their metadata dict, see MetadataTable.
     """
     chunk_content: str
     metadata: Dict[str, str]
-    clean_terms: List[str] = field(default_factory=list, init=False)
-    term_freq: Dict[str, int] = field(default_factory=dict, init=False)
+    term_ids: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
+    term_counts: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
     doc_len: int = field(default=0, init=False)
 
     def __post_init__(self):
@@ -40,32 +76,61 @@ class Document:
             "metadata": self.metadata,
         }
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Pickles the text, the metadata and the length, the terms are in the pickled index.
+        """
+        return {"chunk_content": self.chunk_content, "metadata": self.metadata, "doc_len": self.doc_len}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Restores a pickled document without its terms, including documents pickled with their term frequencies.
+        """
+        self.chunk_content, self.metadata = state["chunk_content"], METADATA.intern(state["metadata"])
+        self.term_ids = self.term_counts = None
+        doc_len: Optional[int] = state.get("doc_len")
+        if doc_len is None:
+            term_freq: Optional[Dict[str, int]] = state.get("term_freq")
+            doc_len = sum(term_freq.values()) if term_freq is not None else len(self.compute_clean_terms())
+        self.doc_len = doc_len
+
     def compute_clean_terms(self) -> List[str]:
         """
-        Computes and returns the clean terms from a text.
+        Computes and returns the clean terms from a text, running the analyzer on every call.
         """
-        self.clean_terms: List[str] = clean_text(self.chunk_content).split()
-        return self.clean_terms
+        return get_analyzer().analyze(self.chunk_content)
 
     def compute_term_freq(self) -> Dict[str, int]:
         """
-        Computes and returns the term frequency.
+        Returns the term frequencies keyed by term, decoded from the term ids.
+        Once the terms have been dropped they are computed from the text, running the analyzer on every call.
         """
-        self.term_freq = Counter(self.clean_terms)
-        return self.term_freq
+        if self.term_ids is None:
+            return dict(Counter(self.compute_clean_terms()))
+        return dict(zip(map(VOCABULARY.terms.__getitem__, self.term_ids.tolist()), self.term_counts.tolist()))
 
     def compute_doc_len(self) -> int:
         """
         Computes and returns the document length.
         """
-        self.doc_len = len(self.clean_terms)
+        self.doc_len = int(self.term_counts.sum())
         return self.doc_len
 
     def update_derived_attributes(self):
       """
       Computes all derived attributes.
       """
-      self.compute_clean_terms()
-      self.compute_term_freq()
+      self.term_ids, self.term_counts = self._encode_term_freq(Counter(self.compute_clean_terms()))
       self.compute_doc_len()
 
+    def drop_terms(self) -> None:
+        """
+        Releases the term ids and counts once they have been added to an index, doc_len is kept.
+        """
+        self.term_ids = self.term_counts = None
+
+    @staticmethod
+    def _encode_term_freq(term_freq: Dict[str, int]) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the term ids and the counts of term frequencies as int32 arrays."""
+        return (VOCABULARY.encode(term_freq.keys()),
+                np.fromiter(term_freq.values(), dtype=np.int32, count=len(term_freq)))
@@ -0,0 +1,141 @@
+"""analyzer.py"""
+import sys
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+from converter.clean_text import clean_text
+from settings import get_settings, read_config
+
+BASE_DIR: str = get_settings().base_dir
+CONFIG_PATH: str = get_settings().config_path
+
+ANALYZER_VERSION: int = 1
+STEM_CACHE_SIZE: int = 1 << 17
+
+ENGLISH_STOPWORDS: FrozenSet[str] = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+class AnalyzerMismatchError(ValueError):
+    """Raised when an index was built with another analyzer than the one querying it."""
+
+
+class Analyzer:
+    """
+    Turns text into index terms: lower-casing and punctuation removal, then optional stopword removal
+    and optional Porter stemming. Stems are memoized, the vocabulary of a corpus is small compared to
+    its number of tokens.
+    """
+
+    def __init__(self, stemming: bool = False, stopwords: bool = False):
+        """
+        :param stemming: Reduce terms to their Porter stem.
+        :param stopwords: Drop English stopwords.
+        """
+        self.stemming: bool = stemming
+        self.stopwords: FrozenSet[str] = ENGLISH_STOPWORDS if stopwords else frozenset()
+        self.stem: Optional[Callable[[str], str]] = None
+        if stemming:
+            from nltk.stem import PorterStemmer
+            self.stem = lru_cache(maxsize=STEM_CACHE_SIZE)(PorterStemmer().stem)
+
+    @property
+    def signature(self) -> Dict[str, Any]:
+        """Describes the analysis, an index must be queried with an analyzer of the same signature."""
+        return {"version": ANALYZER_VERSION, "normalizer": "lowercase_strip_punctuation",
+                "stemmer": "porter" if self.stemming else None,
+                "stopwords": "english" if self.stopwords else None}
+
+    def analyze(self, text: str) -> List[str]:
+        """
+        Returns the terms of a text, in order and with repetitions.
+        :param text: A chunk or a query.
+        """
+        terms: List[str] = clean_text(text).split()
+        if self.stopwords:
+            terms = [term for term in terms if term not in self.stopwords]
+        if self.stem is not None:
+            terms = [self.stem(term) for term in terms]
+        return terms
+
+    def check(self, signature: Optional[Dict[str, Any]], source: str) -> None:
+        """
+        Raises AnalyzerMismatchError when an index was not built with this analyzer.
+        :param signature: The signature stored with the index, None for indexes written before it was stored.
+        :param source: The index file, for the error message.
+        """
+        signature = LEGACY_SIGNATURE if signature is None else signature
+        if signature != self.signature:
+            raise AnalyzerMismatchError(f"{source} was built with analyzer {signature}, "
+                                        f"queries use {self.signature}")
+
+
+class Vocabulary:
+    """
+    Interns terms to dense integer ids so documents hold their terms as compact int arrays until they are indexed.
+    The postings and the queries are keyed by the term strings, mapped to the rows of the index.
+    Every distinct term string is stored once. Ids are only meaningful within one process.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.ids
+
+    def add(self, term: str) -> int:
+        """Returns the id of a term, assigning the next id to a new term."""
+        term_id: Optional[int] = self.ids.get(term)
+        if term_id is None:
+            with self.lock:
+                term_id = self.ids.get(term)
+                if term_id is None:
+                    term_id = len(self.terms)
+                    self.terms.append(sys.intern(term))
+                    self.ids[self.terms[term_id]] = term_id
+        return term_id
+
+    def encode(self, terms: Iterable[str]) -> np.ndarray:
+        """Returns the ids of the terms as an int32 array, adding the new ones."""
+        ids: Dict[str, int] = self.ids
+        return np.fromiter((ids[term] if term in ids else self.add(term) for term in terms), dtype=np.int32)
+
+    def term(self, term_id: int) -> str:
+        """Returns the term of an id."""
+        return self.terms[term_id]
+
+
+def get_analyzer_settings(config_path: str) -> Dict[str, bool]:
+    """Reads the [analyzer] section: stemming and stopwords, both off by default."""
+    config = read_config(config_path)
+    return {"stemming": config.getboolean("analyzer", "stemming", fallback=False),
+            "stopwords": config.getboolean("analyzer", "stopwords", fallback=False)}
+
+
+# The analysis of indexes written before the signature was stored in them.
+LEGACY_SIGNATURE: Dict[str, Any] = Analyzer().signature
+
+VOCABULARY: Vocabulary = Vocabulary()
+_analyzer: Optional[Analyzer] = None
+
+
+def get_analyzer() -> Analyzer:
+    """Returns the analyzer configured in config.ini, shared by indexing and querying."""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = Analyzer(**get_analyzer_settings(CONFIG_PATH))
+    return _analyzer
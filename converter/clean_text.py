@@ -2,6 +2,9 @@
 
 import string
 
+# Built once, str.maketrans is too costly to repeat for every chunk and query.
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
 
 # A text cleaning function
 def clean_text(text: str)->str:
@@ -10,9 +13,4 @@ def clean_text(text: str)->str:
     :param text: A text.
     :return: A text.
     """
-    lower_case_text: str = text.lower()
-    translated_text: str = lower_case_text.translate(str.maketrans("","",string.punctuation))
-    # TODO
-    # Do stemming operation
-    return translated_text
-
+    return text.lower().translate(PUNCTUATION_TABLE)
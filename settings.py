@@ -0,0 +1,47 @@
+"""settings.py"""
+import configparser
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+from config_reader import get_base_directory, get_bm25_parameters, get_chunk_size, get_data_dir, get_output_dir, \
+    get_retriever_file
+
+
+@dataclass(frozen=True)
+class Settings:
+    """The locations and parameters of config.ini, read once per process, see get_settings."""
+    base_dir: str
+    config_path: str
+    data_dir: str
+    output_dir: str
+    retriever_file: str
+    chunk_size: int
+    k1: float
+    b: float
+
+
+@lru_cache(maxsize=None)
+def read_config(config_path: str) -> configparser.ConfigParser:
+    """
+    Parses a config file once, the sections read by the modules all come from the same parser.
+    The parser is shared and must not be modified.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return config
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Returns the settings of config.ini in the base directory, reading them on first use."""
+    base_dir: str = get_base_directory()
+    config_path: str = os.path.join(base_dir, "config.ini")
+    k1, b = get_bm25_parameters(config_path)
+    return Settings(base_dir=base_dir,
+                    config_path=config_path,
+                    data_dir=os.path.join(base_dir, get_data_dir(config_path)),
+                    output_dir=os.path.join(base_dir, get_output_dir(config_path)),
+                    retriever_file=os.path.join(base_dir, get_retriever_file(config_path)),
+                    chunk_size=get_chunk_size(config_path),
+                    k1=k1, b=b)
@@ -0,0 +1,177 @@
+"""test_equivalence.py"""
+import os
+import pickle
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+from benchmarks.corpus import generate_corpus, generate_queries
+from bm25Tool.build_document_index import build_document_index
+from bm25Tool.calculate_BM25_score import b, k1
+from bm25Tool.incremental_index import build_manifest, update_document_index
+from bm25Tool.mmap_index import MmapIndex, convert_pickle_to_mmap, write_mmap_index
+from bm25Tool.query_engine import BM25Engine
+from bm25Tool.streaming_index import build_streaming_index
+from bm25Tool.toc_store import build_toc_store
+
+NUM_FILES: int = 6
+NUM_SECTIONS: int = 5
+VOCAB_SIZE: int = 2000
+TOP_K: int = 10
+
+Hits = List[Tuple[str, float]]
+
+
+def _hits(results) -> Hits:
+    """Returns the texts and scores of a ranking, comparable across indexes."""
+    return [(document.chunk_content, score) for document, score in results]
+
+
+def _assert_same_ranking(hits: Hits, expected: Hits) -> None:
+    """Asserts the same chunks in the same order, with scores equal up to float rounding."""
+    assert [text for text, _ in hits] == [text for text, _ in expected]
+    assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
+
+
+def _assert_same_scores(engine: BM25Engine, other: BM25Engine, query: str) -> None:
+    """
+    Asserts that two indexes of the same chunks score them alike. Their chunk ids can differ, which only
+    reorders ties, so the top scores and the scores of all matching chunks are compared.
+    """
+    assert [score for _, score in other.query(query, TOP_K)] == \
+        pytest.approx([score for _, score in engine.query(query, TOP_K)])
+    scores: Dict[str, float] = dict(_hits(engine.query(query)))
+    assert dict(_hits(other.query(query))) == pytest.approx(scores)
+
+
+def _avgdl(documents) -> float:
+    """Returns the mean chunk length."""
+    return sum(document.doc_len for document in documents) / len(documents)
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory) -> Dict[str, str]:
+    """A synthetic corpus with its in-memory build written as a memory-mapped index."""
+    base: str = str(tmp_path_factory.mktemp("corpus"))
+    paths: Dict[str, str] = {"input_dir": os.path.join(base, "data"), "output_dir": os.path.join(base, "out"),
+                             "index_file": os.path.join(base, "retriever.bm25idx"),
+                             "retriever_file": os.path.join(base, "retriever.pkl")}
+    os.makedirs(paths["input_dir"])
+    generate_corpus(paths["output_dir"], NUM_FILES, NUM_SECTIONS, vocab_size=VOCAB_SIZE, seed=0)
+    documents, _, inverted_index = build_document_index(paths["input_dir"], paths["output_dir"])
+    write_mmap_index(paths["index_file"], documents, _avgdl(documents), inverted_index, k1, b)
+    build_toc_store(paths["output_dir"], sorted({document.metadata["filename"] for document in documents}),
+                    paths["index_file"])
+    return paths
+
+
+@pytest.fixture(scope="module")
+def queries() -> List[str]:
+    """Queries of 1 to 8 terms drawn from the corpus word distribution."""
+    return [query for num_terms in (1, 2, 4, 8) for query in generate_queries(5, num_terms, VOCAB_SIZE, seed=1)]
+
+
+def _engine(corpus: Dict[str, str], index_file: Optional[str] = None, shards: int = 0) -> BM25Engine:
+    """Opens an engine on the corpus index or on another index of its chunks, without result cache."""
+    return BM25Engine(corpus["retriever_file"], corpus["output_dir"], index_file=index_file or corpus["index_file"],
+                      cache_size=0, reload_interval=0, shards=shards)
+
+
+def test_wand_equals_exhaustive(corpus, queries):
+    engine = _engine(corpus)
+    try:
+        for query in queries:
+            for top_k in (1, TOP_K):
+                assert _hits(engine.query(query, top_k, mode="wand")) == _hits(engine.query(query, top_k))
+    finally:
+        engine.close()
+
+
+def test_batch_equals_single_queries(corpus, queries):
+    engine = _engine(corpus)
+    try:
+        for query, batch_hits in zip(queries, engine.query_batch(queries, TOP_K)):
+            _assert_same_ranking(_hits(batch_hits), _hits(engine.query(query, TOP_K)))
+    finally:
+        engine.close()
+
+
+def test_sharded_equals_unsharded(corpus, queries):
+    engine = _engine(corpus)
+    sharded = _engine(corpus, shards=2)
+    try:
+        assert sharded.state.sharded is not None
+        for query in queries:
+            assert _hits(sharded.query(query, TOP_K)) == _hits(engine.query(query, TOP_K))
+            assert _hits(sharded.query(query)) == _hits(engine.query(query))
+    finally:
+        sharded.close()
+        engine.close()
+
+
+def test_streaming_equals_in_memory_build(corpus, queries, tmp_path):
+    index_file: str = str(tmp_path / "streaming.bm25idx")
+    build_streaming_index(corpus["input_dir"], corpus["output_dir"], index_file, k1, b, memory_budget_mb=1)
+    streamed, in_memory = MmapIndex(index_file), MmapIndex(corpus["index_file"])
+    try:
+        assert (streamed.N, streamed.avgdl) == (in_memory.N, pytest.approx(in_memory.avgdl))
+    finally:
+        streamed.close()
+        in_memory.close()
+    engine, streaming_engine = _engine(corpus), _engine(corpus, index_file)
+    try:
+        for query in queries:
+            _assert_same_scores(engine, streaming_engine, query)
+    finally:
+        streaming_engine.close()
+        engine.close()
+
+
+def _postings(documents, inverted_index) -> Dict[str, List[Tuple[str, int]]]:
+    """Returns the postings keyed by chunk text instead of chunk id, which depends on the build order."""
+    return {term: sorted((documents[chunk_id].chunk_content, tf) for chunk_id, tf in postings)
+            for term, postings in inverted_index.items()}
+
+
+def test_incremental_update_equals_full_rebuild(tmp_path):
+    input_dir, output_dir = str(tmp_path / "data"), str(tmp_path / "out")
+    os.makedirs(input_dir)
+    paths: List[str] = generate_corpus(output_dir, NUM_FILES, NUM_SECTIONS, vocab_size=VOCAB_SIZE, seed=0)
+    documents, term_frequency, inverted_index = build_document_index(input_dir, output_dir)
+    manifest = build_manifest(input_dir, output_dir, documents)
+
+    os.remove(paths[0])
+    added: List[str] = generate_corpus(str(tmp_path / "new"), 1, NUM_SECTIONS, vocab_size=VOCAB_SIZE, seed=7)
+    shutil.copy(added[0], os.path.join(output_dir, "added.md"))
+    documents, term_frequency, inverted_index, _ = update_document_index(
+        input_dir, output_dir, documents, term_frequency, inverted_index, manifest)
+    rebuilt_documents, rebuilt_term_frequency, rebuilt_inverted_index = build_document_index(input_dir, output_dir)
+
+    assert term_frequency == rebuilt_term_frequency
+    assert sorted(document.chunk_content for document in documents) == \
+        sorted(document.chunk_content for document in rebuilt_documents)
+    assert _postings(documents, inverted_index) == _postings(rebuilt_documents, rebuilt_inverted_index)
+
+
+def test_legacy_pickle_conversion_keeps_avgdl(corpus, queries, tmp_path):
+    documents, term_frequency, _ = build_document_index(corpus["input_dir"], corpus["output_dir"])
+    retriever_file: str = str(tmp_path / "legacy.pkl")
+    # The retriever files of the first releases stored the total chunk length as avgdl.
+    with open(retriever_file, "wb") as file:
+        pickle.dump({"documents": documents, "avgdl": sum(document.doc_len for document in documents),
+                     "N": len(documents), "term_document_freq": term_frequency}, file)
+    index_file: str = str(tmp_path / "legacy.bm25idx")
+    convert_pickle_to_mmap(retriever_file, index_file, k1, b)
+    index = MmapIndex(index_file)
+    try:
+        assert index.avgdl == pytest.approx(_avgdl(documents))
+    finally:
+        index.close()
+    engine, converted_engine = _engine(corpus), _engine(corpus, index_file)
+    try:
+        for query in queries:
+            _assert_same_scores(engine, converted_engine, query)
+    finally:
+        converted_engine.close()
+        engine.close()